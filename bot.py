@@ -16,11 +16,12 @@ import os
 from threading import Thread
 import signal
 import logging
-from flask import Flask
+from flask import Flask, jsonify
 
 import yolab_quote as yq
 from yolab_quote import QuoteClient
 
+import market
 import reliability
 
 logging.basicConfig(
@@ -35,7 +36,88 @@ readiness = reliability.ReadinessState()
 # 行情來源：yfinance 優先、Yahoo JSON 端點備援（兩者無共用程式路徑，
 # 其中一個掛掉不會連帶失效）。30 秒報價快取讓 !market 這類一次查多檔的
 # 指令不會重複打同一個端點。
-_quotes = QuoteClient(ttl=30, max_workers=8)
+QUOTE_CACHE_TTL = 30
+_quotes = QuoteClient(ttl=QUOTE_CACHE_TTL, max_workers=8)
+
+# 熱路徑改走原生 asyncio 用戶端：共用一個 aiohttp 連線池（keep-alive、每主機
+# 連線上限、DNS 快取），一次 chart 請求同時拿到報價與日 K，不經過 worker
+# thread。上游失敗（「查無此代碼」除外）時退回上面的 yolab-quote。
+_yahoo = market.YahooClient(limit=32, limit_per_host=8, dns_ttl=300)
+
+# chart 端點沒有本益比、殖利率等基本面；這些一天內變動不大，另外用
+# yolab-quote 取一次並快取 FUNDAMENTALS_TTL 秒，失敗時短暫快取空值。
+FUNDAMENTALS_TTL = 6 * 3600
+_fundamentals = market.TTLCache(maxsize=512, ttl=FUNDAMENTALS_TTL)
+
+# 快取 TTL 依交易時段決定：盤中 QUOTE_CACHE_TTL 秒，收盤後（含週末與
+# MARKET_HOLIDAYS 設定的休市日）快取到下次開盤，半夜不再每 30 秒重抓日經。
+_ttl_policy = market.SessionTTLPolicy(
+    open_ttl=QUOTE_CACHE_TTL,
+    holidays=market.parse_holidays(os.environ.get('MARKET_HOLIDAYS')),
+)
+
+# 組好的 get_stock_info 結果另存一份（以查詢代碼為 key），多檔指令先查這裡，
+# 只有真的過期的代碼才送上游。過期後 QUOTE_STALE_GRACE 秒內仍先回舊值
+# （嵌入訊息會標示資料時間），同時在背景更新一次；背景更新失敗就繼續回
+# 舊值，直到寬限期結束。設為 0 可停用。
+QUOTE_STALE_GRACE = float(os.environ.get('QUOTE_STALE_GRACE', '300'))
+_info_cache = market.TTLCache(maxsize=512, ttl=QUOTE_CACHE_TTL, stale_ttl=QUOTE_STALE_GRACE)
+_revalidations: dict = {}
+
+# 同一時間對同一代碼（與參數）的查詢只送一次上游，其餘等同一個結果。
+# 大伺服器一有新聞就幾十人同時 !stock 2330，快取還沒填好前全部 miss 是 429 的主因。
+_inflight = market.SingleFlight()
+
+# 日 K 存在本機 SQLite（以 symbol + date 為鍵）：已收盤的 K 棒不會再變，
+# 每檔第一次抓滿 63 根，之後只補最後一筆之後的部分；15 分鐘內不重複同步。
+# 檔案只是快取，遺失（例如 Render 重新部署）時會自動重建。
+_bar_store = market.BarStore(
+    os.environ.get('BAR_STORE_PATH', 'data/market_bars.db'),
+    depth=63,
+    max_age=15 * 60,
+)
+
+# 三個月高低與均量的增量統計：已收盤的日 K 每小時最多補一次，今天的高低量
+# 直接用即時報價帶入，所以快取命中時一次查詢只需要一個報價請求。
+_three_month_stats = market.RollingStatsBook(window=63, refresh_interval=3600)
+
+# 多檔查詢（!market 等）並行抓取：同時最多幾檔、每檔最多等幾秒。
+# 逾時的那檔直接略過，其餘照常顯示，整體延遲約等於最慢的單檔而非總和。
+QUOTE_FANOUT_LIMIT = 6
+QUOTE_FANOUT_TIMEOUT = 10.0
+
+# 多檔指令先送出占位嵌入訊息，每收到一檔就更新同一則訊息，不再等最慢的
+# 那檔。編輯至少間隔 PROGRESSIVE_EDIT_INTERVAL 秒（Discord 對訊息編輯有
+# 速率限制），期間到達的多檔合併成一次編輯。
+PROGRESSIVE_EDIT_INTERVAL = 1.0
+
+# 對照表查不到時的線上搜尋（Yahoo）最多等幾秒；逾時視為查無結果。
+SYMBOL_SEARCH_TIMEOUT = 5.0
+
+# 線上搜尋結果依正規化後的查詢字串快取：查到的記 12 小時，查無結果記 5 分鐘。
+# 解析時搜過的字串，指令內的第二次備援搜尋會直接命中這裡。
+_resolution_cache = market.ResolutionCache(maxsize=2048, positive_ttl=12 * 3600, negative_ttl=300)
+
+# !market / /market 顯示的主要指數（代碼, 顯示名稱）
+MARKET_INDICES = [
+    ('^GSPC', 'S&P 500'),
+    ('^DJI', '道瓊工業'),
+    ('^IXIC', '那斯達克'),
+    ('^TWII', '台灣加權'),
+    ('^HSI', '恆生指數'),
+    ('^N225', '日經 225'),
+]
+
+# 背景預取的熱門代碼（逗號分隔，預設為上面的指數；設為空字串可停用）與週期。
+# 週期要短於 QUOTE_CACHE_TTL，快取才不會在兩次預取之間過期。
+PREFETCH_SYMBOLS = [
+    symbol.strip()
+    for symbol in os.environ.get(
+        'PREFETCH_SYMBOLS', ','.join(symbol for symbol, _ in MARKET_INDICES)
+    ).split(',')
+    if symbol.strip()
+]
+PREFETCH_INTERVAL = float(os.environ.get('PREFETCH_INTERVAL', '20'))
 
 # ===== Flask 保活 / 健康檢查 =====
 app = Flask(__name__)
@@ -57,6 +139,11 @@ def live():
     """liveness：行程存活即回 200（Flask 能回應代表行程還活著）。"""
     return "OK", 200
 
+@app.route('/metrics/prefetch')
+def prefetch_metrics():
+    """背景預取的執行次數、耗時與失敗計數（不含代碼以外的任何資料）。"""
+    return jsonify(_prefetcher.stats())
+
 def run_flask():
     port = int(os.environ.get('PORT', 10000))
     app.run(host='0.0.0.0', port=port)
@@ -104,6 +191,7 @@ async def setup_hook():
         logger.error("資料層初始化失敗（%s）", type(exc).__name__)
         raise
     await load_cogs()
+    _prefetcher.start()
 
 # ===== 台股代碼對應中文名稱 =====
 # 中文名稱對照表已移入 yolab-quote。該套件的內建表合併了本專案原本的
@@ -144,21 +232,38 @@ def get_tw_stock_chinese_name(symbol: str) -> Optional[str]:
     return yq.get_name(symbol)
 
 
-def search_stock_by_name(query: str) -> Optional[str]:
-    """線上搜尋股票，返回最匹配的代碼。
+async def _search_symbols(query: str, limit: int) -> list:
+    """線上搜尋：原生用戶端優先，上游失敗時改在 worker thread 走 yolab-quote。"""
+    try:
+        return await _yahoo.search(query, limit)
+    except market.YahooError as exc:
+        logger.warning("原生搜尋失敗（%s），改走 yolab-quote", type(exc).__name__)
+        return await asyncio.to_thread(_quotes.search, query, limit)
+
+
+async def search_stock_by_name_async(query: str) -> Optional[str]:
+    """線上搜尋股票，返回最匹配的代碼：走原生用戶端並套逾時。
 
-    改用 yolab-quote 的 search_symbols()，行為與原本相同（同一個 Yahoo
-    端點），但逾時與錯誤處理由套件統一負責。
+    結果（包含查無結果）寫入 _resolution_cache；逾時與上游錯誤屬暫時性，
+    不寫入快取。
     """
+    hit, symbol = _resolution_cache.lookup(query)
+    if hit:
+        return symbol
     try:
-        results = yq.search_symbols(query, limit=1)
+        results = await asyncio.wait_for(_search_symbols(query, 1), SYMBOL_SEARCH_TIMEOUT)
+    except TimeoutError:
+        logger.warning("線上搜尋逾時（%.1f 秒）", SYMBOL_SEARCH_TIMEOUT)
+        return None
     except yq.QuoteError as exc:
-        print(f"Search error: {exc}")
+        logger.warning("線上搜尋失敗（%s）", type(exc).__name__)
         return None
-    return results[0].symbol if results else None
+    symbol = results[0].symbol if results else None
+    _resolution_cache.store(query, symbol)
+    return symbol
 
 
-def resolve_stock_symbol(user_input: str) -> Tuple[str, str]:
+async def resolve_stock_symbol(user_input: str) -> Tuple[str, str]:
     """
     解析使用者輸入，返回 (股票代碼, 解析說明)
     
@@ -166,6 +271,10 @@ def resolve_stock_symbol(user_input: str) -> Tuple[str, str]:
     1. 純數字（如 2330）-> 視為台股，自動加 .TW
     2. 股票名稱（如 nvidia）-> 從對照表或搜尋找代碼
     3. 完整代碼（如 AAPL, 2330.TW）-> 直接使用
+
+    本機對照表直接在 event loop 上查（純記憶體運算）；只有查不到時才走
+    線上搜尋：用原生 aiohttp 用戶端（_yahoo），受 SYMBOL_SEARCH_TIMEOUT 限制，
+    上游失敗時才改在 worker thread 走 yolab-quote。
     """
     user_input = user_input.strip()
     if not user_input:
@@ -179,14 +288,27 @@ def resolve_stock_symbol(user_input: str) -> Tuple[str, str]:
         return resolved, None
 
     # 對照表查不到才走線上搜尋。
-    print(f"Searching online for: {user_input}")
-    search_result = search_stock_by_name(user_input)
+    logger.info("對照表查無結果，改走線上搜尋")
+    search_result = await search_stock_by_name_async(user_input)
     if search_result:
         return search_result, None
 
     return user_input.upper(), None
 
 
+def _load_bars(symbol: str, days: int) -> list:
+    """從本機日 K 儲存讀最近 days 根，必要時先向上游補抓增量。
+
+    上游失敗但本機已有資料時沿用本機資料；都沒有才拋出 QuoteError。
+    """
+    bars = _bar_store.sync(
+        symbol,
+        lambda count: _quotes.get_bars(symbol, count),
+        max_age=max(_bar_store.max_age, _ttl_policy.ttl(symbol)),
+    )
+    return bars[-days:]
+
+
 def _load_history(symbol: str, days: int) -> Tuple[list, Optional[str], str]:
     """取得日 K，連同顯示用的名稱與幣別。
 
@@ -195,7 +317,7 @@ def _load_history(symbol: str, days: int) -> Tuple[list, Optional[str], str]:
     拿不到就退回代碼與 USD，不讓它擋住歷史資料本身。
     """
     try:
-        bars = _quotes.get_bars(symbol, days)
+        bars = _load_bars(symbol, days)
     except yq.QuoteError:
         return [], None, 'USD'
 
@@ -210,55 +332,458 @@ def _load_history(symbol: str, days: int) -> Tuple[list, Optional[str], str]:
     return bars, name, currency
 
 
+async def _load_bars_async(symbol: str, days: int) -> list:
+    """_load_bars 的原生 asyncio 版本：增量補抓走 _yahoo，本機讀寫丟到 worker thread。"""
+    bars = await _bar_store.async_sync(
+        symbol,
+        lambda count: _yahoo.bars(symbol, count),
+        max_age=max(_bar_store.max_age, _ttl_policy.ttl(symbol)),
+    )
+    return bars[-days:]
+
+
+async def _load_history_async(symbol: str, days: int) -> Tuple[list, Optional[str], str]:
+    """_load_history 的原生 asyncio 版本；上游失敗時退回 worker thread 版本。
+
+    名稱與幣別取自 fetch_stock_info（走 _info_cache，通常不會多打一次網路）。
+    """
+    try:
+        bars = await _load_bars_async(symbol, days)
+    except market.SymbolNotFound:
+        return [], None, 'USD'
+    except market.YahooError as exc:
+        logger.warning("原生日 K 失敗（%s：%s），改走 yolab-quote", symbol, type(exc).__name__)
+        return await asyncio.to_thread(_load_history, symbol, days)
+
+    name = symbol
+    currency = 'USD'
+    data = await fetch_stock_info(symbol)
+    if data:
+        name = data['name']
+        currency = data['currency']
+    return bars, name, currency
+
+
+def _stock_info_from(quote, extra: dict, stats) -> dict:
+    """把報價（yolab-quote 或 market.Quote）、基本面與三個月統計組成顯示用的 dict。"""
+    three_month_high, three_month_low, avg_volume = stats
+
+    # 優先顯示中文名稱；套件的對照表同時涵蓋台股與美股。
+    name = yq.get_name(quote.symbol) or quote.name or quote.symbol
+
+    return {
+        'symbol': quote.symbol,
+        'name': name,
+        'currency': quote.currency or 'USD',
+        'open': quote.open,
+        'high': quote.high,
+        'low': quote.low,
+        'close': quote.price,
+        'volume': quote.volume,
+        'change': quote.change,
+        'change_percent': quote.change_percent,
+        'market_cap': extra.get('market_cap'),
+        'pe_ratio': extra.get('pe_ratio'),
+        'three_month_high': three_month_high,
+        'three_month_low': three_month_low,
+        'avg_volume': avg_volume,
+        # 已是百分比（套件負責換算），顯示時不可再乘 100。
+        'dividend_yield': extra.get('dividend_yield'),
+        'sector': extra.get('sector', 'N/A'),
+        'industry': extra.get('industry', 'N/A'),
+    }
+
+
 def get_stock_info(symbol: str) -> dict:
-    """獲取股票資訊"""
+    """獲取股票資訊（yolab-quote 同步版本，原生用戶端失敗時的備援）"""
     try:
         quote = _quotes.get_quote(symbol)
 
-        # 三個月高低與均量：用套件的日 K 計算（約 63 個交易日）。
-        three_month_high = None
-        three_month_low = None
-        avg_volume = None
-        try:
-            bars = _quotes.get_bars(symbol, 63)
-        except yq.QuoteError:
-            bars = []          # 拿不到歷史不影響即時報價，欄位留 None
-        if bars:
-            three_month_high = max(bar.high for bar in bars)
-            three_month_low = min(bar.low for bar in bars)
-            volumes = [bar.volume for bar in bars if bar.volume is not None]
-            if volumes:
-                avg_volume = sum(volumes) / len(volumes)
-
-        # 優先顯示中文名稱；套件的對照表同時涵蓋台股與美股。
-        name = yq.get_name(quote.symbol) or quote.name or quote.symbol
-
-        return {
-            'symbol': quote.symbol,
-            'name': name,
-            'currency': quote.currency or 'USD',
-            'open': quote.open,
-            'high': quote.high,
-            'low': quote.low,
-            'close': quote.price,
-            'volume': quote.volume,
-            'change': quote.change,
-            'change_percent': quote.change_percent,
-            'market_cap': quote.extra.get('market_cap'),
-            'pe_ratio': quote.extra.get('pe_ratio'),
-            'three_month_high': three_month_high,
-            'three_month_low': three_month_low,
-            'avg_volume': avg_volume,
-            # 已是百分比（套件負責換算），顯示時不可再乘 100。
-            'dividend_yield': quote.extra.get('dividend_yield'),
-            'sector': quote.extra.get('sector', 'N/A'),
-            'industry': quote.extra.get('industry', 'N/A'),
-        }
+        # 三個月高低與均量（約 63 個交易日）：已收盤部分來自增量統計，
+        # 今天的部分用這次報價；拿不到歷史不影響即時報價，欄位留 None。
+        stats = _three_month_stats.snapshot(
+            symbol,
+            lambda: _load_bars(symbol, 63),
+            live_high=quote.high,
+            live_low=quote.low,
+            live_volume=quote.volume,
+        )
+        return _stock_info_from(quote, quote.extra, stats)
     except Exception as e:
         print(f"Error fetching stock info: {e}")
         return None
 
 
+async def _get_fundamentals(symbol: str) -> dict:
+    """基本面（本益比、殖利率、市值、產業），快取 FUNDAMENTALS_TTL 秒；不會拋例外。"""
+    cached = _fundamentals.get(symbol)
+    if cached is not None:
+        return cached
+    try:
+        quote = await asyncio.to_thread(_quotes.get_quote, symbol)
+    except Exception as exc:
+        logger.warning("基本面取得失敗（%s：%s）", symbol, type(exc).__name__)
+        _fundamentals.set(symbol, {}, ttl=10 * 60)
+        return {}
+    extra = dict(quote.extra)
+    _fundamentals.set(symbol, extra)
+    return extra
+
+
+async def get_stock_info_async(symbol: str) -> Optional[dict]:
+    """獲取股票資訊（原生 asyncio 熱路徑）。
+
+    報價走一次 chart 請求；基本面與三個月統計各自有快取，通常不產生額外請求。
+    查無此代碼回傳 None；其他上游錯誤改走 get_stock_info。
+    """
+    # 基本面與報價並行；報價沒成功（查無代碼、上游錯誤、呼叫端取消）就取消
+    # 基本面查詢，不替不存在的代碼快取空結果
+    fundamentals = asyncio.ensure_future(_get_fundamentals(symbol))
+    quote = None
+    try:
+        quote = await _yahoo.quote(symbol)
+    except market.SymbolNotFound:
+        _fundamentals.pop(symbol)
+        return None
+    except market.YahooError as exc:
+        logger.warning("原生報價失敗（%s：%s），改走 yolab-quote", symbol, type(exc).__name__)
+        return await asyncio.to_thread(get_stock_info, symbol)
+    finally:
+        if quote is None:
+            fundamentals.cancel()
+    # 交易時段以報價回應的交易所為準（加密貨幣、外匯、期貨沒有收盤）
+    _ttl_policy.learn(symbol, quote.exchange, quote.instrument_type)
+    extra = await fundamentals
+
+    stats = await _three_month_stats.async_snapshot(
+        symbol,
+        lambda: _load_bars_async(symbol, 63),
+        live_high=quote.high,
+        live_low=quote.low,
+        live_volume=quote.volume,
+    )
+    return _stock_info_from(quote, extra, stats)
+
+
+async def _fetch_and_cache(symbol: str) -> Optional[dict]:
+    """向上游取得單檔資訊（同代碼共用進行中的請求），成功就寫回快取。"""
+    data = await _inflight.do(('info', symbol), lambda: get_stock_info_async(symbol))
+    if data is not None:
+        _info_cache.set(symbol, data, ttl=_ttl_policy.ttl(symbol))
+    return data
+
+
+async def _revalidate(symbol: str) -> None:
+    try:
+        data = await asyncio.wait_for(_fetch_and_cache(symbol), QUOTE_FANOUT_TIMEOUT)
+        if data is None:
+            logger.warning("背景更新查無資料（%s），沿用舊值", symbol)
+    except Exception as exc:
+        logger.warning("背景更新失敗（%s：%s），沿用舊值", symbol, type(exc).__name__)
+
+
+def _schedule_revalidation(symbol: str) -> None:
+    """每個代碼同時最多一個背景更新。"""
+    if symbol in _revalidations:
+        return
+    task = asyncio.get_running_loop().create_task(_revalidate(symbol))
+    _revalidations[symbol] = task
+    task.add_done_callback(lambda _: _revalidations.pop(symbol, None))
+
+
+async def get_stock_info_many(symbols, force: bool = False, on_result=None) -> Tuple[dict, dict]:
+    """一次取得多檔股票資訊，回傳 (results, errors)，兩者都以代碼為 key。
+
+    重複代碼只查一次；30 秒內查過的直接從 _info_cache 回傳，其餘一起送出
+    （同時最多 QUOTE_FANOUT_LIMIT 檔、每檔最多等 QUOTE_FANOUT_TIMEOUT 秒），
+    成功的逐檔寫回快取。查不到記為 LookupError，逾時為 TimeoutError。
+    chart 端點一次只查一檔，無法把多檔併成一個上游請求；批次的效益來自
+    去重、快取與共用連線池，多檔指令都應該走這個入口。
+    已過期但仍在 QUOTE_STALE_GRACE 內的項目直接回傳（附 stale_seconds），
+    並排程背景更新。force=True 時略過快取讀取（背景預取用），結果仍會寫回快取。
+    on_result(symbol, data) 在每檔拿到資料時呼叫（快取命中的立即呼叫），
+    供漸進式顯示使用。
+    """
+    symbols = list(dict.fromkeys(symbols))
+    results = {}
+    misses = []
+    for symbol in symbols:
+        entry = None if force else _info_cache.peek(symbol)
+        if entry is None:
+            misses.append(symbol)
+        elif entry.fresh:
+            results[symbol] = entry.value
+        else:
+            results[symbol] = dict(entry.value, stale_seconds=int(entry.age))
+            _schedule_revalidation(symbol)
+        if symbol in results and on_result is not None:
+            on_result(symbol, results[symbol])
+
+    async def fetch(symbol: str) -> Optional[dict]:
+        data = await _fetch_and_cache(symbol)
+        if data is not None and on_result is not None:
+            on_result(symbol, data)
+        return data
+
+    fetched, errors = await market.gather_bounded(
+        misses,
+        fetch,
+        limit=QUOTE_FANOUT_LIMIT,
+        timeout=QUOTE_FANOUT_TIMEOUT,
+    )
+    for symbol, data in fetched.items():
+        if data is None:
+            errors[symbol] = LookupError(symbol)
+        else:
+            results[symbol] = data
+    for symbol, exc in errors.items():
+        if not isinstance(exc, LookupError):
+            logger.warning("報價取得失敗（%s：%s）", symbol, type(exc).__name__)
+
+    # 依呼叫端給的順序回傳
+    ordered = {symbol: results[symbol] for symbol in symbols if symbol in results}
+    return ordered, errors
+
+
+def staleness_note(*datas) -> str:
+    """有任何一筆是過期快取時，回傳附在 footer 的資料時間說明。"""
+    ages = [data['stale_seconds'] for data in datas if data and 'stale_seconds' in data]
+    if not ages:
+        return ""
+    return f"｜資料為 {max(ages)} 秒前（更新中）"
+
+
+async def _refresh_hot_symbols(symbols) -> dict:
+    """背景預取：強制重抓盤中的熱門代碼寫回快取，回傳個別代碼的錯誤。
+
+    休市中的代碼不強制重抓，只在快取不存在時補一次（收盤後會快取到下次開盤）。
+    """
+    trading = [symbol for symbol in symbols if _ttl_policy.is_open(symbol)]
+    closed = [symbol for symbol in symbols if symbol not in trading]
+    _, errors = await get_stock_info_many(trading, force=True)
+    _, closed_errors = await get_stock_info_many(closed)
+    errors.update(closed_errors)
+    return errors
+
+
+_prefetcher = market.Prefetcher(PREFETCH_SYMBOLS, _refresh_hot_symbols, interval=PREFETCH_INTERVAL)
+
+
+async def fetch_history(symbol: str, days: int) -> Tuple[list, Optional[str], str]:
+    """取得日 K 與顯示用名稱、幣別；同時的相同查詢共用一次請求。"""
+    return await _inflight.do(('history', symbol, days), lambda: _load_history_async(symbol, days))
+
+
+async def fetch_stock_info(symbol: str) -> Optional[dict]:
+    """單檔版本的 get_stock_info_many；查不到回傳 None。"""
+    results, _ = await get_stock_info_many([symbol])
+    return results.get(symbol)
+
+
+async def fetch_compare_data(queries, on_row=None) -> list:
+    """解析多個查詢並批次取得資料，回傳 [(query, data 或 None)]。
+
+    第一輪查不到的查詢改走線上搜尋（解析時搜過的會命中 _resolution_cache），
+    只有搜到不同代碼的才再批次查一次。on_row(query, data) 在每個查詢拿到
+    資料時呼叫；查不到的不呼叫，以回傳值為準。
+    """
+    resolved = await asyncio.gather(*(resolve_stock_symbol(query) for query in queries))
+    symbols = {query: symbol for query, (symbol, _) in zip(queries, resolved)}
+
+    def report(symbol: str, data: dict) -> None:
+        if on_row is None:
+            return
+        for query in symbols:
+            if symbols[query] == symbol:
+                on_row(query, data)
+
+    results, _ = await get_stock_info_many(symbols.values(), on_result=report)
+
+    missing = [query for query in queries if symbols[query] not in results]
+    if missing:
+        searched = await asyncio.gather(
+            *(search_stock_by_name_async(query) for query in missing)
+        )
+        retry_symbols = []
+        for query, search_result in zip(missing, searched):
+            if search_result and search_result != symbols[query]:
+                symbols[query] = search_result
+                retry_symbols.append(search_result)
+        if retry_symbols:
+            retry, _ = await get_stock_info_many(retry_symbols, on_result=report)
+            results.update(retry)
+
+    return [(query, results.get(symbols[query])) for query in queries]
+
+
+# 漸進式顯示中尚未拿到資料的占位值（與「查不到」的 None 區分）
+PENDING = object()
+
+
+def add_compare_field(embed: discord.Embed, query: str, data: Optional[dict]) -> None:
+    """在比較嵌入訊息加上一檔股票的欄位；data 為 None 時顯示找不到。"""
+    if data:
+        change_emoji = get_change_emoji(data['change'])
+        currency = data['currency']
+        value = (
+            f"💰 價格: **{format_number(data['close'])} {currency}**\n"
+            f"{change_emoji} 漲跌: {'+' if data['change'] >= 0 else ''}{format_number(data['change'])} {currency} "
+            f"({'+' if data['change_percent'] >= 0 else ''}{data['change_percent']:.2f}%)\n"
+            f"📦 成交量: {format_number(data['volume'], 0)}\n"
+            f"📊 本益比: {format_number(data['pe_ratio']) if data['pe_ratio'] else 'N/A'}"
+        )
+        embed.add_field(
+            name=f"{data['symbol']} - {data['name'][:20]}",
+            value=value,
+            inline=True
+        )
+    else:
+        embed.add_field(
+            name=f"❌ {query}",
+            value="找不到此股票",
+            inline=True
+        )
+
+
+def create_market_embed(results: dict, pending=()) -> discord.Embed:
+    """依 MARKET_INDICES 順序組出指數嵌入訊息；pending 中的顯示讀取中，
+    其餘沒拿到資料的指數略過。"""
+    embed = discord.Embed(
+        title="🌍 全球主要市場指數",
+        color=discord.Color.gold(),
+        timestamp=datetime.now()
+    )
+
+    for symbol, name in MARKET_INDICES:
+        data = results.get(symbol)
+        if data:
+            change_emoji = get_change_emoji(data['change'])
+            value = (
+                f"💰 **{format_number(data['close'])}**\n"
+                f"{change_emoji} {'+' if data['change'] >= 0 else ''}{format_number(data['change'])} "
+                f"({'+' if data['change_percent'] >= 0 else ''}{data['change_percent']:.2f}%)"
+            )
+            embed.add_field(name=f"📊 {name}", value=value, inline=True)
+        elif symbol in pending:
+            embed.add_field(name=f"📊 {name}", value="⏳ 讀取中…", inline=True)
+
+    embed.set_footer(
+        text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}{staleness_note(*results.values())}"
+    )
+    return embed
+
+
+def create_compare_embed(rows) -> discord.Embed:
+    """比較嵌入訊息；rows 為 [(query, data)]，data 為 PENDING 時顯示讀取中。"""
+    embed = discord.Embed(
+        title="📊 股票比較",
+        color=discord.Color.blue(),
+        timestamp=datetime.now()
+    )
+    for query, data in rows:
+        if data is PENDING:
+            embed.add_field(name=f"⏳ {query}", value="讀取中…", inline=True)
+        else:
+            add_compare_field(embed, query, data)
+
+    embed.set_footer(
+        text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}"
+        f"{staleness_note(*(data for _, data in rows if data is not PENDING))}"
+    )
+    return embed
+
+
+class ProgressiveReply:
+    """先送出占位嵌入訊息，之後隨資料抵達節流編輯同一則訊息。
+
+    render() 每次依當下狀態重畫完整的嵌入訊息。send 為 ctx.send 或
+    followup.send（需 wait=True 才拿得到可編輯的訊息）。沒呼叫 start()
+    就 finish() 時只送一次完整訊息（例如全部命中快取）。
+    """
+
+    def __init__(self, send, render):
+        self._send = send
+        self._render = render
+        self._message = None
+        self._shown = None
+        self._editor = market.ThrottledEditor(self._edit, min_interval=PROGRESSIVE_EDIT_INTERVAL)
+
+    @staticmethod
+    def _content(embed: discord.Embed) -> dict:
+        content = embed.to_dict()
+        content.pop('timestamp', None)
+        return content
+
+    async def _edit(self):
+        embed = self._render()
+        content = self._content(embed)
+        if content == self._shown:
+            return  # 內容沒變就不浪費一次編輯額度
+        await self._message.edit(embed=embed)
+        self._shown = content
+
+    async def start(self):
+        embed = self._render()
+        self._message = await self._send(embed=embed)
+        self._shown = self._content(embed)
+        self._editor.touch()
+
+    def update(self):
+        if self._message is not None:
+            self._editor.request()
+
+    async def finish(self):
+        if self._message is None:
+            await self._send(embed=self._render())
+            return
+        self._editor.request()
+        await self._editor.flush()
+
+
+async def send_market_embed(send) -> None:
+    """!market 與 /market 共用：全部命中快取時直接送出，否則先送占位訊息再逐檔更新。"""
+    symbols = [symbol for symbol, _ in MARKET_INDICES]
+    results = {}
+    pending = set(symbols)
+    for symbol in symbols:
+        entry = _info_cache.peek(symbol)
+        if entry is not None:
+            results[symbol] = entry.value
+            pending.discard(symbol)
+
+    reply = ProgressiveReply(send, lambda: create_market_embed(results, pending))
+    if pending:
+        await reply.start()
+
+    def on_result(symbol, data):
+        results[symbol] = data
+        pending.discard(symbol)
+        reply.update()
+
+    final, _ = await get_stock_info_many(symbols, on_result=on_result)
+    results.clear()
+    results.update(final)
+    pending.clear()
+    await reply.finish()
+
+
+async def send_compare_embed(send, queries) -> None:
+    """!compare 與 /compare 共用：先送出每檔「讀取中」的占位訊息，再逐檔更新。"""
+    rows = [[query, PENDING] for query in queries]
+    reply = ProgressiveReply(send, lambda: create_compare_embed(rows))
+    await reply.start()
+
+    def on_row(query, data):
+        for row in rows:
+            if row[0] == query:
+                row[1] = data
+        reply.update()
+
+    compared = await fetch_compare_data(queries, on_row=on_row)
+    rows[:] = [[query, data] for query, data in compared]
+    await reply.finish()
+
+
 def create_stock_embed(data: dict, resolve_msg: str = None) -> discord.Embed:
     """創建股票資訊嵌入訊息"""
     change_emoji = get_change_emoji(data['change'])
@@ -364,8 +889,8 @@ def create_stock_embed(data: dict, resolve_msg: str = None) -> discord.Embed:
     embed.add_field(name="\u200b", value="\u200b", inline=True)
     
     # 不顯示產業資訊
-    # 不顯示資料來源，只顯示查詢日期
-    embed.set_footer(text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}")
+    # 不顯示資料來源，只顯示查詢日期（過期快取另註明資料時間）
+    embed.set_footer(text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}{staleness_note(data)}")
     
     return embed
 
@@ -436,17 +961,17 @@ async def stock_command(ctx, *, query: str):
     """
     async with ctx.typing():
         # 解析使用者輸入
-        symbol, resolve_msg = resolve_stock_symbol(query)
+        symbol, resolve_msg = await resolve_stock_symbol(query)
         
-        data = await asyncio.to_thread(get_stock_info, symbol)
+        data = await fetch_stock_info(symbol)
         
         if data is None:
             # 如果第一次找不到，嘗試線上搜尋
-            search_result = await asyncio.to_thread(search_stock_by_name, query)
+            search_result = await search_stock_by_name_async(query)
             if search_result and search_result != symbol:
                 symbol = search_result
                 resolve_msg = None
-                data = await asyncio.to_thread(get_stock_info, symbol)
+                data = await fetch_stock_info(symbol)
         
         if data is None:
             await ctx.send(
@@ -469,17 +994,17 @@ async def stock_slash(interaction: discord.Interaction, query: str):
     await interaction.response.defer()
     
     # 解析使用者輸入
-    symbol, resolve_msg = resolve_stock_symbol(query)
+    symbol, resolve_msg = await resolve_stock_symbol(query)
     
-    data = await asyncio.to_thread(get_stock_info, symbol)
+    data = await fetch_stock_info(symbol)
     
     if data is None:
         # 如果第一次找不到，嘗試線上搜尋
-        search_result = await asyncio.to_thread(search_stock_by_name, query)
+        search_result = await search_stock_by_name_async(query)
         if search_result and search_result != symbol:
             symbol = search_result
             resolve_msg = None
-            data = await asyncio.to_thread(get_stock_info, symbol)
+            data = await fetch_stock_info(symbol)
     
     if data is None:
         await interaction.followup.send(
@@ -510,46 +1035,7 @@ async def compare_command(ctx, *queries: str):
         return
     
     async with ctx.typing():
-        embed = discord.Embed(
-            title="📊 股票比較",
-            color=discord.Color.blue(),
-            timestamp=datetime.now()
-        )
-        
-        for query in queries:
-            symbol, _ = resolve_stock_symbol(query)
-            data = await asyncio.to_thread(get_stock_info, symbol)
-            
-            if data is None:
-                # 嘗試線上搜尋
-                search_result = await asyncio.to_thread(search_stock_by_name, query)
-                if search_result:
-                    data = await asyncio.to_thread(get_stock_info, search_result)
-            
-            if data:
-                change_emoji = get_change_emoji(data['change'])
-                currency = data['currency']
-                value = (
-                    f"💰 價格: **{format_number(data['close'])} {currency}**\n"
-                    f"{change_emoji} 漲跌: {'+' if data['change'] >= 0 else ''}{format_number(data['change'])} {currency} "
-                    f"({'+' if data['change_percent'] >= 0 else ''}{data['change_percent']:.2f}%)\n"
-                    f"📦 成交量: {format_number(data['volume'], 0)}\n"
-                    f"📊 本益比: {format_number(data['pe_ratio']) if data['pe_ratio'] else 'N/A'}"
-                )
-                embed.add_field(
-                    name=f"{data['symbol']} - {data['name'][:20]}",
-                    value=value,
-                    inline=True
-                )
-            else:
-                embed.add_field(
-                    name=f"❌ {query}",
-                    value="找不到此股票",
-                    inline=True
-                )
-        
-        embed.set_footer(text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}")
-        await ctx.send(embed=embed)
+        await send_compare_embed(ctx.send, queries)
 
 
 @bot.tree.command(name="compare", description="比較多檔股票")
@@ -572,46 +1058,10 @@ async def compare_slash(
     await interaction.response.defer()
     
     queries = [s for s in [stock1, stock2, stock3, stock4, stock5] if s]
-    
-    embed = discord.Embed(
-        title="📊 股票比較",
-        color=discord.Color.blue(),
-        timestamp=datetime.now()
+
+    await send_compare_embed(
+        lambda **kwargs: interaction.followup.send(wait=True, **kwargs), queries
     )
-    
-    for query in queries:
-        symbol, _ = resolve_stock_symbol(query)
-        data = await asyncio.to_thread(get_stock_info, symbol)
-        
-        if data is None:
-            search_result = await asyncio.to_thread(search_stock_by_name, query)
-            if search_result:
-                data = await asyncio.to_thread(get_stock_info, search_result)
-        
-        if data:
-            change_emoji = get_change_emoji(data['change'])
-            currency = data['currency']
-            value = (
-                f"💰 價格: **{format_number(data['close'])} {currency}**\n"
-                f"{change_emoji} 漲跌: {'+' if data['change'] >= 0 else ''}{format_number(data['change'])} {currency} "
-                f"({'+' if data['change_percent'] >= 0 else ''}{data['change_percent']:.2f}%)\n"
-                f"📦 成交量: {format_number(data['volume'], 0)}\n"
-                f"📊 本益比: {format_number(data['pe_ratio']) if data['pe_ratio'] else 'N/A'}"
-            )
-            embed.add_field(
-                name=f"{data['symbol']} - {data['name'][:20]}",
-                value=value,
-                inline=True
-            )
-        else:
-            embed.add_field(
-                name=f"❌ {query}",
-                value="找不到此股票",
-                inline=True
-            )
-    
-    embed.set_footer(text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}")
-    await interaction.followup.send(embed=embed)
 
 
 @bot.command(name='price', aliases=['p', '價格'])
@@ -621,13 +1071,13 @@ async def price_command(ctx, *, query: str):
     用法: !price 2330 或 !p nvidia
     """
     async with ctx.typing():
-        symbol, resolve_msg = resolve_stock_symbol(query)
-        data = await asyncio.to_thread(get_stock_info, symbol)
+        symbol, resolve_msg = await resolve_stock_symbol(query)
+        data = await fetch_stock_info(symbol)
         
         if data is None:
-            search_result = await asyncio.to_thread(search_stock_by_name, query)
-            if search_result:
-                data = await asyncio.to_thread(get_stock_info, search_result)
+            search_result = await search_stock_by_name_async(query)
+            if search_result and search_result != symbol:
+                data = await fetch_stock_info(search_result)
         
         if data is None:
             await ctx.send(f"❌ 找不到 `{query}` 對應的股票")
@@ -652,9 +1102,9 @@ async def search_command(ctx, *, query: str):
     """
     async with ctx.typing():
         try:
-            # 改用套件的搜尋，並丟到 worker thread：原本是在 async 函式裡
+            # 原生 asyncio 搜尋（失敗時退回 yolab-quote）；原本是在 async 函式裡
             # 直接跑同步的 requests.get，會卡住 event loop。
-            matches = await asyncio.to_thread(_quotes.search, query, 10)
+            matches = await _search_symbols(query, 10)
 
             if not matches:
                 await ctx.send(f"❌ 找不到與 `{query}` 相關的股票")
@@ -694,15 +1144,15 @@ async def history_command(ctx, query: str, days: int = 7):
     
     async with ctx.typing():
         try:
-            symbol, _ = resolve_stock_symbol(query)
-            bars, name, currency = await asyncio.to_thread(_load_history, symbol, days)
+            symbol, _ = await resolve_stock_symbol(query)
+            bars, name, currency = await fetch_history(symbol, days)
 
             if not bars:
                 # 對照表解不出來，改走線上搜尋
-                search_result = await asyncio.to_thread(search_stock_by_name, query)
-                if search_result:
+                search_result = await search_stock_by_name_async(query)
+                if search_result and search_result != symbol:
                     symbol = search_result
-                    bars, name, currency = await asyncio.to_thread(_load_history, symbol, days)
+                    bars, name, currency = await fetch_history(symbol, days)
 
             if not bars:
                 await ctx.send(f"❌ 找不到 `{query}` 的歷史資料")
@@ -771,70 +1221,16 @@ async def market_command(ctx):
     查詢主要市場指數
     用法: !market
     """
-    indices = [
-        ('^GSPC', 'S&P 500'),
-        ('^DJI', '道瓊工業'),
-        ('^IXIC', '那斯達克'),
-        ('^TWII', '台灣加權'),
-        ('^HSI', '恆生指數'),
-        ('^N225', '日經 225'),
-    ]
-    
     async with ctx.typing():
-        embed = discord.Embed(
-            title="🌍 全球主要市場指數",
-            color=discord.Color.gold(),
-            timestamp=datetime.now()
-        )
-        
-        for symbol, name in indices:
-            data = await asyncio.to_thread(get_stock_info, symbol)
-            if data:
-                change_emoji = get_change_emoji(data['change'])
-                value = (
-                    f"💰 **{format_number(data['close'])}**\n"
-                    f"{change_emoji} {'+' if data['change'] >= 0 else ''}{format_number(data['change'])} "
-                    f"({'+' if data['change_percent'] >= 0 else ''}{data['change_percent']:.2f}%)"
-                )
-                embed.add_field(name=f"📊 {name}", value=value, inline=True)
-        
-        embed.set_footer(text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}")
-        await ctx.send(embed=embed)
+        await send_market_embed(ctx.send)
 
 
 @bot.tree.command(name="market", description="查詢全球主要市場指數")
 async def market_slash(interaction: discord.Interaction):
     """斜線命令：查詢市場指數"""
     await interaction.response.defer()
-    
-    indices = [
-        ('^GSPC', 'S&P 500'),
-        ('^DJI', '道瓊工業'),
-        ('^IXIC', '那斯達克'),
-        ('^TWII', '台灣加權'),
-        ('^HSI', '恆生指數'),
-        ('^N225', '日經 225'),
-    ]
-    
-    embed = discord.Embed(
-        title="🌍 全球主要市場指數",
-        color=discord.Color.gold(),
-        timestamp=datetime.now()
-    )
-    
-    for symbol, name in indices:
-        data = await asyncio.to_thread(get_stock_info, symbol)
-        if data:
-            change_emoji = get_change_emoji(data['change'])
-            value = (
-                f"💰 **{format_number(data['close'])}**\n"
-                f"{change_emoji} {'+' if data['change'] >= 0 else ''}{format_number(data['change'])} "
-                f"({'+' if data['change_percent'] >= 0 else ''}{data['change_percent']:.2f}%)"
-            )
-            embed.add_field(name=f"📊 {name}", value=value, inline=True)
-    
-    embed.set_footer(text=f"查詢日期：{datetime.now().strftime('%Y-%m-%d')}")
-    await interaction.followup.send(embed=embed)
+
+    await send_market_embed(lambda **kwargs: interaction.followup.send(wait=True, **kwargs))
 
 
 @bot.command(name='help_stock', aliases=['hs', '股票幫助', '說明'])
@@ -1014,7 +1410,10 @@ async def _run_bot(token: str, backoff=None):
                     raise SystemExit(1)
     finally:
         readiness.set_not_ready()
+        await _prefetcher.stop()
+        await _yahoo.close()
         await database.close()
+        _bar_store.close()
 
 
 if __name__ == '__main__':
@@ -2,6 +2,7 @@
 等級系統 Cog
 - 發言自動獲得經驗值（15-25 XP）
 - 60 秒冷卻防刷
+- XP 先記在記憶體、定期批次寫入資料庫
 - 升級自動通知
 - 達到指定等級自動給角色
 """
@@ -9,14 +10,103 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import asyncio
+import os
 import random
 from datetime import datetime, timedelta
 from database import (
-    get_user_level, add_xp, get_leaderboard, get_user_rank,
+    get_user_level, add_xp_many, claim_xp_cooldown, get_leaderboard, get_leaderboard_after,
+    get_members_from_level, get_user_rank,
     get_guild_settings, update_guild_settings,
-    add_level_reward, get_level_reward, get_all_level_rewards, remove_level_reward,
+    add_level_reward, get_reward_map, remove_level_reward,
+    get_role_sync_progress, save_role_sync_progress,
     xp_for_level, calculate_level
 )
+from cooldown import CooldownTracker
+from market.cache import TTLCache
+from market.progress import ThrottledEditor
+from rewards import RewardMap
+from role_sync import RoleSync
+from xp_buffer import XPBuffer
+
+# XP 批次寫入間隔（秒）：每則訊息只改記憶體，同一成員的增量合併後定期寫入。
+XP_FLUSH_INTERVAL = float(os.environ.get('XP_FLUSH_INTERVAL', '10'))
+
+# 排行榜每頁人數；翻頁結果快取秒數（連點按鈕不重複查詢）
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_PAGE_TTL = float(os.environ.get('LEADERBOARD_PAGE_TTL', '15'))
+MEDALS = ['🥇', '🥈', '🥉']
+
+# !syncroles：每批讀取的成員數、兩次補發角色之間的最短間隔（秒）
+ROLE_SYNC_CHUNK = 200
+ROLE_SYNC_INTERVAL = float(os.environ.get('ROLE_SYNC_INTERVAL', '0.5'))
+
+
+class LeaderboardPage:
+    """排行榜的一頁：已排版的行、下一頁游標 (xp, user_id)（沒有下一頁為 None）。"""
+
+    __slots__ = ('start', 'lines', 'next_cursor')
+
+    def __init__(self, start: int, lines: tuple, next_cursor):
+        self.start = start
+        self.lines = lines
+        self.next_cursor = next_cursor
+
+
+class LeaderboardView(discord.ui.View):
+    """排行榜翻頁按鈕。以 keyset 游標往後翻，走過的頁記在堆疊裡供上一頁使用。"""
+
+    def __init__(self, cog: 'Leveling', guild: discord.Guild, author_id: int,
+                 first: LeaderboardPage, footer: str = None):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.guild = guild
+        self.author_id = author_id
+        self.footer = footer
+        self.pages = [first]
+        self.message = None
+        self._sync_buttons()
+
+    def embed(self) -> discord.Embed:
+        return self.cog.leaderboard_embed(self.guild, self.pages[-1], len(self.pages), self.footer)
+
+    def _sync_buttons(self):
+        self.previous_page.disabled = len(self.pages) == 1
+        self.next_page.disabled = self.pages[-1].next_cursor is None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ 只有下指令的人可以翻頁", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label='上一頁', emoji='◀️', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.pages) > 1:
+            self.pages.pop()
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label='下一頁', emoji='▶️', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        current = self.pages[-1]
+        if current.next_cursor is not None:
+            page = await self.cog.leaderboard_page(
+                str(self.guild.id), current.start + len(current.lines), current.next_cursor
+            )
+            if page.lines:
+                self.pages.append(page)
+        self._sync_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message is not None:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException:
+                pass
 
 
 class Leveling(commands.Cog):
@@ -24,8 +114,24 @@ class Leveling(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # 冷卻追蹤：{(guild_id, user_id): last_xp_datetime}
-        self.xp_cooldowns: dict[tuple, datetime] = {}
+        # 冷卻追蹤：(guild_id, user_id) → 到期時間，過期自動清除
+        self.xp_cooldowns = CooldownTracker()
+        # 升級判定用本機視圖，寫入資料庫延後批次進行
+        self.xp_buffer = XPBuffer(get_user_level, add_xp_many, interval=XP_FLUSH_INTERVAL)
+        # (guild_id, 起始名次, 游標) → LeaderboardPage
+        self.leaderboard_pages = TTLCache(maxsize=512, ttl=LEADERBOARD_PAGE_TTL)
+        # guild_id → 進行中的 !syncroles 工作
+        self.role_syncs = {}
+
+    async def cog_load(self):
+        self.xp_buffer.start()
+
+    async def cog_unload(self):
+        # 關機（bot.close 會卸載 cog）時把尚未寫入的 XP 寫完
+        await self.xp_buffer.stop()
+        # 補發角色的進度每批都已存檔，直接中斷，下次 !syncroles 接著做
+        for task in list(self.role_syncs.values()):
+            task.cancel()
 
     # ==================== 自動經驗值 ====================
 
@@ -42,29 +148,42 @@ class Leveling(commands.Cog):
         user_id = str(message.author.id)
         cooldown_key = (guild_id, user_id)
 
+        # 冷卻檢查：純記憶體，冷卻中的訊息不碰任何資料庫
+        if self.xp_cooldowns.active(cooldown_key):
+            return
+
         # 取得伺服器設定
         settings = await get_guild_settings(guild_id)
         xp_cooldown = settings.get('xp_cooldown', 60)
         base_xp = settings.get('xp_per_message', 15)
 
-        # 冷卻檢查
-        now = datetime.now()
-        if cooldown_key in self.xp_cooldowns:
-            elapsed = (now - self.xp_cooldowns[cooldown_key]).total_seconds()
-            if elapsed < xp_cooldown:
-                return
+        # 檢查並記錄冷卻（await 期間可能有同一人的另一則訊息先通過）
+        if not self.xp_cooldowns.try_start(cooldown_key, xp_cooldown):
+            return
 
-        # 記錄冷卻時間
-        self.xp_cooldowns[cooldown_key] = now
+        # 向資料層確認冷卻：多個行程共用的後端（PostgreSQL）以 last_xp_time
+        # 原子地搶冷卻，其他分片剛給過 XP 時不會重複發放；單一行程的後端
+        # 只在重新啟動後第一次讀一下存檔時間，不會每則訊息都寫一次資料庫
+        # （發言時間隨 XP 批次寫入）。本機冷卻表已記下，之後的訊息在冷卻
+        # 結束前不會再走到這裡。
+        username = str(message.author)
+        if not await claim_xp_cooldown(guild_id, user_id, username, xp_cooldown):
+            return
 
         # 隨機經驗值 (base ~ base+10)
         xp_amount = random.randint(base_xp, base_xp + 10)
-        username = str(message.author)
-        new_level, new_xp, leveled_up = await add_xp(guild_id, user_id, username, xp_amount)
+        new_level, new_xp, leveled_up = await self.xp_buffer.award(guild_id, user_id, username, xp_amount)
 
         if leveled_up:
             await self._handle_level_up(message, new_level, guild_id, user_id)
 
+    async def _flush_xp(self):
+        """查詢前先寫入緩衝中的 XP，讓等級與排行看得到剛發的言；失敗就顯示資料庫現值。"""
+        try:
+            await self.xp_buffer.flush()
+        except Exception as e:
+            print(f"⚠️ XP 寫入失敗，稍後重試: {type(e).__name__}")
+
     async def _handle_level_up(self, message: discord.Message, new_level: int, guild_id: str, user_id: str):
         """處理升級：通知 + 角色獎勵"""
         settings = await get_guild_settings(guild_id)
@@ -89,22 +208,31 @@ class Leveling(commands.Cog):
         if channel:
             await channel.send(embed=embed)
 
-        # 檢查等級獎勵
-        reward = await get_level_reward(guild_id, new_level)
-        if reward:
-            role = message.guild.get_role(int(reward['role_id']))
-            if role and role not in message.author.roles:
-                try:
-                    await message.author.add_roles(role)
-                    reward_embed = discord.Embed(
-                        title="🏆 獲得新角色！",
-                        description=f"{message.author.mention} 達到等級 {new_level}，獲得了 {role.mention} 角色！",
-                        color=discord.Color.purple()
-                    )
-                    if channel:
-                        await channel.send(embed=reward_embed)
-                except discord.Forbidden:
-                    print(f"❌ 無法給予角色 {role.name}（權限不足）")
+        # 檢查等級獎勵（獎勵表快取在記憶體，升級不必查資料庫）
+        # 補上這個等級以下所有還沒拿到的角色，不只剛好等於 new_level 的那個
+        rewards = await get_reward_map(guild_id)
+        held = {str(role.id) for role in message.author.roles}
+        roles = self._reward_roles(message.guild, rewards.missing(new_level, held))
+        if roles:
+            try:
+                await message.author.add_roles(*roles, reason=f"等級 {new_level} 獎勵")
+                mentions = '、'.join(role.mention for role in roles)
+                reward_embed = discord.Embed(
+                    title="🏆 獲得新角色！",
+                    description=f"{message.author.mention} 達到等級 {new_level}，獲得了 {mentions} 角色！",
+                    color=discord.Color.purple()
+                )
+                if channel:
+                    await channel.send(embed=reward_embed)
+            except discord.Forbidden:
+                names = '、'.join(role.name for role in roles)
+                print(f"❌ 無法給予角色 {names}（權限不足）")
+
+    @staticmethod
+    def _reward_roles(guild: discord.Guild, rewards) -> list:
+        """獎勵 → 伺服器上還存在的角色（已刪除的角色略過）。"""
+        roles = (guild.get_role(int(reward.role_id)) for reward in rewards)
+        return [role for role in roles if role is not None]
 
     # ==================== 等級查詢 ====================
 
@@ -118,6 +246,7 @@ class Leveling(commands.Cog):
         guild_id = str(ctx.guild.id)
         user_id = str(member.id)
 
+        await self._flush_xp()
         data = await get_user_level(guild_id, user_id)
 
         if not data:
@@ -162,45 +291,76 @@ class Leveling(commands.Cog):
 
     # ==================== 排行榜 ====================
 
+    async def leaderboard_page(self, guild_id: str, start: int = 0, cursor=None) -> LeaderboardPage:
+        """取得從第 start 名（0 起算）、游標 cursor 之後的一頁，短時間內重用已排版的結果。"""
+        key = (guild_id, start, cursor)
+        page = self.leaderboard_pages.get(key)
+        if page is not None:
+            return page
+
+        # 多拿一筆判斷是否還有下一頁
+        limit = LEADERBOARD_PAGE_SIZE + 1
+        if cursor is None:
+            rows = await get_leaderboard(guild_id, limit)
+        else:
+            rows = await get_leaderboard_after(guild_id, cursor[0], cursor[1], limit)
+        shown = rows[:LEADERBOARD_PAGE_SIZE]
+
+        lines = []
+        for i, user_data in enumerate(shown, start=start):
+            medal = MEDALS[i] if i < len(MEDALS) else f'`{i+1}.`'
+            username = user_data.get('username') or '未知用戶'
+            lines.append(f"{medal} **{username}** — 等級 {user_data['level']} | {user_data['xp']:,} XP")
+
+        next_cursor = None
+        if len(rows) > LEADERBOARD_PAGE_SIZE:
+            last = shown[-1]
+            next_cursor = (last['xp'], str(last['user_id']))
+        page = LeaderboardPage(start, tuple(lines), next_cursor)
+        self.leaderboard_pages.set(key, page)
+        return page
+
+    def leaderboard_embed(self, guild: discord.Guild, page: LeaderboardPage, page_no: int,
+                          footer: str = None) -> discord.Embed:
+        embed = discord.Embed(
+            title=f"🏆 {guild.name} 等級排行榜",
+            description='\n'.join(page.lines),
+            color=discord.Color.gold(),
+            timestamp=datetime.now()
+        )
+        footer_text = f"第 {page_no} 頁"
+        if footer:
+            footer_text = f"{footer} ・ {footer_text}"
+        embed.set_footer(text=footer_text)
+        return embed
+
     @commands.hybrid_command(name='rank', aliases=['leaderboard', 'top', '排行', '排行榜'])
     async def rank_command(self, ctx: commands.Context):
         """
-        查看排行榜 TOP 10
+        查看排行榜（每頁 10 名，可按按鈕翻頁）
         用法: !rank
         """
         guild_id = str(ctx.guild.id)
-        leaders = await get_leaderboard(guild_id, 10)
+        await self._flush_xp()
+        first = await self.leaderboard_page(guild_id)
 
-        if not leaders:
+        if not first.lines:
             await ctx.send("📊 還沒有任何排行資料，大家多多發言吧！")
             return
 
-        embed = discord.Embed(
-            title=f"🏆 {ctx.guild.name} 等級排行榜",
-            color=discord.Color.gold(),
-            timestamp=datetime.now()
-        )
-
-        medals = ['🥇', '🥈', '🥉']
-        description_lines = []
-
-        for i, user_data in enumerate(leaders):
-            medal = medals[i] if i < 3 else f'`{i+1}.`'
-            username = user_data.get('username', '未知用戶')
-            level = user_data['level']
-            xp = user_data['xp']
-            description_lines.append(
-                f"{medal} **{username}** — 等級 {level} | {xp:,} XP"
-            )
-
-        embed.description = '\n'.join(description_lines)
-
         # 顯示自己的排名
+        footer = None
         user_rank = await get_user_rank(guild_id, str(ctx.author.id))
         if user_rank:
-            embed.set_footer(text=f"你的排名：#{user_rank}")
+            footer = f"你的排名：#{user_rank}"
 
-        await ctx.send(embed=embed)
+        view = LeaderboardView(self, ctx.guild, ctx.author.id, first, footer)
+        if first.next_cursor is None:
+            # 只有一頁就不用按鈕
+            await ctx.send(embed=view.embed())
+            view.stop()
+            return
+        view.message = await ctx.send(embed=view.embed(), view=view)
 
     # ==================== 管理員指令 ====================
 
@@ -247,7 +407,7 @@ class Leveling(commands.Cog):
         用法: !levelrewards
         """
         guild_id = str(ctx.guild.id)
-        rewards = await get_all_level_rewards(guild_id)
+        rewards = await get_reward_map(guild_id)
 
         if not rewards:
             await ctx.send("📋 目前沒有設定任何等級獎勵\n使用 `!setlevelreward <等級> @角色` 來設定")
@@ -261,9 +421,9 @@ class Leveling(commands.Cog):
 
         description_lines = []
         for r in rewards:
-            role = ctx.guild.get_role(int(r['role_id']))
-            role_text = role.mention if role else f"~~{r['role_name']}~~（已刪除）"
-            description_lines.append(f"⭐ **等級 {r['level']}** → {role_text}")
+            role = ctx.guild.get_role(int(r.role_id))
+            role_text = role.mention if role else f"~~{r.role_name}~~（已刪除）"
+            description_lines.append(f"⭐ **等級 {r.level}** → {role_text}")
 
         embed.description = '\n'.join(description_lines)
         await ctx.send(embed=embed)
@@ -312,12 +472,100 @@ class Leveling(commands.Cog):
             msg += f"，冷卻時間設為 **{cooldown}** 秒"
         await ctx.send(msg)
 
+    @commands.hybrid_command(name='syncroles')
+    @commands.has_permissions(administrator=True)
+    async def sync_roles(self, ctx: commands.Context, mode: str = None):
+        """
+        依目前的等級獎勵，補發所有成員缺少的角色（中斷後再執行會接著做）
+        用法: !syncroles [restart]
+        """
+        guild = ctx.guild
+        guild_id = str(guild.id)
+        if guild_id in self.role_syncs:
+            await ctx.send("⏳ 角色補發已在進行中")
+            return
+
+        # 只處理伺服器上還存在的角色
+        rewards = await get_reward_map(guild_id)
+        rewards = RewardMap(r.as_dict() for r in rewards if guild.get_role(int(r.role_id)))
+        if not rewards:
+            await ctx.send("📋 目前沒有可補發的等級獎勵")
+            return
+
+        progress = None if mode == 'restart' else await get_role_sync_progress(guild_id)
+        if progress is not None and progress.done:
+            progress = None
+        resumed = progress is not None
+        await self._flush_xp()
+
+        async def fetch_page(min_level, after_user_id, limit):
+            return await get_members_from_level(guild_id, min_level, after_user_id, limit)
+
+        def member_roles(user_id):
+            member = guild.get_member(int(user_id))
+            if member is None:
+                return None
+            return {str(role.id) for role in member.roles}
+
+        async def grant(user_id, missing):
+            member = guild.get_member(int(user_id))
+            roles = self._reward_roles(guild, missing)
+            if member is not None and roles:
+                await member.add_roles(*roles, reason="等級獎勵補發")
+
+        async def save(progress):
+            await save_role_sync_progress(guild_id, progress)
+
+        job = RoleSync(
+            rewards, fetch_page, member_roles, grant, save,
+            progress=progress, on_progress=lambda _: editor.request(),
+            chunk_size=ROLE_SYNC_CHUNK, grant_interval=ROLE_SYNC_INTERVAL,
+        )
+
+        def render():
+            p = job.progress
+            if p.done:
+                title, color = "✅ 角色補發完成", discord.Color.green()
+            else:
+                title, color = "🔄 角色補發中" + ("（接續上次進度）" if resumed else ""), discord.Color.blue()
+            embed = discord.Embed(title=title, color=color, timestamp=datetime.now())
+            embed.add_field(name="已檢查", value=f"{p.scanned:,}", inline=True)
+            embed.add_field(name="已補發角色", value=f"{p.granted:,}", inline=True)
+            embed.add_field(name="不在伺服器", value=f"{p.skipped:,}", inline=True)
+            if p.failed:
+                embed.add_field(name="失敗", value=f"{p.failed:,}", inline=True)
+            if not p.done:
+                embed.set_footer(text="中斷後再執行 !syncroles 會從上次進度繼續")
+            return embed
+
+        # 斜線指令的回覆 15 分鐘後就不能再編輯，進度改發在頻道裡
+        if ctx.interaction is not None:
+            await ctx.send("🔄 開始補發角色", ephemeral=True)
+            message = await ctx.channel.send(embed=render())
+        else:
+            message = await ctx.send(embed=render())
+        editor = ThrottledEditor(lambda: message.edit(embed=render()), min_interval=2.0)
+        editor.touch()
+
+        task = asyncio.ensure_future(job.run())
+        self.role_syncs[guild_id] = task
+        try:
+            await task
+        finally:
+            self.role_syncs.pop(guild_id, None)
+            try:
+                editor.request()
+                await editor.flush()
+            except discord.HTTPException:
+                pass
+
     # ==================== 錯誤處理 ====================
 
     @set_level_reward.error
     @remove_level_reward_cmd.error
     @set_level_channel.error
     @set_xp.error
+    @sync_roles.error
     async def admin_error(self, ctx: commands.Context, error):
         if isinstance(error, commands.MissingPermissions):
             await ctx.send("❌ 你需要 **管理員** 權限才能使用此指令")
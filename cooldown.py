@@ -0,0 +1,69 @@
+"""
+發言冷卻追蹤（純邏輯，不相依 discord，方便單元測試）。
+
+CooldownTracker 以 dict 存每個 key 的到期時間，另用一個以到期時間排序的
+heap 清掉過期的 key，記憶體只跟「冷卻中」的人數成正比，不會隨著累積的
+發言人數無限成長。查詢與設定都是 O(1)（清除過期項目攤銷 O(log n)）。
+"""
+
+from __future__ import annotations
+
+import heapq
+import time
+from typing import Callable, Dict, Hashable, List, Tuple
+
+
+class CooldownTracker:
+    """
+    會自動過期的冷卻表。
+
+    active(key) 只讀記憶體，可放在任何 I/O 之前先擋掉冷卻中的訊息；
+    try_start(key, seconds) 是「檢查並設定」，中間沒有 await，同一個 key
+    併發時只有一個會成功。
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self._clock = clock
+        self._deadlines: Dict[Hashable, float] = {}
+        self._expiry: List[Tuple[float, int, Hashable]] = []
+        self._counter = 0  # heap 同時間到期時的排序依據（key 不一定可比較）
+
+    def __len__(self) -> int:
+        self._evict(self._clock())
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.active(key)
+
+    def _evict(self, now: float) -> None:
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            deadline, _, key = heapq.heappop(expiry)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+
+    def active(self, key: Hashable) -> bool:
+        now = self._clock()
+        self._evict(now)
+        deadline = self._deadlines.get(key)
+        return deadline is not None and deadline > now
+
+    def remaining(self, key: Hashable) -> float:
+        now = self._clock()
+        deadline = self._deadlines.get(key)
+        return max(0.0, deadline - now) if deadline is not None else 0.0
+
+    def try_start(self, key: Hashable, seconds: float) -> bool:
+        """冷卻中回傳 False；否則開始 seconds 秒的冷卻並回傳 True。"""
+        if self.active(key):
+            return False
+        if seconds > 0:
+            deadline = self._clock() + seconds
+            self._deadlines[key] = deadline
+            self._counter += 1
+            heapq.heappush(self._expiry, (deadline, self._counter, key))
+        return True
+
+    def clear(self) -> None:
+        self._deadlines.clear()
+        self._expiry.clear()
@@ -3,21 +3,72 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any, Dict, List, Optional, Tuple
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
-from storage import Storage, calculate_level, create_storage, xp_for_level
+from cooldown import CooldownTracker
+from ranking import GuildRankIndex, RankBook
+from rewards import RewardMap
+from storage import (
+    RoleSyncProgress, Storage, WelcomeLog, XPAward, calculate_level, create_storage, epoch_seconds,
+    xp_for_level,
+)
+
+logger = logging.getLogger("discord_stockbot.database")
 
 _storage: Optional[Storage] = None
 _initialize_lock = asyncio.Lock()
 
+# Guild settings are read on every message, so they are served from memory.
+# Local writes invalidate the entry immediately; writes from other processes
+# arrive through Storage.listen_settings_changes when the backend supports it,
+# and the TTL bounds staleness when it does not.
+SETTINGS_CACHE_TTL = float(os.environ.get("GUILD_SETTINGS_TTL", "300"))
+_settings_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_settings_generation = 0  # bumped on invalidation so in-flight reads are not cached
+_clock = time.monotonic
+
+# Rank and leaderboard reads are answered from a per-guild in-memory index,
+# loaded from user_levels on first use and updated on every XP write. The TTL
+# forces a reload so writes from other processes are picked up.
+RANK_INDEX_TTL = float(os.environ.get("RANK_INDEX_TTL", "900"))
+_ranks = RankBook(ttl=RANK_INDEX_TTL)
+_rank_loads: Dict[str, "asyncio.Future[GuildRankIndex]"] = {}
+
+# Level reward tables are tiny and rarely change, so each guild's table is kept
+# as an immutable RewardMap. Local writes reload it immediately; the settings
+# TTL bounds how long another process's changes take to show up.
+_reward_maps: Dict[str, Tuple[float, RewardMap]] = {}
+_reward_generation = 0
+
+# Members whose stored cooldown has been checked since startup (single-process
+# backends only; see claim_xp_cooldown). Entries expire once a cooldown that
+# began before startup can no longer be running, so this stays bounded.
+_cooldown_checked = CooldownTracker(lambda: _clock())
+_started_at = 0.0
+
 
 async def initialize(storage: Optional[Storage] = None) -> None:
-    global _storage
+    global _storage, _started_at
     async with _initialize_lock:
         if _storage is not None:
             return
         candidate = storage or create_storage()
         await candidate.initialize()
+        try:
+            await candidate.listen_settings_changes(invalidate_guild_settings)
+        except Exception as exc:
+            logger.warning(
+                "settings change listener unavailable (%s); relying on TTL",
+                type(exc).__name__,
+            )
+        _settings_cache.clear()
+        _reward_maps.clear()
+        _cooldown_checked.clear()
+        _ranks.discard()
+        _started_at = _clock()
         _storage = candidate
 
 
@@ -27,6 +78,10 @@ async def close() -> None:
         if _storage is not None:
             await _storage.close()
             _storage = None
+        _settings_cache.clear()
+        _reward_maps.clear()
+        _cooldown_checked.clear()
+        _ranks.discard()
 
 
 def backend_name() -> str:
@@ -43,40 +98,209 @@ async def get_user_level(guild_id: str, user_id: str) -> Optional[Dict[str, Any]
     return await _require_storage().get_user_level(guild_id, user_id)
 
 
+async def get_user_levels_many(
+    keys: Iterable[Tuple[str, str]]
+) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    return await _require_storage().get_user_levels_many(keys)
+
+
 async def add_xp(guild_id: str, user_id: str, username: str, xp_amount: int) -> Tuple[int, int, bool]:
-    return await _require_storage().add_xp(guild_id, user_id, username, xp_amount)
+    new_level, new_xp, leveled_up = await _require_storage().add_xp(
+        guild_id, user_id, username, xp_amount
+    )
+    _ranks.apply(guild_id, user_id, new_xp, username)
+    return new_level, new_xp, leveled_up
+
+
+async def add_xp_many(awards: Iterable[XPAward]) -> Dict[Tuple[str, str], Tuple[int, int, bool]]:
+    awards = list(awards)
+    results = await _require_storage().add_xp_many(awards)
+    names = {(award.guild_id, award.user_id): award.username for award in awards}
+    for (guild_id, user_id), (_, new_xp, _) in results.items():
+        _ranks.apply(guild_id, user_id, new_xp, names.get((guild_id, user_id)))
+    return results
+
+
+async def claim_xp_cooldown(guild_id: str, user_id: str, username: str, cooldown_seconds: int) -> bool:
+    """Confirm a cooldown the caller's in-process tracker has just started.
+
+    Backends shared between processes claim it atomically in storage. For
+    single-process backends the tracker is authoritative and the batched
+    add_xp_many flush persists last_xp_time, so no per-message write is made:
+    only a member's first claim in the first ``cooldown_seconds`` after startup
+    reads the stored time, to honour a cooldown that began before a restart.
+    """
+    storage = _require_storage()
+    if storage.shared_cooldowns:
+        return await storage.claim_xp_cooldown(guild_id, user_id, username, cooldown_seconds)
+    window = _started_at + cooldown_seconds - _clock()
+    if window <= 0:
+        return True  # any cooldown from before startup has ended
+    key = (guild_id, user_id)
+    if _cooldown_checked.active(key):
+        return True
+    row = await storage.get_user_level(guild_id, user_id)
+    _cooldown_checked.try_start(key, window)
+    last = epoch_seconds(row.get("last_xp_time")) if row else None
+    return last is None or last <= time.time() - cooldown_seconds
+
+
+async def _load_rank_index(guild_id: str) -> GuildRankIndex:
+    _ranks.begin_load(guild_id)
+    try:
+        rows = await _require_storage().get_guild_levels(guild_id)
+        # Building the index for a large guild takes a noticeable fraction of
+        # a second, so it runs off the event loop.
+        index = await asyncio.to_thread(GuildRankIndex.from_rows, rows)
+    except BaseException:
+        _ranks.abort_load(guild_id)
+        raise
+    return _ranks.install(guild_id, index)
+
+
+async def _rank_index(guild_id: str) -> GuildRankIndex:
+    index = _ranks.get(guild_id)
+    if index is not None:
+        return index
+    load = _rank_loads.get(guild_id)
+    if load is None:
+        load = asyncio.ensure_future(_load_rank_index(guild_id))
+        _rank_loads[guild_id] = load
+        load.add_done_callback(lambda _: _rank_loads.pop(guild_id, None))
+    return await asyncio.shield(load)
 
 
 async def get_leaderboard(guild_id: str, limit: int = 10) -> List[Dict[str, Any]]:
-    return await _require_storage().get_leaderboard(guild_id, limit)
+    """Top members by XP with ``user_id``, ``username``, ``xp`` and ``level``."""
+    index = await _rank_index(guild_id)
+    return [dict(row, guild_id=guild_id) for row in index.top(limit)]
+
+
+async def get_leaderboard_after(
+    guild_id: str, xp: int, user_id: str, limit: int = 10
+) -> List[Dict[str, Any]]:
+    """The leaderboard page following the member ``(xp, user_id)``."""
+    index = await _rank_index(guild_id)
+    return [dict(row, guild_id=guild_id) for row in index.top(limit, after=(xp, user_id))]
+
+
+async def get_members_from_level(
+    guild_id: str, min_level: int, after_user_id: Optional[str] = None, limit: int = 200
+) -> List[Dict[str, Any]]:
+    """Members at ``min_level`` or above in ``user_id`` order (for role syncs)."""
+    return await _require_storage().get_members_from_level(guild_id, min_level, after_user_id, limit)
 
 
 async def get_user_rank(guild_id: str, user_id: str) -> Optional[int]:
-    return await _require_storage().get_user_rank(guild_id, user_id)
+    index = await _rank_index(guild_id)
+    rank = index.rank(user_id)
+    if rank is None:
+        return await _require_storage().get_user_rank(guild_id, user_id)
+    return rank
+
+
+async def get_reward_map(guild_id: str) -> RewardMap:
+    """The guild's level rewards as an immutable level -> role mapping."""
+    cached = _reward_maps.get(guild_id)
+    if cached is not None and _clock() - cached[0] < SETTINGS_CACHE_TTL:
+        return cached[1]
+    generation = _reward_generation
+    rows = await _require_storage().get_all_level_rewards(guild_id)
+    reward_map = RewardMap(rows)
+    if generation == _reward_generation:
+        _reward_maps[guild_id] = (_clock(), reward_map)
+    return reward_map
+
+
+async def _refresh_reward_map(guild_id: str) -> RewardMap:
+    global _reward_generation
+    _reward_generation += 1
+    _reward_maps.pop(guild_id, None)
+    return await get_reward_map(guild_id)
 
 
 async def add_level_reward(guild_id: str, level: int, role_id: str, role_name: str) -> None:
-    await _require_storage().add_level_reward(guild_id, level, role_id, role_name)
+    try:
+        await _require_storage().add_level_reward(guild_id, level, role_id, role_name)
+    finally:
+        await _refresh_reward_map(guild_id)
 
 
 async def get_level_reward(guild_id: str, level: int) -> Optional[Dict[str, Any]]:
-    return await _require_storage().get_level_reward(guild_id, level)
+    reward = (await get_reward_map(guild_id)).get(level)
+    return dict(reward.as_dict(), guild_id=guild_id) if reward else None
 
 
 async def get_all_level_rewards(guild_id: str) -> List[Dict[str, Any]]:
-    return await _require_storage().get_all_level_rewards(guild_id)
+    return [dict(reward.as_dict(), guild_id=guild_id) for reward in await get_reward_map(guild_id)]
 
 
 async def remove_level_reward(guild_id: str, level: int) -> bool:
-    return await _require_storage().remove_level_reward(guild_id, level)
+    try:
+        return await _require_storage().remove_level_reward(guild_id, level)
+    finally:
+        await _refresh_reward_map(guild_id)
+
+
+def invalidate_guild_settings(guild_id: Optional[str] = None) -> None:
+    """Drop one guild's cached settings, or all of them when no id is given."""
+    global _settings_generation
+    _settings_generation += 1
+    if guild_id is None:
+        _settings_cache.clear()
+    else:
+        _settings_cache.pop(guild_id, None)
 
 
 async def get_guild_settings(guild_id: str) -> Dict[str, Any]:
-    return await _require_storage().get_guild_settings(guild_id)
+    cached = _settings_cache.get(guild_id)
+    if cached is not None and _clock() - cached[0] < SETTINGS_CACHE_TTL:
+        return dict(cached[1])
+    generation = _settings_generation
+    settings = await _require_storage().get_guild_settings(guild_id)
+    if generation == _settings_generation:
+        _settings_cache[guild_id] = (_clock(), settings)
+    return dict(settings)
+
+
+async def get_guild_settings_many(guild_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Settings for several guilds; only the ones not cached hit storage."""
+    now = _clock()
+    result: Dict[str, Dict[str, Any]] = {}
+    missing = []
+    for guild_id in dict.fromkeys(guild_ids):
+        cached = _settings_cache.get(guild_id)
+        if cached is not None and now - cached[0] < SETTINGS_CACHE_TTL:
+            result[guild_id] = dict(cached[1])
+        else:
+            missing.append(guild_id)
+    if missing:
+        generation = _settings_generation
+        loaded = await _require_storage().get_guild_settings_many(missing)
+        for guild_id, settings in loaded.items():
+            if generation == _settings_generation:
+                _settings_cache[guild_id] = (_clock(), settings)
+            result[guild_id] = dict(settings)
+    return result
 
 
 async def update_guild_settings(guild_id: str, **kwargs: Any) -> None:
-    await _require_storage().update_guild_settings(guild_id, **kwargs)
+    try:
+        await _require_storage().update_guild_settings(guild_id, **kwargs)
+    finally:
+        invalidate_guild_settings(guild_id)
+
+
+async def log_welcome_many(entries: Iterable[WelcomeLog]) -> None:
+    await _require_storage().log_welcome_many(entries)
+
+
+async def get_role_sync_progress(guild_id: str) -> Optional[RoleSyncProgress]:
+    return await _require_storage().get_role_sync_progress(guild_id)
+
+
+async def save_role_sync_progress(guild_id: str, progress: RoleSyncProgress) -> None:
+    await _require_storage().save_role_sync_progress(guild_id, progress)
 
 
 async def log_welcome(guild_id: str, user_id: str, username: str) -> None:
@@ -85,7 +309,11 @@ async def log_welcome(guild_id: str, user_id: str, username: str) -> None:
 
 __all__ = [
     "initialize", "close", "backend_name", "calculate_level", "xp_for_level",
-    "get_user_level", "add_xp", "get_leaderboard", "get_user_rank",
-    "add_level_reward", "get_level_reward", "get_all_level_rewards",
-    "remove_level_reward", "get_guild_settings", "update_guild_settings", "log_welcome",
+    "RoleSyncProgress", "WelcomeLog", "XPAward",
+    "get_user_level", "get_user_levels_many", "add_xp", "add_xp_many", "claim_xp_cooldown",
+    "get_leaderboard", "get_leaderboard_after", "get_members_from_level", "get_user_rank",
+    "add_level_reward", "get_level_reward", "get_all_level_rewards", "get_reward_map",
+    "remove_level_reward", "get_guild_settings", "get_guild_settings_many",
+    "update_guild_settings", "invalidate_guild_settings",
+    "get_role_sync_progress", "save_role_sync_progress", "log_welcome", "log_welcome_many",
 ]
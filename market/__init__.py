@@ -0,0 +1,18 @@
+"""行情取得工具（不相依 discord / yolab-quote，方便單元測試）。"""
+
+from .bars import Bar, BarStore
+from .cache import CacheEntry, ResolutionCache, TTLCache, normalize_query
+from .fanout import gather_bounded
+from .prefetch import Prefetcher
+from .progress import ThrottledEditor
+from .sessions import SessionTTLPolicy, exchange_for, exchange_for_meta, parse_holidays
+from .singleflight import SingleFlight
+from .stats import RollingStats, RollingStatsBook
+from .yahoo import Quote, SearchMatch, SymbolNotFound, YahooClient, YahooError
+
+__all__ = [
+    "Bar", "BarStore", "CacheEntry", "Prefetcher", "Quote", "ResolutionCache",
+    "RollingStats", "RollingStatsBook", "SearchMatch", "SessionTTLPolicy", "SingleFlight",
+    "SymbolNotFound", "TTLCache", "ThrottledEditor", "YahooClient", "YahooError",
+    "exchange_for", "exchange_for_meta", "gather_bounded", "normalize_query", "parse_holidays",
+]
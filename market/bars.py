@@ -0,0 +1,215 @@
+"""
+本機日 K 儲存（SQLite，以 symbol + date 為鍵）。
+
+已收盤的日 K 不會再變，所以每檔只需在第一次抓滿 depth 根，之後只補
+「最後一筆之後」的部分；最後一筆可能是盤中未完成的 K 棒，每次同步都會
+連同它一起重抓覆寫。同步由 max_age 節流，期間內直接讀本機。
+
+這裡用標準庫 sqlite3（同步），因為呼叫端本來就在 worker thread；
+一條連線加一把 threading.Lock 供多個 worker 共用。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger("discord_stockbot.bars")
+
+BAR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_bars (
+    symbol TEXT NOT NULL,
+    date TEXT NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    volume REAL,
+    PRIMARY KEY (symbol, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bar_sync (
+    symbol TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+
+class Bar(NamedTuple):
+    """與 yolab-quote 日 K 相同的欄位名稱，顯示端不需區分來源。"""
+
+    date: str
+    open: Optional[float]
+    high: Optional[float]
+    low: Optional[float]
+    close: Optional[float]
+    volume: Optional[float]
+
+
+class BarStore:
+    """
+    每檔最多保留最近 depth 根日 K 的本機儲存。
+
+    sync(symbol, fetch) 的 fetch(n) 需回傳最近 n 根日 K（具 date/open/high/
+    low/close/volume 屬性，舊到新）。抓取失敗時若本機已有資料就沿用舊資料
+    （記一筆 warning），沒有資料才把例外往上拋。upsert 之後刪掉該檔
+    最近 depth 根以前的 K 棒，表格大小不會隨時間成長。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        depth: int = 63,
+        max_age: float = 900.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = Path(path)
+        self.depth = depth
+        self.max_age = max_age
+        self._clock = clock
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # 延遲開檔：import bot 時不應該建立任何檔案
+        if self._connection is None:
+            if self.path.parent != Path("."):
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(BAR_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def latest_date(self, symbol: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT MAX(date) FROM daily_bars WHERE symbol = ?", (symbol,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def recent(self, symbol: str, limit: int) -> List[Bar]:
+        """最近 limit 根日 K，舊到新。"""
+        with self._lock:
+            rows = self._conn().execute(
+                """
+                SELECT date, open, high, low, close, volume FROM daily_bars
+                WHERE symbol = ? ORDER BY date DESC LIMIT ?
+                """,
+                (symbol, limit),
+            ).fetchall()
+        return [Bar(*row) for row in reversed(rows)]
+
+    def upsert(self, symbol: str, bars: Iterable[Any]) -> int:
+        rows = [
+            (symbol, str(bar.date)[:10], bar.open, bar.high, bar.low, bar.close, bar.volume)
+            for bar in bars
+        ]
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO daily_bars (symbol, date, open, high, low, close, volume)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(symbol, date) DO UPDATE SET
+                        open = excluded.open, high = excluded.high, low = excluded.low,
+                        close = excluded.close, volume = excluded.volume
+                    """,
+                    rows,
+                )
+                conn.execute(
+                    """
+                    DELETE FROM daily_bars
+                    WHERE symbol = ? AND date < (
+                        SELECT date FROM daily_bars WHERE symbol = ?
+                        ORDER BY date DESC LIMIT 1 OFFSET ?
+                    )
+                    """,
+                    (symbol, symbol, self.depth - 1),
+                )
+                conn.execute(
+                    """
+                    INSERT INTO bar_sync (symbol, synced_at) VALUES (?, ?)
+                    ON CONFLICT(symbol) DO UPDATE SET synced_at = excluded.synced_at
+                    """,
+                    (symbol, self._clock()),
+                )
+        return len(rows)
+
+    def synced_at(self, symbol: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT synced_at FROM bar_sync WHERE symbol = ?", (symbol,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def bars_to_fetch(self, symbol: str) -> int:
+        """
+        需要向上游要幾根：沒資料就抓滿 depth；否則依最後一筆日期到今天的
+        日曆天數估算（日曆天 ≥ 交易日，只會多抓不會漏），再多 1 根涵蓋時區差。
+        """
+        latest = self.latest_date(symbol)
+        if latest is None:
+            return self.depth
+        try:
+            last = date.fromisoformat(latest)
+        except ValueError:
+            return self.depth
+        today = datetime.fromtimestamp(self._clock(), timezone.utc).date()
+        gap = max((today - last).days, 0)
+        return max(1, min(self.depth, gap + 2))
+
+    def sync(
+        self,
+        symbol: str,
+        fetch: Callable[[int], List[Any]],
+        max_age: Optional[float] = None,
+    ) -> List[Bar]:
+        """必要時向上游補抓，回傳最近 depth 根。"""
+        synced = self.synced_at(symbol)
+        if self._stale(synced, max_age):
+            try:
+                fetched = fetch(self.bars_to_fetch(symbol))
+            except Exception as exc:
+                if synced is None:
+                    raise
+                logger.warning("日 K 補抓失敗（%s：%s），沿用本機資料", symbol, type(exc).__name__)
+            else:
+                self.upsert(symbol, fetched)
+        return self.recent(symbol, self.depth)
+
+    async def async_sync(
+        self,
+        symbol: str,
+        fetch: Callable[[int], Awaitable[List[Any]]],
+        max_age: Optional[float] = None,
+    ) -> List[Bar]:
+        """sync() 的非同步版本：fetch 為 coroutine，本機 SQLite 讀寫丟到 worker thread。"""
+        synced = await asyncio.to_thread(self.synced_at, symbol)
+        if self._stale(synced, max_age):
+            count = await asyncio.to_thread(self.bars_to_fetch, symbol)
+            try:
+                fetched = await fetch(count)
+            except Exception as exc:
+                if synced is None:
+                    raise
+                logger.warning("日 K 補抓失敗（%s：%s），沿用本機資料", symbol, type(exc).__name__)
+            else:
+                await asyncio.to_thread(self.upsert, symbol, fetched)
+        return await asyncio.to_thread(self.recent, symbol, self.depth)
+
+    def _stale(self, synced: Optional[float], max_age: Optional[float]) -> bool:
+        age_limit = self.max_age if max_age is None else max_age
+        return synced is None or self._clock() - synced >= age_limit
@@ -0,0 +1,126 @@
+"""
+行程內快取。
+
+- TTLCache：有上限的 LRU + TTL 快取，只在 event loop 上使用（不加鎖）。
+  時鐘可注入，方便測試。設定 stale_ttl 後，過期項目在寬限期內仍可用
+  peek() 取得（stale-while-revalidate）。
+- ResolutionCache：自由文字查詢 → 代碼的快取，連「查無結果」也記住一小段時間。
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple, Optional, Tuple
+
+_MISSING = object()
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    age: float  # 寫入至今的秒數
+    fresh: bool  # False 代表已過 TTL、仍在 stale 寬限期內
+
+
+class TTLCache:
+    """
+    LRU + TTL 快取。
+
+    超過 maxsize 時淘汰最久沒用的項目；過期項目在讀取時才移除。
+    set() 可為單筆指定 ttl，覆寫預設值。
+    stale_ttl > 0 時，項目過期後再保留 stale_ttl 秒：get() 不回傳，
+    peek() 會連同寫入時間一起回傳，讓呼叫端先回舊值、背景更新。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        stale_ttl: float = 0.0,
+    ) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        # key -> (stored_at, expires_at, value)
+        self._entries: "OrderedDict[Hashable, Tuple[float, float, Any]]" = OrderedDict()
+
+    def peek(self, key: Hashable) -> Optional[CacheEntry]:
+        """回傳新鮮或仍在寬限期內的項目；超過寬限期就移除並回傳 None。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, expires_at, value = entry
+        now = self._clock()
+        if expires_at + self.stale_ttl <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return CacheEntry(value, now - stored_at, expires_at > now)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.peek(key)
+        if entry is None or not entry.fresh:
+            return default
+        return entry.value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        lifetime = self.ttl if ttl is None else ttl
+        now = self._clock()
+        self._entries[key] = (now, now + lifetime, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[2]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def normalize_query(query: str) -> str:
+    """查詢字串正規化：去頭尾空白、合併連續空白、不分大小寫。"""
+    return " ".join(query.split()).casefold()
+
+
+class ResolutionCache:
+    """
+    查詢字串 → 代碼 的快取（含負向快取）。
+
+    lookup() 回傳 (hit, symbol)：hit 為 False 代表沒快取，要自己查；
+    hit 為 True 而 symbol 為 None 代表最近查過而且確定查無結果。
+    查無結果只記 negative_ttl 秒，避免新上市代碼被擋太久。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 2048,
+        positive_ttl: float = 12 * 3600,
+        negative_ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=positive_ttl, clock=clock)
+
+    def lookup(self, query: str) -> Tuple[bool, Optional[str]]:
+        entry = self._cache.get(normalize_query(query), _MISSING)
+        if entry is _MISSING:
+            return False, None
+        return True, entry
+
+    def store(self, query: str, symbol: Optional[str]) -> None:
+        ttl = self.positive_ttl if symbol else self.negative_ttl
+        self._cache.set(normalize_query(query), symbol or None, ttl=ttl)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
@@ -0,0 +1,54 @@
+"""
+有上限的並行 fan-out。
+
+- gather_bounded：同時查多檔，以 Semaphore 限制並行數、每檔各自套逾時，
+  回傳 (results, errors)，讓呼叫端用「已完成的部分」組訊息，
+  不會因為一檔卡住就整批等到底或整批失敗。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+async def gather_bounded(
+    keys: Iterable[K],
+    worker: Callable[[K], Awaitable[V]],
+    *,
+    limit: int = 4,
+    timeout: Optional[float] = None,
+) -> Tuple[Dict[K, V], Dict[K, BaseException]]:
+    """
+    對每個 key 執行 worker，最多同時 limit 個，每個 key 最多等 timeout 秒。
+
+    重複的 key 只跑一次；results 依 key 首次出現的順序排列。
+    逾時記為 errors[key] = TimeoutError。注意 worker 若是 asyncio.to_thread，
+    逾時只會放棄等待，背景執行緒仍會跑完（結果照樣進上游快取）。
+    """
+    if limit < 1:
+        raise ValueError("limit must be >= 1")
+    ordered = list(dict.fromkeys(keys))
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run_one(key: K) -> V:
+        async with semaphore:
+            if timeout is None:
+                return await worker(key)
+            return await asyncio.wait_for(worker(key), timeout)
+
+    outcomes = await asyncio.gather(*(run_one(key) for key in ordered), return_exceptions=True)
+
+    results: Dict[K, V] = {}
+    errors: Dict[K, BaseException] = {}
+    for key, outcome in zip(ordered, outcomes):
+        if isinstance(outcome, BaseException):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            errors[key] = outcome
+        else:
+            results[key] = outcome
+    return results, errors
@@ -0,0 +1,100 @@
+"""
+熱門代碼背景預取。
+
+Prefetcher 定期對一組代碼呼叫 refresh（強制略過快取重抓並寫回快取），
+讓 !market 這類固定清單的指令永遠命中快取。計數器供健康端點查看。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("discord_stockbot.prefetch")
+
+RefreshFn = Callable[[List[str]], Awaitable[Dict[str, BaseException]]]
+
+
+class Prefetcher:
+    """
+    背景預取工作。
+
+    refresh(symbols) 回傳 {symbol: 例外}，代表個別代碼失敗；整批拋例外則記為
+    一次失敗的執行，下個週期照常重試。start() / stop() 可重複呼叫。
+    """
+
+    def __init__(
+        self,
+        symbols: Iterable[str],
+        refresh: RefreshFn,
+        interval: float = 25.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.symbols = list(dict.fromkeys(symbols))
+        self.interval = interval
+        self._refresh = refresh
+        self._clock = clock
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.failed_runs = 0
+        self.symbol_failures = 0
+        self.last_duration: Optional[float] = None
+        self.last_success_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.symbols and not self.is_running():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def run_once(self) -> None:
+        started = self._clock()
+        self.runs += 1
+        try:
+            errors = await self._refresh(self.symbols)
+        except Exception as exc:
+            self.failed_runs += 1
+            self.last_error = type(exc).__name__
+            logger.warning("預取失敗（%s）", self.last_error)
+            return
+        finally:
+            self.last_duration = self._clock() - started
+        self.symbol_failures += len(errors)
+        if errors:
+            self.last_error = type(next(iter(errors.values()))).__name__
+        self.last_success_at = self._clock()
+
+    async def _loop(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        last_success_age = None
+        if self.last_success_at is not None:
+            last_success_age = round(self._clock() - self.last_success_at, 3)
+        return {
+            "running": self.is_running(),
+            "symbols": len(self.symbols),
+            "interval": self.interval,
+            "runs": self.runs,
+            "failed_runs": self.failed_runs,
+            "symbol_failures": self.symbol_failures,
+            "last_duration": None if self.last_duration is None else round(self.last_duration, 3),
+            "last_success_age": last_success_age,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,83 @@
+"""
+漸進式訊息更新的節流。
+
+多檔指令先送出占位嵌入訊息，之後每收到一檔就要求重畫一次；ThrottledEditor
+把這些請求合併成「距離上次編輯至少 min_interval 秒」的編輯，避免撞到
+Discord 的訊息編輯速率限制。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("discord_stockbot.progress")
+
+
+class ThrottledEditor:
+    """
+    合併重畫請求的編輯器。
+
+    request() 標記需要更新；距上次編輯不足 min_interval 時延到期滿才編輯，
+    期間的多次 request() 只產生一次編輯（每次編輯都畫當下最新的狀態）。
+    中途編輯失敗只記錄；flush() 等待排程中的編輯，若最後一次失敗就再送一次，
+    這次的例外會拋給呼叫端。
+    """
+
+    def __init__(
+        self,
+        edit: Callable[[], Awaitable[object]],
+        min_interval: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[object]] = asyncio.sleep,
+    ) -> None:
+        self.min_interval = min_interval
+        self._edit = edit
+        self._clock = clock
+        self._sleep = sleep
+        self._last: Optional[float] = None
+        self._dirty = False
+        self._failed = False
+        self._task: Optional[asyncio.Future] = None
+        self.edits = 0
+
+    def touch(self) -> None:
+        """記錄一次外部送出（例如占位訊息本身），下一次編輯從這時開始計算間隔。"""
+        self._last = self._clock()
+
+    def request(self) -> None:
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _wait_turn(self) -> None:
+        if self._last is not None:
+            wait = self._last + self.min_interval - self._clock()
+            if wait > 0:
+                await self._sleep(wait)
+
+    async def _run(self) -> None:
+        while self._dirty:
+            await self._wait_turn()
+            self._dirty = False
+            self._last = self._clock()
+            try:
+                await self._edit()
+            except Exception as exc:
+                self._failed = True
+                logger.warning("訊息編輯失敗（%s），稍後重試", type(exc).__name__)
+            else:
+                self._failed = False
+                self.edits += 1
+
+    async def flush(self) -> None:
+        if self._task is not None:
+            await self._task
+        if self._failed:
+            await self._wait_turn()
+            self._last = self._clock()
+            await self._edit()
+            self._failed = False
+            self.edits += 1
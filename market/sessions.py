@@ -0,0 +1,231 @@
+"""
+交易時段感知的快取 TTL。
+
+- exchange_for：由代碼後綴 / 指數代碼判斷交易所（.TW / .TWO / .T / .HK /
+  一般無後綴代碼視為美股，^TWII / ^N225 / ^HSI / ^GSPC ...）。加密貨幣
+  （BTC-USD）、外匯（EURUSD=X）、期貨（GC=F）幾乎全天交易，不對應交易所。
+- exchange_for_meta：由 chart 回應的 exchangeName / instrumentType 判斷，
+  比猜代碼可靠；SessionTTLPolicy.learn() 記住後優先採用。
+- SessionTTLPolicy：盤中用短 TTL；收盤後（含週末、設定的休市日）快取到下次開盤。
+  認不出交易所的代碼一律用盤中 TTL，行為與原本的固定 TTL 相同。
+
+時段只看一般交易時間（不含午休與盤後交易）；收盤後保留 close_grace
+讓收盤價定案，開盤前 open_lead 開始改回短 TTL。
+"""
+
+from __future__ import annotations
+
+import re
+import time as _time
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterable, Mapping, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from .cache import TTLCache
+
+
+@dataclass(frozen=True)
+class Exchange:
+    key: str
+    timezone: str
+    open: time
+    close: time
+    weekdays: frozenset = frozenset(range(5))
+
+    @property
+    def tz(self) -> ZoneInfo:
+        return ZoneInfo(self.timezone)
+
+
+EXCHANGES: Dict[str, Exchange] = {
+    "TW": Exchange("TW", "Asia/Taipei", time(9, 0), time(13, 30)),
+    "US": Exchange("US", "America/New_York", time(9, 30), time(16, 0)),
+    "JP": Exchange("JP", "Asia/Tokyo", time(9, 0), time(15, 30)),
+    "HK": Exchange("HK", "Asia/Hong_Kong", time(9, 30), time(16, 0)),
+}
+
+_INDEX_EXCHANGES = {
+    "^TWII": "TW",
+    "^TWOII": "TW",
+    "^N225": "JP",
+    "^HSI": "HK",
+    "^GSPC": "US",
+    "^DJI": "US",
+    "^IXIC": "US",
+    "^SOX": "US",
+    "^VIX": "US",
+}
+
+_SUFFIX_EXCHANGES = {
+    "TW": "TW",
+    "TWO": "TW",
+    "T": "JP",
+    "HK": "HK",
+}
+
+# 一般美股代碼（含 BRK-B 這類單字母股別）；BTC-USD 之類的幣對不算
+_US_TICKER = re.compile(r"[A-Z0-9]+(-[A-Z])?")
+
+# chart meta 的 exchangeName → 交易所
+_META_EXCHANGES = {
+    "TAI": "TW",
+    "TWO": "TW",
+    "NMS": "US",
+    "NGM": "US",
+    "NCM": "US",
+    "NYQ": "US",
+    "ASE": "US",
+    "PCX": "US",
+    "BTS": "US",
+    "NIM": "US",
+    "SNP": "US",
+    "DJI": "US",
+    "JPX": "JP",
+    "OSA": "JP",
+    "HKG": "HK",
+}
+
+# 全天（或接近全天）交易的商品類型，沒有「收盤到下次開盤」可以快取
+_ROUND_THE_CLOCK = frozenset({"CRYPTOCURRENCY", "CURRENCY", "FUTURE"})
+
+
+def exchange_for(symbol: str) -> Optional[Exchange]:
+    """依代碼判斷交易所；無法判斷（其他後綴、未知指數、幣對、外匯、期貨）回傳 None。"""
+    normalized = symbol.strip().upper()
+    if normalized.startswith("^"):
+        key = _INDEX_EXCHANGES.get(normalized)
+    elif "." in normalized:
+        key = _SUFFIX_EXCHANGES.get(normalized.rsplit(".", 1)[1])
+    elif _US_TICKER.fullmatch(normalized):
+        key = "US"
+    else:
+        key = None
+    return EXCHANGES.get(key) if key else None
+
+
+def exchange_for_meta(
+    exchange_name: Optional[str], instrument_type: Optional[str]
+) -> Tuple[bool, Optional[Exchange]]:
+    """
+    依 chart meta 判斷交易所，回傳 (known, exchange)。
+
+    known 為 False 代表 meta 認不出來，呼叫端應改用 exchange_for()；
+    known 為 True 而 exchange 為 None 代表全天交易的商品（加密貨幣、外匯、期貨）。
+    """
+    if (instrument_type or "").upper() in _ROUND_THE_CLOCK:
+        return True, None
+    key = _META_EXCHANGES.get((exchange_name or "").upper())
+    if key is None:
+        return False, None
+    return True, EXCHANGES[key]
+
+
+def parse_holidays(value: Optional[str]) -> Dict[str, Set[date]]:
+    """
+    解析休市日設定，例如 "TW:2026-10-10,2026-10-26;US:2026-11-26"。
+
+    格式錯誤的片段直接略過（設定錯誤不應該讓 bot 起不來）。
+    """
+    holidays: Dict[str, Set[date]] = {}
+    for part in (value or "").split(";"):
+        key, _, days = part.partition(":")
+        key = key.strip().upper()
+        if key not in EXCHANGES:
+            continue
+        for day in days.split(","):
+            try:
+                parsed = date.fromisoformat(day.strip())
+            except ValueError:
+                continue
+            holidays.setdefault(key, set()).add(parsed)
+    return holidays
+
+
+class SessionTTLPolicy:
+    """
+    ttl(symbol) 回傳該代碼目前應使用的快取秒數。
+
+    盤中（含 open_lead / close_grace）回傳 open_ttl；休市時回傳距離下次
+    開盤（減去 open_lead）的秒數，至少 open_ttl，最多 max_closed_ttl（None 不設上限）。
+    learn() 記下報價回應裡的交易所資訊（最多 learned_size 檔），之後優先於代碼推測。
+    """
+
+    def __init__(
+        self,
+        open_ttl: float = 30.0,
+        open_lead: float = 300.0,
+        close_grace: float = 900.0,
+        max_closed_ttl: Optional[float] = None,
+        holidays: Optional[Mapping[str, Iterable[date]]] = None,
+        clock: Callable[[], float] = _time.time,
+        learned_size: int = 4096,
+    ) -> None:
+        self.open_ttl = open_ttl
+        self.open_lead = timedelta(seconds=open_lead)
+        self.close_grace = timedelta(seconds=close_grace)
+        self.max_closed_ttl = max_closed_ttl
+        self.holidays = {key: set(days) for key, days in (holidays or {}).items()}
+        self._clock = clock
+        # 代碼 → 交易所 key（"" 代表全天交易）；交易所不會變，放一週
+        self._learned = TTLCache(maxsize=learned_size, ttl=7 * 86400)
+
+    def learn(self, symbol: str, exchange_name: Optional[str], instrument_type: Optional[str]) -> None:
+        """記下 chart meta 給的交易所；meta 認不出來就不記，繼續用代碼推測。"""
+        known, exchange = exchange_for_meta(exchange_name, instrument_type)
+        if known:
+            self._learned.set(symbol.strip().upper(), exchange.key if exchange else "")
+
+    def exchange(self, symbol: str) -> Optional[Exchange]:
+        learned = self._learned.get(symbol.strip().upper())
+        if learned is not None:
+            return EXCHANGES.get(learned)
+        return exchange_for(symbol)
+
+    def _trading_day(self, exchange: Exchange, day: date) -> bool:
+        return day.weekday() in exchange.weekdays and day not in self.holidays.get(exchange.key, ())
+
+    def _window(self, exchange: Exchange, day: date):
+        tz = exchange.tz
+        start = datetime.combine(day, exchange.open, tz) - self.open_lead
+        end = datetime.combine(day, exchange.close, tz) + self.close_grace
+        return start, end
+
+    def _now(self, exchange: Exchange) -> datetime:
+        return datetime.fromtimestamp(self._clock(), exchange.tz)
+
+    def is_open(self, symbol: str) -> bool:
+        """代碼所屬市場目前是否在（放寬後的）交易時段；認不出交易所視為開盤。"""
+        exchange = self.exchange(symbol)
+        if exchange is None:
+            return True
+        now = self._now(exchange)
+        if not self._trading_day(exchange, now.date()):
+            return False
+        start, end = self._window(exchange, now.date())
+        return start <= now < end
+
+    def seconds_until_open(self, symbol: str) -> Optional[float]:
+        """距離下次（放寬後）開盤的秒數；認不出交易所或兩週內都休市回傳 None。"""
+        exchange = self.exchange(symbol)
+        if exchange is None:
+            return None
+        now = self._now(exchange)
+        for offset in range(15):
+            day = now.date() + timedelta(days=offset)
+            if not self._trading_day(exchange, day):
+                continue
+            start, _ = self._window(exchange, day)
+            if start > now:
+                return (start - now).total_seconds()
+        return None
+
+    def ttl(self, symbol: str) -> float:
+        if self.is_open(symbol):
+            return self.open_ttl
+        remaining = self.seconds_until_open(symbol)
+        if remaining is None:
+            return self.open_ttl
+        if self.max_closed_ttl is not None:
+            remaining = min(remaining, self.max_closed_ttl)
+        return max(self.open_ttl, remaining)
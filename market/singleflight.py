@@ -0,0 +1,45 @@
+"""
+同鍵請求合併（single-flight）。
+
+同一時間對同一個 key 的多個呼叫只會真的執行一次 factory，
+其餘呼叫等同一個結果（成功或例外都共用）。完成後立刻移除，
+之後的呼叫會重新執行——快取是上一層的事，這裡只負責「同時」的去重。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    以 asyncio.Task 共享進行中的請求。
+
+    呼叫端以 asyncio.shield 等待共享的 task：某個呼叫端被取消（例如
+    gather_bounded 逾時）不會取消其他人正在等的上游請求。
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+        self.coalesced = 0  # 直接搭上進行中請求的次數（觀察用）
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: "asyncio.Task[Any]") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 所有呼叫端都被取消時，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+
+    def __len__(self) -> int:
+        return len(self._inflight)
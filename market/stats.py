@@ -0,0 +1,227 @@
+"""
+三個月高低與均量的增量統計。
+
+- RollingStats：固定視窗的最高 / 最低 / 平均成交量。最高最低用單調 deque，
+  均量用累計和，新增一根已收盤 K 棒是攤銷 O(1)。視窗中保留一格給「今天」，
+  今天的高低量由即時報價帶入，不進 deque（盤中會一直變）。
+- RollingStatsBook：每檔一份 RollingStats，定期用已收盤的日 K 補進新的 K 棒；
+  跨 worker thread 共用，以 threading.Lock 保護，最多保留 maxsize 檔（LRU）。
+  持久化交給 BarStore，重啟後第一次查詢時從本機日 K 重建。
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+Snapshot = Tuple[Optional[float], Optional[float], Optional[float]]
+
+
+class RollingStats:
+    """
+    最近 window 個交易日的 (最高, 最低, 平均成交量)。
+
+    push() 只接受已收盤的 K 棒（日期需遞增，重複或較舊的日期直接忽略），
+    最多保留 window - 1 根；snapshot() 再把今天的即時高低量併進來。
+    """
+
+    def __init__(self, window: int = 63) -> None:
+        if window < 2:
+            raise ValueError("window must be >= 2")
+        self.window = window
+        self.last_date: Optional[str] = None
+        self._seq = 0
+        self._highs: Deque[Tuple[int, float]] = deque()  # 值遞減
+        self._lows: Deque[Tuple[int, float]] = deque()  # 值遞增
+        self._volumes: Deque[Optional[float]] = deque()
+        self._volume_sum = 0.0
+        self._volume_count = 0
+
+    def __len__(self) -> int:
+        return len(self._volumes)
+
+    def push(
+        self,
+        date: str,
+        high: Optional[float],
+        low: Optional[float],
+        volume: Optional[float],
+    ) -> bool:
+        if self.last_date is not None and date <= self.last_date:
+            return False
+        self.last_date = date
+        seq = self._seq
+        self._seq += 1
+
+        if high is not None:
+            while self._highs and self._highs[-1][1] <= high:
+                self._highs.pop()
+            self._highs.append((seq, high))
+        if low is not None:
+            while self._lows and self._lows[-1][1] >= low:
+                self._lows.pop()
+            self._lows.append((seq, low))
+        self._volumes.append(volume)
+        if volume is not None:
+            self._volume_sum += volume
+            self._volume_count += 1
+
+        # 視窗保留一格給今天
+        capacity = self.window - 1
+        oldest = seq - capacity + 1
+        while self._highs and self._highs[0][0] < oldest:
+            self._highs.popleft()
+        while self._lows and self._lows[0][0] < oldest:
+            self._lows.popleft()
+        while len(self._volumes) > capacity:
+            expired = self._volumes.popleft()
+            if expired is not None:
+                self._volume_sum -= expired
+                self._volume_count -= 1
+        return True
+
+    def snapshot(
+        self,
+        live_high: Optional[float] = None,
+        live_low: Optional[float] = None,
+        live_volume: Optional[float] = None,
+    ) -> Snapshot:
+        """併入今天的即時值後回傳 (最高, 最低, 平均成交量)；沒有歷史時全為 None。"""
+        if not self._volumes:
+            return None, None, None
+        highs = [live_high] if live_high is not None else []
+        lows = [live_low] if live_low is not None else []
+        if self._highs:
+            highs.append(self._highs[0][1])
+        if self._lows:
+            lows.append(self._lows[0][1])
+        volume_sum = self._volume_sum
+        volume_count = self._volume_count
+        if live_volume is not None:
+            volume_sum += live_volume
+            volume_count += 1
+        return (
+            max(highs) if highs else None,
+            min(lows) if lows else None,
+            volume_sum / volume_count if volume_count else None,
+        )
+
+
+class _BookEntry:
+    __slots__ = ("stats", "due_at")
+
+    def __init__(self) -> None:
+        self.stats: Optional[RollingStats] = None  # 載入成功前為 None
+        self.due_at = 0.0
+
+
+class RollingStatsBook:
+    """
+    每檔一份 RollingStats。
+
+    snapshot(symbol, load_bars, ...) 在該檔超過 refresh_interval 沒更新時呼叫
+    load_bars() 取最近的日 K（最後一根視為今天、不寫入），只把新的已收盤
+    K 棒 push 進去。load_bars 失敗不算更新：沿用舊統計（沒有就全為 None），
+    retry_interval 秒後再試。超過 maxsize 檔時淘汰最久沒查的那檔。
+    """
+
+    def __init__(
+        self,
+        window: int = 63,
+        refresh_interval: float = 3600.0,
+        retry_interval: float = 60.0,
+        maxsize: int = 1024,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if maxsize < 1:
+            raise ValueError("maxsize must be >= 1")
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.maxsize = maxsize
+        self._clock = clock
+        self._entries: "OrderedDict[str, _BookEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry(self, symbol: str) -> _BookEntry:
+        entry = self._entries.get(symbol)
+        if entry is None:
+            entry = self._entries[symbol] = _BookEntry()
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(symbol)
+        return entry
+
+    def _due(self, symbol: str) -> bool:
+        entry = self._entries.get(symbol)
+        return entry is None or self._clock() >= entry.due_at
+
+    def refresh(self, symbol: str, bars: List[Any]) -> None:
+        with self._lock:
+            entry = self._entry(symbol)
+            if entry.stats is None:
+                entry.stats = RollingStats(self.window)
+            for bar in bars[:-1]:
+                entry.stats.push(str(bar.date)[:10], bar.high, bar.low, bar.volume)
+            entry.due_at = self._clock() + self.refresh_interval
+
+    def _failed(self, symbol: str) -> None:
+        with self._lock:
+            self._entry(symbol).due_at = self._clock() + self.retry_interval
+
+    def _snapshot(
+        self,
+        symbol: str,
+        live_high: Optional[float],
+        live_low: Optional[float],
+        live_volume: Optional[float],
+    ) -> Snapshot:
+        with self._lock:
+            stats = self._entry(symbol).stats
+            if stats is None:
+                return None, None, None
+            return stats.snapshot(live_high, live_low, live_volume)
+
+    def snapshot(
+        self,
+        symbol: str,
+        load_bars: Callable[[], List[Any]],
+        live_high: Optional[float] = None,
+        live_low: Optional[float] = None,
+        live_volume: Optional[float] = None,
+    ) -> Snapshot:
+        with self._lock:
+            due = self._due(symbol)
+        if due:
+            try:
+                bars = load_bars()
+            except Exception:
+                self._failed(symbol)
+            else:
+                self.refresh(symbol, bars)
+        return self._snapshot(symbol, live_high, live_low, live_volume)
+
+    async def async_snapshot(
+        self,
+        symbol: str,
+        load_bars: Callable[[], Awaitable[List[Any]]],
+        live_high: Optional[float] = None,
+        live_low: Optional[float] = None,
+        live_volume: Optional[float] = None,
+    ) -> Snapshot:
+        """snapshot() 的非同步版本：load_bars 為 coroutine。"""
+        with self._lock:
+            due = self._due(symbol)
+        if due:
+            try:
+                bars = await load_bars()
+            except Exception:
+                self._failed(symbol)
+            else:
+                self.refresh(symbol, bars)
+        return self._snapshot(symbol, live_high, live_low, live_volume)
@@ -0,0 +1,230 @@
+"""
+原生 asyncio 的 Yahoo 行情用戶端（aiohttp）。
+
+- 共用一個 ClientSession：keep-alive、總連線與每主機連線上限、DNS 快取。
+- chart()：一次 v8 chart 請求同時拿到即時報價（meta）與日 K；range="1d"
+  的回應只有一根 K 棒，適合熱路徑。
+- search()：v1 search 端點。
+- parse_chart / parse_search 是純函式，方便不連網測試。
+
+回傳的 Quote / SearchMatch 與 yolab-quote 的屬性名稱相同，呼叫端不必區分來源。
+本益比、殖利率等基本面不在 chart 回應裡，Quote.extra 固定為空 dict。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import quote as _url_quote
+
+import aiohttp
+
+from .bars import Bar
+
+CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+SEARCH_URL = "https://query2.finance.yahoo.com/v1/finance/search"
+USER_AGENT = "Mozilla/5.0 (compatible; DiscordStockBot/1.0)"
+
+# 依需要的根數挑最小的 range，避免多拉資料
+_RANGES = ((1, "1d"), (5, "5d"), (21, "1mo"), (63, "3mo"), (126, "6mo"), (252, "1y"))
+
+
+class YahooError(Exception):
+    """上游失敗（網路、逾時、非預期的回應）。status 為 HTTP 狀態碼（若有）。"""
+
+    def __init__(self, message: str, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class SymbolNotFound(YahooError):
+    """上游明確回應查無此代碼；換資料源也不會有結果。"""
+
+
+class Quote(NamedTuple):
+    symbol: str
+    name: Optional[str]
+    currency: Optional[str]
+    open: Optional[float]
+    high: Optional[float]
+    low: Optional[float]
+    price: Optional[float]
+    volume: Optional[float]
+    change: Optional[float]
+    change_percent: Optional[float]
+    extra: Dict[str, Any]
+    exchange: Optional[str] = None  # chart meta 的 exchangeName，例如 NMS、TAI、CCC
+    instrument_type: Optional[str] = None  # EQUITY、ETF、CRYPTOCURRENCY、CURRENCY、FUTURE ...
+
+
+class SearchMatch(NamedTuple):
+    symbol: str
+    name: Optional[str]
+    exchange: Optional[str]
+    quote_type: Optional[str]
+
+
+def range_for(count: int) -> str:
+    for limit, name in _RANGES:
+        if count <= limit:
+            return name
+    return _RANGES[-1][1]
+
+
+def chart_url(symbol: str) -> str:
+    """代碼放在路徑裡，整段編碼（^TWII、BRK/B 之類的字元不會改變路徑）。"""
+    return CHART_URL.format(symbol=_url_quote(symbol, safe=""))
+
+
+def parse_chart(payload: Dict[str, Any]) -> Tuple[Quote, List[Bar]]:
+    """把 v8 chart 回應轉成 (Quote, 日 K 由舊到新)。"""
+    chart = payload.get("chart") or {}
+    results = chart.get("result") or []
+    if not results:
+        error = chart.get("error") or {}
+        raise SymbolNotFound(str(error.get("code") or "no chart result"))
+    result = results[0]
+    meta = result.get("meta") or {}
+    price = meta.get("regularMarketPrice")
+    if price is None:
+        raise SymbolNotFound("no market price")
+
+    offset = timedelta(seconds=meta.get("gmtoffset") or 0)
+    timestamps = result.get("timestamp") or []
+    series = ((result.get("indicators") or {}).get("quote") or [{}])[0]
+    bars: List[Bar] = []
+    for index, stamp in enumerate(timestamps):
+        close = _at(series.get("close"), index)
+        if close is None:
+            continue
+        day = (datetime.fromtimestamp(stamp, timezone.utc) + offset).date().isoformat()
+        bars.append(
+            Bar(
+                day,
+                _at(series.get("open"), index),
+                _at(series.get("high"), index),
+                _at(series.get("low"), index),
+                close,
+                _at(series.get("volume"), index),
+            )
+        )
+
+    last = bars[-1] if bars else None
+    previous = meta.get("previousClose")
+    if previous is None:
+        previous = meta.get("chartPreviousClose")
+    change = price - previous if previous else None
+    quote = Quote(
+        symbol=meta.get("symbol") or "",
+        name=meta.get("longName") or meta.get("shortName"),
+        currency=meta.get("currency"),
+        open=last.open if last else None,
+        high=meta.get("regularMarketDayHigh", last.high if last else None),
+        low=meta.get("regularMarketDayLow", last.low if last else None),
+        price=price,
+        volume=meta.get("regularMarketVolume", last.volume if last else None),
+        change=change,
+        change_percent=change / previous * 100 if change is not None else None,
+        extra={},
+        exchange=meta.get("exchangeName"),
+        instrument_type=meta.get("instrumentType"),
+    )
+    return quote, bars
+
+
+def parse_search(payload: Dict[str, Any], limit: int) -> List[SearchMatch]:
+    matches = []
+    for item in payload.get("quotes") or []:
+        symbol = item.get("symbol")
+        if not symbol:
+            continue
+        matches.append(
+            SearchMatch(
+                symbol=symbol,
+                name=item.get("longname") or item.get("shortname"),
+                exchange=item.get("exchDisp") or item.get("exchange"),
+                quote_type=item.get("quoteType"),
+            )
+        )
+    return matches[:limit]
+
+
+def _at(values: Optional[List[Any]], index: int) -> Optional[float]:
+    if not values or index >= len(values):
+        return None
+    return values[index]
+
+
+class YahooClient:
+    """
+    共用連線池的 Yahoo 用戶端。
+
+    session 在第一次請求時於目前的 event loop 建立；close() 於關機時呼叫。
+    """
+
+    def __init__(
+        self,
+        limit: int = 32,
+        limit_per_host: int = 8,
+        dns_ttl: int = 300,
+        keepalive: float = 30.0,
+        timeout: float = 10.0,
+    ) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=self.keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": USER_AGENT},
+            )
+        return self._session
+
+    async def close(self) -> None:
+        session, self._session = self._session, None
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def _get_json(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            async with self._get_session().get(url, params=params) as response:
+                if response.status == 404:
+                    raise SymbolNotFound("not found", status=404)
+                if response.status >= 400:
+                    raise YahooError(f"HTTP {response.status}", status=response.status)
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+            raise YahooError(type(exc).__name__) from exc
+
+    async def chart(self, symbol: str, range_: str = "1d") -> Tuple[Quote, List[Bar]]:
+        payload = await self._get_json(
+            chart_url(symbol), {"range": range_, "interval": "1d"}
+        )
+        return parse_chart(payload)
+
+    async def quote(self, symbol: str) -> Quote:
+        quote, _ = await self.chart(symbol, "1d")
+        return quote
+
+    async def bars(self, symbol: str, count: int) -> List[Bar]:
+        _, bars = await self.chart(symbol, range_for(count))
+        return bars[-count:]
+
+    async def search(self, query: str, limit: int = 10) -> List[SearchMatch]:
+        payload = await self._get_json(
+            SEARCH_URL, {"q": query, "quotesCount": limit, "newsCount": 0}
+        )
+        return parse_search(payload, limit)
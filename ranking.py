@@ -0,0 +1,142 @@
+"""
+等級排行的記憶體索引（純邏輯，不相依 discord / 資料庫，方便單元測試）。
+
+- SkipList：可依位置查詢的 skip list，定義在 storage/skiplist.py（記憶體後端也用），
+  這裡轉出以維持原本的匯入路徑。
+- GuildRankIndex：單一伺服器的排行，key 為 (-xp, user_id)，由高到低排序。
+- RankBook：所有伺服器的索引；第一次查詢時由呼叫端載入，之後隨 XP 寫入更新，
+  超過 ttl 秒重新載入（其他行程的寫入靠這個追上）。資料庫仍是唯一的真實來源。
+"""
+
+from __future__ import annotations
+
+import random
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from storage import calculate_level
+from storage.skiplist import SkipList
+
+__all__ = ["GuildRankIndex", "RankBook", "SkipList"]
+
+
+class GuildRankIndex:
+    """單一伺服器的排行索引。同分的人名次相同（與資料庫的 COUNT(xp > 我) + 1 一致）。"""
+
+    def __init__(self, rng: Callable[[], float] = random.random) -> None:
+        self._order = SkipList(rng)
+        self._members: Dict[str, Tuple[int, Optional[str]]] = {}
+
+    @classmethod
+    def from_rows(
+        cls, rows: Iterable[Dict[str, Any]], rng: Callable[[], float] = random.random
+    ) -> "GuildRankIndex":
+        index = cls(rng)
+        for row in rows:
+            user_id = str(row["user_id"])
+            index._members[user_id] = (int(row["xp"] or 0), row.get("username"))
+        index._order = SkipList.from_sorted(
+            sorted((-xp, user_id) for user_id, (xp, _) in index._members.items()), rng
+        )
+        return index
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._members
+
+    def update(self, user_id: str, xp: int, username: Optional[str] = None) -> None:
+        """設定成員的 XP。XP 只增不減，較舊（較小）的值不會蓋掉較新的值。"""
+        current = self._members.get(user_id)
+        if current is not None:
+            old_xp, old_name = current
+            username = username or old_name
+            if xp <= old_xp:
+                self._members[user_id] = (old_xp, username)
+                return
+            self._order.remove((-old_xp, user_id))
+        self._order.insert((-xp, user_id))
+        self._members[user_id] = (xp, username)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        member = self._members.get(user_id)
+        if member is None:
+            return None
+        return self._order.bisect_left((-member[0], "")) + 1
+
+    def top(self, limit: int, after: Optional[Tuple[int, str]] = None) -> List[Dict[str, Any]]:
+        """由高到低回傳最多 limit 筆；after=(xp, user_id) 時從該成員之後開始。"""
+        start = None if after is None else (-after[0], after[1])
+        rows = []
+        for negative_xp, user_id in self._order.iter_from(start):
+            if len(rows) >= limit:
+                break
+            xp = -negative_xp
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "username": self._members[user_id][1],
+                    "xp": xp,
+                    "level": calculate_level(xp),
+                }
+            )
+        return rows
+
+
+class RankBook:
+    """所有伺服器的排行索引，各伺服器獨立載入與過期。"""
+
+    def __init__(
+        self,
+        ttl: float = 900.0,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random,
+    ) -> None:
+        self.ttl = ttl
+        self._clock = clock
+        self._rng = rng
+        self._guilds: Dict[str, Tuple[float, GuildRankIndex]] = {}
+        # 載入中的伺服器：期間的寫入先記下，載入完成後補套用
+        self._loading: Dict[str, List[Tuple[str, int, Optional[str]]]] = {}
+
+    def get(self, guild_id: str) -> Optional[GuildRankIndex]:
+        entry = self._guilds.get(guild_id)
+        if entry is None:
+            return None
+        if self.ttl > 0 and self._clock() - entry[0] >= self.ttl:
+            del self._guilds[guild_id]
+            return None
+        return entry[1]
+
+    def begin_load(self, guild_id: str) -> None:
+        self._loading.setdefault(guild_id, [])
+
+    def abort_load(self, guild_id: str) -> None:
+        self._loading.pop(guild_id, None)
+
+    def load(self, guild_id: str, rows: Iterable[Dict[str, Any]]) -> GuildRankIndex:
+        return self.install(guild_id, GuildRankIndex.from_rows(rows, self._rng))
+
+    def install(self, guild_id: str, index: GuildRankIndex) -> GuildRankIndex:
+        """放入已建好的索引（大伺服器可先在 worker thread 建好）。"""
+        # XP 只增不減，補套用載入期間的寫入不怕順序顛倒
+        for user_id, xp, username in self._loading.pop(guild_id, []):
+            index.update(user_id, xp, username)
+        self._guilds[guild_id] = (self._clock(), index)
+        return index
+
+    def apply(self, guild_id: str, user_id: str, xp: int, username: Optional[str] = None) -> None:
+        """XP 寫入後呼叫；沒載入的伺服器略過（之後載入時會從資料庫讀到）。"""
+        pending = self._loading.get(guild_id)
+        if pending is not None:
+            pending.append((user_id, xp, username))
+        entry = self._guilds.get(guild_id)
+        if entry is not None:
+            entry[1].update(user_id, xp, username)
+
+    def discard(self, guild_id: Optional[str] = None) -> None:
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
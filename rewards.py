@@ -0,0 +1,63 @@
+"""
+等級獎勵對照表（純邏輯，不相依 discord，方便單元測試）。
+
+RewardMap 是單一伺服器「等級 → 角色」的不可變快照：建好之後不會再被修改，
+可以放心在多個協程之間共用；獎勵設定有變動時整張換掉即可。
+每筆獎勵依等級排序存成 tuple，「等級 N 的成員應有哪些獎勵」是一次 bisect。
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_right
+from typing import Any, Collection, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+
+class LevelReward(NamedTuple):
+    level: int
+    role_id: str
+    role_name: Optional[str]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"level": self.level, "role_id": self.role_id, "role_name": self.role_name}
+
+
+class RewardMap:
+    """不可變的等級獎勵表；同一等級只會有一個角色（與資料表的 UNIQUE 一致）。"""
+
+    __slots__ = ("_levels", "_rewards")
+
+    def __init__(self, rows: Iterable[Dict[str, Any]] = ()) -> None:
+        by_level: Dict[int, LevelReward] = {}
+        for row in rows:
+            level = int(row["level"])
+            by_level[level] = LevelReward(level, str(row["role_id"]), row.get("role_name"))
+        rewards = tuple(by_level[level] for level in sorted(by_level))
+        self._rewards: Tuple[LevelReward, ...] = rewards
+        self._levels: Tuple[int, ...] = tuple(reward.level for reward in rewards)
+
+    def __len__(self) -> int:
+        return len(self._rewards)
+
+    def __iter__(self) -> Iterator[LevelReward]:
+        return iter(self._rewards)
+
+    def __bool__(self) -> bool:
+        return bool(self._rewards)
+
+    def get(self, level: int) -> Optional[LevelReward]:
+        """剛好在 level 發放的獎勵。"""
+        i = bisect_right(self._levels, level) - 1
+        if i >= 0 and self._levels[i] == level:
+            return self._rewards[i]
+        return None
+
+    def earned(self, level: int) -> Tuple[LevelReward, ...]:
+        """等級 level 的成員應該擁有的所有獎勵（累積，由低到高）。"""
+        return self._rewards[: bisect_right(self._levels, level)]
+
+    def missing(self, level: int, role_ids: Collection[str]) -> Tuple[LevelReward, ...]:
+        """等級 level、已有 role_ids 這些角色的成員還缺哪些獎勵。"""
+        return tuple(reward for reward in self.earned(level) if reward.role_id not in role_ids)
+
+    def role_ids(self) -> frozenset:
+        return frozenset(reward.role_id for reward in self._rewards)
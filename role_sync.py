@@ -0,0 +1,137 @@
+"""
+等級獎勵角色的批次補發（純邏輯，不相依 discord，方便單元測試）。
+
+RoleSync 只讀取達到最低獎勵等級的成員，依 user_id 以 keyset 游標分批，
+用 RewardMap 算出每個人還缺哪些獎勵角色，放進有速率限制的工作佇列補發。
+每批全部處理完才把游標寫回資料庫，重新啟動後從最後完成的那批之後繼續；
+重做半批也沒關係，已經有角色的人不會再被補發。
+游標不用排行順序：XP 會在補發途中（或中斷到續跑之間）變動，依 XP 排序的
+游標會讓剛升級、排到游標前面的成員被整個跳過；user_id 不會變。已掃過
+之後才升級的成員，由升級當下的獎勵流程補上角色。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional, Tuple
+
+from rewards import LevelReward, RewardMap
+from storage import RoleSyncProgress
+
+logger = logging.getLogger("discord_stockbot.role_sync")
+
+FetchPage = Callable[[int, Optional[str], int], Awaitable[List[Dict[str, Any]]]]
+
+
+class RoleSync:
+    """
+    單一伺服器的補發工作。
+
+    fetch_page(min_level, after_user_id, limit)：回傳 user_id 大於 after_user_id
+    （None 表示從頭）、等級至少 min_level 的成員，依 user_id 排序最多 limit 筆
+    {user_id, xp, level}。
+    member_roles(user_id)：成員目前的角色 id；已離開伺服器回傳 None（計入 skipped）。
+    grant(user_id, rewards)：一次補上該成員缺少的所有角色（一個 API 請求）。
+    save(progress)：持久化進度；on_progress(progress)：進度有變化時呼叫（例如重畫訊息）。
+    兩次 grant 之間至少相隔 grant_interval 秒。
+    """
+
+    def __init__(
+        self,
+        rewards: RewardMap,
+        fetch_page: FetchPage,
+        member_roles: Callable[[str], Optional[Collection[str]]],
+        grant: Callable[[str, Tuple[LevelReward, ...]], Awaitable[object]],
+        save: Callable[[RoleSyncProgress], Awaitable[object]],
+        progress: Optional[RoleSyncProgress] = None,
+        on_progress: Optional[Callable[[RoleSyncProgress], None]] = None,
+        chunk_size: int = 200,
+        grant_interval: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[object]] = asyncio.sleep,
+    ) -> None:
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be >= 1")
+        self.rewards = rewards
+        self.progress = progress or RoleSyncProgress()
+        self.chunk_size = chunk_size
+        self.grant_interval = grant_interval
+        self._fetch_page = fetch_page
+        self._member_roles = member_roles
+        self._grant = grant
+        self._save = save
+        self._on_progress = on_progress
+        self._clock = clock
+        self._sleep = sleep
+        self._last_grant: Optional[float] = None
+
+    def _update(self, **changes: Any) -> None:
+        self.progress = self.progress._replace(**changes)
+        if self._on_progress is not None:
+            self._on_progress(self.progress)
+
+    async def run(self) -> RoleSyncProgress:
+        if self.progress.done:
+            return self.progress
+        if not self.rewards:
+            self._update(done=True)
+            await self._save(self.progress)
+            return self.progress
+
+        lowest = next(iter(self.rewards)).level
+        queue: "asyncio.Queue[Tuple[str, Tuple[LevelReward, ...]]]" = asyncio.Queue(self.chunk_size)
+        worker = asyncio.ensure_future(self._work(queue))
+        try:
+            while True:
+                rows = await self._fetch_page(lowest, self.progress.cursor_user_id, self.chunk_size)
+                finished = len(rows) < self.chunk_size
+                scanned, skipped = len(rows), 0
+                for row in rows:
+                    level = int(row["level"])
+                    user_id = str(row["user_id"])
+                    roles = self._member_roles(user_id)
+                    if roles is None:
+                        skipped += 1
+                        continue
+                    missing = self.rewards.missing(level, roles)
+                    if missing:
+                        await queue.put((user_id, missing))
+                # 這批補發完才推進游標，中斷後從這批重來
+                await queue.join()
+                last = rows[-1] if rows else None
+                self._update(
+                    cursor_user_id=str(last["user_id"]) if last else self.progress.cursor_user_id,
+                    scanned=self.progress.scanned + scanned,
+                    skipped=self.progress.skipped + skipped,
+                    done=finished,
+                )
+                await self._save(self.progress)
+                if finished:
+                    return self.progress
+        finally:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+
+    async def _work(self, queue: "asyncio.Queue[Tuple[str, Tuple[LevelReward, ...]]]") -> None:
+        while True:
+            user_id, missing = await queue.get()
+            try:
+                if self._last_grant is not None:
+                    wait = self._last_grant + self.grant_interval - self._clock()
+                    if wait > 0:
+                        await self._sleep(wait)
+                self._last_grant = self._clock()
+                try:
+                    await self._grant(user_id, missing)
+                except Exception as exc:
+                    logger.warning("補發角色失敗 user=%s（%s）", user_id, type(exc).__name__)
+                    self._update(failed=self.progress.failed + 1)
+                else:
+                    self._update(granted=self.progress.granted + len(missing))
+            finally:
+                queue.task_done()
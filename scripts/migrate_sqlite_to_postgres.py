@@ -93,6 +93,9 @@ UPSERTS = {
 def _normalize_timestamp(value: Any, source_timezone: ZoneInfo) -> Any:
     if value is None:
         return None
+    if isinstance(value, (int, float)):
+        # user_levels.last_xp_time is stored as Unix seconds.
+        return datetime.fromtimestamp(value, timezone.utc)
     parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
     if parsed.tzinfo is None:
         parsed = parsed.replace(tzinfo=source_timezone)
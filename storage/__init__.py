@@ -1,6 +1,13 @@
 """Asynchronous persistence backends for Discord Stock Bot."""
 
-from .base import Storage, calculate_level, xp_for_level
+from .base import (
+    RoleSyncProgress, Storage, WelcomeLog, XPAward, calculate_level, epoch_seconds, merge_xp_awards,
+    xp_for_level,
+)
 from .factory import create_storage
+from .memory import InMemoryStorage
 
-__all__ = ["Storage", "calculate_level", "xp_for_level", "create_storage"]
+__all__ = [
+    "InMemoryStorage", "RoleSyncProgress", "Storage", "WelcomeLog", "XPAward", "calculate_level",
+    "create_storage", "epoch_seconds", "merge_xp_awards", "xp_for_level",
+]
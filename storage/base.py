@@ -4,7 +4,46 @@ from __future__ import annotations
 
 import math
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class XPAward(NamedTuple):
+    """An aggregated XP delta for one member, as flushed by the write-behind buffer."""
+
+    guild_id: str
+    user_id: str
+    username: str
+    xp: int
+    messages: int = 1
+    # Unix time of the member's latest awarded message in this batch.
+    last_xp_time: Optional[float] = None
+
+
+class WelcomeLog(NamedTuple):
+    """One member join, as recorded by ``log_welcome_many``."""
+
+    guild_id: str
+    user_id: str
+    username: str
+
+
+class RoleSyncProgress(NamedTuple):
+    """Resumable state of a guild's level reward role sync.
+
+    ``cursor_user_id`` is the last member of the last fully processed chunk in
+    ``user_id`` order; ``None`` means start from the beginning.
+    """
+
+    cursor_user_id: Optional[str] = None
+    scanned: int = 0
+    granted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    done: bool = False
+
+
+XPResults = Dict[Tuple[str, str], Tuple[int, int, bool]]
 
 
 def calculate_level(xp: int) -> int:
@@ -21,10 +60,48 @@ def xp_for_level(level: int) -> int:
     return (level - 1) ** 2 * 100
 
 
+def epoch_seconds(value: Any) -> Optional[float]:
+    """Normalize a stored ``last_xp_time`` to Unix seconds.
+
+    SQLite stores Unix seconds; PostgreSQL returns aware datetimes; rows
+    written before the numeric format hold ISO-8601 text (UTC when naive).
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def merge_xp_awards(awards: Iterable[XPAward]) -> List[XPAward]:
+    """Collapse awards for the same member so a batch touches each row once."""
+    merged: Dict[Tuple[str, str], XPAward] = {}
+    for award in awards:
+        key = (award.guild_id, award.user_id)
+        previous = merged.get(key)
+        if previous is not None:
+            times = [t for t in (previous.last_xp_time, award.last_xp_time) if t is not None]
+            award = award._replace(
+                xp=previous.xp + award.xp,
+                messages=previous.messages + award.messages,
+                last_xp_time=max(times) if times else None,
+            )
+        merged[key] = award
+    return list(merged.values())
+
+
 class Storage(ABC):
     """Async persistence interface used by the Discord cogs."""
 
     backend_name = "unknown"
+    # True when several bot processes may share this backend. Cooldowns must
+    # then be claimed atomically in storage; otherwise the in-process tracker
+    # is authoritative and last_xp_time is persisted by add_xp_many.
+    shared_cooldowns = False
 
     @abstractmethod
     async def initialize(self) -> None: ...
@@ -35,14 +112,66 @@ class Storage(ABC):
     @abstractmethod
     async def get_user_level(self, guild_id: str, user_id: str) -> Optional[Dict[str, Any]]: ...
 
+    @abstractmethod
+    async def get_user_levels_many(
+        self, keys: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Rows for the given ``(guild_id, user_id)`` pairs; members without a row are omitted."""
+
     @abstractmethod
     async def add_xp(
         self, guild_id: str, user_id: str, username: str, xp_amount: int
     ) -> Tuple[int, int, bool]: ...
 
+    @abstractmethod
+    async def add_xp_many(self, awards: Iterable[XPAward]) -> XPResults:
+        """Apply many XP deltas in one batch.
+
+        Returns ``{(guild_id, user_id): (new_level, new_xp, leveled_up)}``.
+        With ``shared_cooldowns`` an existing ``last_xp_time`` is left alone
+        because claim_xp_cooldown owns it; otherwise it becomes the later of
+        the stored value and the award's ``last_xp_time``.
+        """
+
+    @abstractmethod
+    async def claim_xp_cooldown(
+        self, guild_id: str, user_id: str, username: str, cooldown_seconds: int
+    ) -> bool:
+        """Atomically start a member's XP cooldown.
+
+        Sets ``last_xp_time`` to now only if it is unset or at least
+        ``cooldown_seconds`` old, creating the row if needed. Returns whether
+        the claim succeeded, so concurrent processes award at most once.
+        """
+
     @abstractmethod
     async def get_leaderboard(self, guild_id: str, limit: int = 10) -> List[Dict[str, Any]]: ...
 
+    @abstractmethod
+    async def get_leaderboard_after(
+        self, guild_id: str, xp: int, user_id: str, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        """Return the next leaderboard page after the member ``(xp, user_id)``.
+
+        Pages are ordered by ``xp`` descending, then ``user_id`` ascending, so
+        the last row of one page is the cursor for the next.
+        """
+
+    @abstractmethod
+    async def get_members_from_level(
+        self, guild_id: str, min_level: int, after_user_id: Optional[str] = None, limit: int = 200
+    ) -> List[Dict[str, Any]]:
+        """Return ``user_id``, ``xp`` and ``level`` of members at ``min_level`` or above.
+
+        Rows are ordered by ``user_id`` and start after ``after_user_id``. The
+        key never changes, so XP gained while paging cannot move a member past
+        the cursor.
+        """
+
+    @abstractmethod
+    async def get_guild_levels(self, guild_id: str) -> List[Dict[str, Any]]:
+        """Return ``user_id``, ``username`` and ``xp`` for every member of a guild."""
+
     @abstractmethod
     async def get_user_rank(self, guild_id: str, user_id: str) -> Optional[int]: ...
 
@@ -63,8 +192,30 @@ class Storage(ABC):
     @abstractmethod
     async def get_guild_settings(self, guild_id: str) -> Dict[str, Any]: ...
 
+    @abstractmethod
+    async def get_guild_settings_many(self, guild_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Settings for several guilds, creating default rows for any that are missing."""
+
     @abstractmethod
     async def update_guild_settings(self, guild_id: str, **kwargs: Any) -> None: ...
 
+    async def listen_settings_changes(self, callback: Callable[[Optional[str]], None]) -> None:
+        """Call ``callback(guild_id)`` when another process changes guild settings.
+
+        ``callback(None)`` means changes may have been missed (for example while
+        the listener was reconnecting) and every guild must be invalidated.
+        Backends without a notification channel keep the default no-op; callers
+        must still bound cache staleness with a TTL.
+        """
+
     @abstractmethod
     async def log_welcome(self, guild_id: str, user_id: str, username: str) -> None: ...
+
+    @abstractmethod
+    async def log_welcome_many(self, entries: Iterable[WelcomeLog]) -> None: ...
+
+    @abstractmethod
+    async def get_role_sync_progress(self, guild_id: str) -> Optional[RoleSyncProgress]: ...
+
+    @abstractmethod
+    async def save_role_sync_progress(self, guild_id: str, progress: RoleSyncProgress) -> None: ...
@@ -1,4 +1,4 @@
-"""Select a durable PostgreSQL backend or the local SQLite fallback."""
+"""Select a durable PostgreSQL backend, the local SQLite fallback or the in-memory backend."""
 
 from __future__ import annotations
 
@@ -7,8 +7,9 @@ from collections.abc import Mapping
 from typing import Optional
 
 from .base import Storage
+from .memory import InMemoryStorage
 from .postgres import PostgresStorage
-from .sqlite import SQLiteStorage
+from .sqlite import DEFAULT_PRAGMAS, SQLiteStorage
 
 
 def _truthy(value: Optional[str]) -> bool:
@@ -18,9 +19,27 @@ def _truthy(value: Optional[str]) -> bool:
 def create_storage(environ: Optional[Mapping[str, str]] = None) -> Storage:
     """Create a backend without logging any connection details."""
     values = os.environ if environ is None else environ
+    backend = (values.get("STORAGE_BACKEND") or "").strip().lower()
+    if backend not in {"", "memory", "postgres", "sqlite"}:
+        raise ValueError(f"unknown STORAGE_BACKEND: {backend}")
+    if backend == "memory":
+        if _truthy(values.get("REQUIRE_DURABLE_STORAGE")):
+            raise RuntimeError("durable storage is required but STORAGE_BACKEND=memory")
+        return InMemoryStorage(values.get("MEMORY_SNAPSHOT_PATH") or None)
     database_url = values.get("DATABASE_URL")
-    if database_url:
+    if database_url and backend != "sqlite":
         return PostgresStorage(database_url)
+    if backend == "postgres":
+        raise RuntimeError("STORAGE_BACKEND=postgres requires DATABASE_URL")
     if _truthy(values.get("REQUIRE_DURABLE_STORAGE")):
         raise RuntimeError("durable storage is required but not configured")
-    return SQLiteStorage(values.get("DB_PATH", "data/discord_bot.db"))
\ No newline at end of file
+    pragmas = {
+        name: values[f"SQLITE_{name.upper()}"]
+        for name in DEFAULT_PRAGMAS
+        if values.get(f"SQLITE_{name.upper()}")
+    }
+    return SQLiteStorage(
+        values.get("DB_PATH", "data/discord_bot.db"),
+        readers=int(values.get("SQLITE_READERS", "4")),
+        pragmas=pragmas,
+    )
\ No newline at end of file
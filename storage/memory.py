@@ -0,0 +1,396 @@
+"""In-process backend for load tests and ephemeral deployments.
+
+Everything lives in per-guild structures on the event loop: a dict of slotted
+member records plus a ``(-xp, user_id)`` skip list (the one the rank index
+uses) that answers ranks and leaderboard pages in O(log n), and a ``user_id``
+skip list that role-sync paging resumes from in O(log n). Reads never create
+guild entries; only writes do. No method awaits between reading and writing
+state, so each call is atomic without a lock. An optional snapshot file makes
+the data survive restarts; it is loaded in initialize() and written by
+snapshot() and close().
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .base import (
+    RoleSyncProgress, Storage, WelcomeLog, XPAward, XPResults, calculate_level, merge_xp_awards,
+)
+from .skiplist import SkipList
+from .sqlite import ALLOWED_SETTINGS
+
+SNAPSHOT_VERSION = 1
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "welcome_channel_id": None,
+    "welcome_message": None,
+    "rules_channel_id": None,
+    "log_channel_id": None,
+    "level_up_channel_id": None,
+    "xp_per_message": 15,
+    "xp_cooldown": 60,
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+class _Member:
+    __slots__ = ("id", "username", "xp", "level", "total_messages", "last_xp_time", "created_at")
+
+    def __init__(
+        self,
+        id: int,
+        username: Optional[str],
+        xp: int = 0,
+        level: int = 1,
+        total_messages: int = 0,
+        last_xp_time: Optional[datetime] = None,
+        created_at: Optional[datetime] = None,
+    ) -> None:
+        self.id = id
+        self.username = username
+        self.xp = xp
+        self.level = level
+        self.total_messages = total_messages
+        self.last_xp_time = last_xp_time
+        self.created_at = created_at or _now()
+
+    def row(self, guild_id: str, user_id: str) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "username": self.username,
+            "xp": self.xp,
+            "level": self.level,
+            "total_messages": self.total_messages,
+            "last_xp_time": self.last_xp_time,
+            "created_at": self.created_at,
+        }
+
+
+class _Guild:
+    __slots__ = ("members", "order", "ids", "rewards", "settings", "role_sync")
+
+    def __init__(self) -> None:
+        self.members: Dict[str, _Member] = {}
+        self.order = SkipList()  # (-xp, user_id), ascending
+        self.ids = SkipList()  # user_id, ascending
+        self.rewards: Dict[int, Tuple[int, str, Optional[str]]] = {}  # level -> (id, role_id, role_name)
+        self.settings: Optional[Dict[str, Any]] = None
+        self.role_sync: Optional[RoleSyncProgress] = None
+
+    def set_xp(self, user_id: str, member: _Member, xp: int) -> None:
+        if member.xp == xp and user_id in self.members:
+            return
+        if user_id in self.members:
+            self.order.remove((-member.xp, user_id))
+        else:
+            self.ids.insert(user_id)
+        member.xp = xp
+        member.level = calculate_level(xp)
+        self.order.insert((-xp, user_id))
+        self.members[user_id] = member
+
+
+class InMemoryStorage(Storage):
+    """Storage kept entirely in memory, optionally snapshotted to a JSON file."""
+
+    backend_name = "memory"
+
+    def __init__(self, snapshot_path: Optional[str] = None):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._guilds: Dict[str, _Guild] = {}
+        self._welcome_logs: List[Tuple[str, str, Optional[str], datetime]] = []
+        self._next_id = 1
+        self._initialized = False
+
+    def _require_initialized(self) -> None:
+        if not self._initialized:
+            raise RuntimeError("storage is not initialized")
+
+    def _find(self, guild_id: str) -> Optional[_Guild]:
+        """Look a guild up for reading; unknown guilds are not created."""
+        self._require_initialized()
+        return self._guilds.get(guild_id)
+
+    def _guild(self, guild_id: str) -> _Guild:
+        """Look a guild up for writing, creating it on first use."""
+        self._require_initialized()
+        guild = self._guilds.get(guild_id)
+        if guild is None:
+            guild = self._guilds[guild_id] = _Guild()
+        return guild
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _member(self, guild: _Guild, user_id: str, username: Optional[str]) -> _Member:
+        member = guild.members.get(user_id)
+        if member is None:
+            member = _Member(self._new_id(), username)
+            guild.set_xp(user_id, member, 0)
+        return member
+
+    async def initialize(self) -> None:
+        if self._initialized:
+            return
+        if self.snapshot_path is not None and self.snapshot_path.exists():
+            text = await asyncio.to_thread(self.snapshot_path.read_text, "utf-8")
+            self._restore(json.loads(text))
+        self._initialized = True
+
+    async def close(self) -> None:
+        if self._initialized and self.snapshot_path is not None:
+            await self.snapshot()
+        self._initialized = False
+
+    async def snapshot(self) -> None:
+        """Write the current state to ``snapshot_path`` atomically."""
+        if self.snapshot_path is None:
+            return
+        # Capture on the loop so the snapshot is consistent; encode and write off it.
+        state = self._dump()
+        await asyncio.to_thread(self._write_snapshot, state)
+
+    def _write_snapshot(self, state: Dict[str, Any]) -> None:
+        path = self.snapshot_path
+        if path.parent != Path("."):
+            path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_text(json.dumps(state, separators=(",", ":")), "utf-8")
+        os.replace(temporary, path)
+
+    def _dump(self) -> Dict[str, Any]:
+        guilds = {}
+        for guild_id, guild in self._guilds.items():
+            guilds[guild_id] = {
+                "members": [
+                    [user_id, m.id, m.username, m.xp, m.total_messages,
+                     _timestamp(m.last_xp_time), _timestamp(m.created_at)]
+                    for user_id, m in guild.members.items()
+                ],
+                "rewards": [[level, *reward] for level, reward in guild.rewards.items()],
+                "settings": guild.settings,
+                "role_sync": list(guild.role_sync) if guild.role_sync else None,
+            }
+        return {
+            "version": SNAPSHOT_VERSION,
+            "next_id": self._next_id,
+            "guilds": guilds,
+            "welcome_logs": [[*entry[:3], _timestamp(entry[3])] for entry in self._welcome_logs],
+        }
+
+    def _restore(self, state: Dict[str, Any]) -> None:
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise RuntimeError(f"unsupported snapshot version: {state.get('version')}")
+        self._guilds = {}
+        for guild_id, data in state["guilds"].items():
+            guild = self._guilds[guild_id] = _Guild()
+            for user_id, id_, username, xp, total_messages, last_xp_time, created_at in data["members"]:
+                guild.members[user_id] = _Member(
+                    id_, username, xp, calculate_level(xp), total_messages,
+                    _parse_timestamp(last_xp_time), _parse_timestamp(created_at),
+                )
+            guild.order = SkipList.from_sorted(
+                sorted((-m.xp, user_id) for user_id, m in guild.members.items())
+            )
+            guild.ids = SkipList.from_sorted(sorted(guild.members))
+            guild.rewards = {level: (id_, role_id, role_name) for level, id_, role_id, role_name in data["rewards"]}
+            guild.settings = data["settings"]
+            guild.role_sync = RoleSyncProgress(*data["role_sync"]) if data["role_sync"] else None
+        self._welcome_logs = [
+            (guild_id, user_id, username, _parse_timestamp(joined_at))
+            for guild_id, user_id, username, joined_at in state["welcome_logs"]
+        ]
+        self._next_id = state["next_id"]
+
+    def _find_member(self, guild_id: str, user_id: str) -> Optional[_Member]:
+        guild = self._find(guild_id)
+        return guild.members.get(user_id) if guild is not None else None
+
+    async def get_user_level(self, guild_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        member = self._find_member(guild_id, user_id)
+        return member.row(guild_id, user_id) if member else None
+
+    async def get_user_levels_many(
+        self, keys: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        found = {}
+        for guild_id, user_id in keys:
+            member = self._find_member(guild_id, user_id)
+            if member is not None:
+                found[(guild_id, user_id)] = member.row(guild_id, user_id)
+        return found
+
+    async def add_xp(
+        self, guild_id: str, user_id: str, username: str, xp_amount: int
+    ) -> Tuple[int, int, bool]:
+        guild = self._guild(guild_id)
+        member = self._member(guild, user_id, username)
+        old_level = member.level
+        guild.set_xp(user_id, member, member.xp + xp_amount)
+        member.username = username
+        member.total_messages += 1
+        member.last_xp_time = _now()
+        return member.level, member.xp, member.level > old_level
+
+    async def add_xp_many(self, awards: Iterable[XPAward]) -> XPResults:
+        now = _now()
+        results: XPResults = {}
+        for award in merge_xp_awards(awards):
+            guild = self._guild(award.guild_id)
+            existing = award.user_id in guild.members
+            member = self._member(guild, award.user_id, award.username)
+            old_level = calculate_level(member.xp) if existing else 1
+            guild.set_xp(award.user_id, member, member.xp + award.xp)
+            member.username = award.username
+            member.total_messages += award.messages
+            if award.last_xp_time is not None:
+                awarded_at = datetime.fromtimestamp(award.last_xp_time, timezone.utc)
+                if member.last_xp_time is None or awarded_at > member.last_xp_time:
+                    member.last_xp_time = awarded_at
+            elif member.last_xp_time is None:
+                member.last_xp_time = now
+            results[(award.guild_id, award.user_id)] = (member.level, member.xp, member.level > old_level)
+        return results
+
+    async def claim_xp_cooldown(
+        self, guild_id: str, user_id: str, username: str, cooldown_seconds: int
+    ) -> bool:
+        guild = self._guild(guild_id)
+        member = self._member(guild, user_id, username)
+        now = _now()
+        if member.last_xp_time is not None and member.last_xp_time > now - timedelta(seconds=cooldown_seconds):
+            return False
+        member.last_xp_time = now
+        return True
+
+    def _page(self, guild_id: str, after: Optional[Tuple[int, str]], limit: int) -> List[Dict[str, Any]]:
+        guild = self._find(guild_id)
+        if guild is None:
+            return []
+        return [
+            guild.members[user_id].row(guild_id, user_id)
+            for _, user_id in islice(guild.order.iter_from(after), limit)
+        ]
+
+    async def get_leaderboard(self, guild_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return self._page(guild_id, None, limit)
+
+    async def get_leaderboard_after(
+        self, guild_id: str, xp: int, user_id: str, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        return self._page(guild_id, (-xp, user_id), limit)
+
+    async def get_members_from_level(
+        self, guild_id: str, min_level: int, after_user_id: Optional[str] = None, limit: int = 200
+    ) -> List[Dict[str, Any]]:
+        guild = self._find(guild_id)
+        if guild is None:
+            return []
+        rows = []
+        for user_id in guild.ids.iter_from(after_user_id):
+            if len(rows) >= limit:
+                break
+            member = guild.members[user_id]
+            if member.level >= min_level:
+                rows.append({"user_id": user_id, "xp": member.xp, "level": member.level})
+        return rows
+
+    async def get_guild_levels(self, guild_id: str) -> List[Dict[str, Any]]:
+        guild = self._find(guild_id)
+        if guild is None:
+            return []
+        return [
+            {"user_id": user_id, "username": member.username, "xp": member.xp}
+            for user_id, member in guild.members.items()
+        ]
+
+    async def get_user_rank(self, guild_id: str, user_id: str) -> Optional[int]:
+        guild = self._find(guild_id)
+        member = guild.members.get(user_id) if guild is not None else None
+        if member is None:
+            # Matches the SQL backends, whose COUNT(xp > NULL) + 1 is 1.
+            return 1
+        return guild.order.bisect_left((-member.xp, "")) + 1
+
+    async def add_level_reward(
+        self, guild_id: str, level: int, role_id: str, role_name: str
+    ) -> None:
+        rewards = self._guild(guild_id).rewards
+        current = rewards.get(level)
+        rewards[level] = (current[0] if current else self._new_id(), role_id, role_name)
+
+    def _reward_row(self, guild_id: str, level: int, reward: Tuple[int, str, Optional[str]]) -> Dict[str, Any]:
+        id_, role_id, role_name = reward
+        return {"id": id_, "guild_id": guild_id, "level": level, "role_id": role_id, "role_name": role_name}
+
+    def _rewards(self, guild_id: str) -> Dict[int, Tuple[int, str, Optional[str]]]:
+        guild = self._find(guild_id)
+        return guild.rewards if guild is not None else {}
+
+    async def get_level_reward(self, guild_id: str, level: int) -> Optional[Dict[str, Any]]:
+        reward = self._rewards(guild_id).get(level)
+        return self._reward_row(guild_id, level, reward) if reward else None
+
+    async def get_all_level_rewards(self, guild_id: str) -> List[Dict[str, Any]]:
+        rewards = self._rewards(guild_id)
+        return [self._reward_row(guild_id, level, rewards[level]) for level in sorted(rewards)]
+
+    async def remove_level_reward(self, guild_id: str, level: int) -> bool:
+        return self._rewards(guild_id).pop(level, None) is not None
+
+    def _settings(self, guild_id: str) -> Dict[str, Any]:
+        guild = self._find(guild_id)
+        settings = guild.settings if guild is not None else None
+        return dict(settings or DEFAULT_SETTINGS, guild_id=guild_id)
+
+    async def get_guild_settings(self, guild_id: str) -> Dict[str, Any]:
+        return self._settings(guild_id)
+
+    async def get_guild_settings_many(self, guild_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        return {guild_id: self._settings(guild_id) for guild_id in guild_ids}
+
+    async def update_guild_settings(self, guild_id: str, **kwargs: Any) -> None:
+        values = {key: value for key, value in kwargs.items() if key in ALLOWED_SETTINGS}
+        if values:
+            guild = self._guild(guild_id)
+            if guild.settings is None:
+                guild.settings = dict(DEFAULT_SETTINGS)
+            guild.settings.update(values)
+
+    async def log_welcome(self, guild_id: str, user_id: str, username: str) -> None:
+        self._require_initialized()
+        self._welcome_logs.append((guild_id, user_id, username, _now()))
+
+    async def log_welcome_many(self, entries: Iterable[WelcomeLog]) -> None:
+        self._require_initialized()
+        now = _now()
+        for guild_id, user_id, username in entries:
+            self._welcome_logs.append((guild_id, user_id, username, now))
+
+    async def get_role_sync_progress(self, guild_id: str) -> Optional[RoleSyncProgress]:
+        guild = self._find(guild_id)
+        return guild.role_sync if guild is not None else None
+
+    async def save_role_sync_progress(self, guild_id: str, progress: RoleSyncProgress) -> None:
+        self._guild(guild_id).role_sync = RoleSyncProgress(*progress)
@@ -0,0 +1,250 @@
+"""Versioned schema migrations applied by the storage backends in initialize().
+
+The base schema (``SQLITE_SCHEMA`` / ``POSTGRES_SCHEMA``) stays idempotent and
+creates the tables; everything after that is an ordered, numbered step recorded
+in ``schema_migrations`` so it runs exactly once per database.
+
+Steps marked ``concurrent`` only matter on PostgreSQL: they run outside a
+transaction (``CREATE INDEX CONCURRENTLY`` requires that) in a background task
+after startup, so a long index build never blocks the bot from connecting.
+If another process holds the migration lock they wait and retry with backoff.
+They must not be prerequisites of later transactional steps.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger("discord_stockbot.storage")
+
+# Arbitrary constant used with pg_advisory_lock so concurrent bot processes
+# do not apply the same migration twice.
+MIGRATION_LOCK_ID = 0x5EED_DB01
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sqlite: Sequence[str] = ()
+    postgres: Sequence[str] = ()
+    concurrent: bool = False
+    # Index built by a concurrent step; an invalid leftover from an
+    # interrupted build is dropped before retrying.
+    index_name: Optional[str] = None
+
+
+MIGRATIONS: Tuple[Migration, ...] = (
+    Migration(
+        1,
+        "user_levels_guild_xp_index",
+        sqlite=(
+            "CREATE INDEX IF NOT EXISTS idx_user_levels_guild_xp "
+            "ON user_levels (guild_id, xp DESC, user_id)",
+        ),
+        postgres=(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_levels_guild_xp "
+            "ON user_levels (guild_id, xp DESC, user_id)",
+        ),
+        concurrent=True,
+        index_name="idx_user_levels_guild_xp",
+    ),
+    Migration(
+        2,
+        "role_sync_progress",
+        sqlite=(
+            """
+            CREATE TABLE IF NOT EXISTS role_sync_progress (
+                guild_id TEXT PRIMARY KEY,
+                cursor_xp INTEGER,
+                cursor_user_id TEXT,
+                scanned INTEGER NOT NULL DEFAULT 0,
+                granted INTEGER NOT NULL DEFAULT 0,
+                skipped INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                done INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ),
+        postgres=(
+            """
+            CREATE TABLE IF NOT EXISTS role_sync_progress (
+                guild_id TEXT PRIMARY KEY,
+                cursor_xp BIGINT,
+                cursor_user_id TEXT,
+                scanned BIGINT NOT NULL DEFAULT 0,
+                granted BIGINT NOT NULL DEFAULT 0,
+                skipped BIGINT NOT NULL DEFAULT 0,
+                failed BIGINT NOT NULL DEFAULT 0,
+                done BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ),
+    ),
+    Migration(
+        3,
+        "sqlite_last_xp_time_epoch",
+        # SQLite compared ISO-8601 strings of mixed precision lexically; store
+        # Unix seconds instead. PostgreSQL already uses TIMESTAMPTZ.
+        sqlite=(
+            """
+            UPDATE user_levels
+            SET last_xp_time = (julianday(last_xp_time) - 2440587.5) * 86400.0
+            WHERE typeof(last_xp_time) = 'text'
+            """,
+        ),
+    ),
+    Migration(
+        4,
+        "role_sync_user_id_cursor",
+        # Role syncs page by user_id now; a saved leaderboard-order cursor
+        # would skip members, so unfinished syncs restart from the beginning.
+        sqlite=(
+            "UPDATE role_sync_progress SET cursor_user_id = NULL WHERE done = 0",
+            "ALTER TABLE role_sync_progress DROP COLUMN cursor_xp",
+        ),
+        postgres=(
+            "UPDATE role_sync_progress SET cursor_user_id = NULL WHERE NOT done",
+            "ALTER TABLE role_sync_progress DROP COLUMN IF EXISTS cursor_xp",
+        ),
+    ),
+)
+
+
+SQLITE_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+POSTGRES_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+
+def pending(migrations: Iterable[Migration], applied: Iterable[int]) -> List[Migration]:
+    done = set(applied)
+    return sorted((m for m in migrations if m.version not in done), key=lambda m: m.version)
+
+
+async def apply_sqlite(conn, migrations: Sequence[Migration] = MIGRATIONS) -> List[int]:
+    """Apply pending steps, one transaction each. Returns the versions applied."""
+    await conn.execute(SQLITE_VERSION_TABLE)
+    await conn.commit()
+    cursor = await conn.execute("SELECT version FROM schema_migrations")
+    applied = [row[0] for row in await cursor.fetchall()]
+    done = []
+    for migration in pending(migrations, applied):
+        await conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in migration.sqlite:
+                await conn.execute(statement)
+            await conn.execute(
+                "INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (?, ?)",
+                (migration.version, migration.name),
+            )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+        done.append(migration.version)
+    return done
+
+
+async def apply_postgres(conn, migrations: Sequence[Migration] = MIGRATIONS) -> List[Migration]:
+    """Apply pending transactional steps; return the concurrent ones still to run."""
+    await conn.execute(POSTGRES_VERSION_TABLE)
+    deferred = []
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+        applied = [row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")]
+        for migration in pending(migrations, applied):
+            if migration.concurrent:
+                deferred.append(migration)
+                continue
+            for statement in migration.postgres:
+                await conn.execute(statement)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                migration.version,
+                migration.name,
+            )
+    return deferred
+
+
+async def apply_postgres_concurrent(
+    pool,
+    migrations: Sequence[Migration],
+    retry_delay: float = 5.0,
+    max_retry_delay: float = 300.0,
+    sleep: Callable[[float], Awaitable[object]] = asyncio.sleep,
+) -> List[int]:
+    """Run deferred steps outside any transaction.
+
+    While another process holds the migration lock the steps are deferred and
+    retried with exponential backoff; steps that process applies in the
+    meantime are skipped. Returns the versions applied here.
+    """
+    delay = retry_delay
+    while True:
+        done = await _apply_postgres_concurrent_locked(pool, migrations)
+        if done is not None:
+            return done
+        logger.warning(
+            "migration lock held by another process; deferring %d concurrent step(s), retrying in %.0fs",
+            len(migrations),
+            delay,
+        )
+        await sleep(delay)
+        delay = min(delay * 2, max_retry_delay)
+
+
+async def _apply_postgres_concurrent_locked(pool, migrations: Sequence[Migration]) -> Optional[List[int]]:
+    """One attempt; ``None`` when the lock is busy. No connection is held while waiting."""
+    done = []
+    async with pool.acquire() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+            return None
+        try:
+            for migration in migrations:
+                exists = await conn.fetchval(
+                    "SELECT 1 FROM schema_migrations WHERE version = $1", migration.version
+                )
+                if exists:
+                    continue
+                if migration.index_name:
+                    await _drop_invalid_index(conn, migration.index_name)
+                for statement in migration.postgres:
+                    await conn.execute(statement)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2) "
+                    "ON CONFLICT (version) DO NOTHING",
+                    migration.version,
+                    migration.name,
+                )
+                done.append(migration.version)
+                logger.info("applied migration %s (%s)", migration.version, migration.name)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+    return done
+
+
+async def _drop_invalid_index(conn, index_name: str) -> None:
+    invalid = await conn.fetchval(
+        """
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = $1 AND NOT i.indisvalid
+        """,
+        index_name,
+    )
+    if invalid:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
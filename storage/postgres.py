@@ -2,12 +2,17 @@
 
 from __future__ import annotations
 
+import asyncio
+import logging
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import asyncpg
 
-from .base import Storage, calculate_level
+from . import migrations
+from .base import (
+    RoleSyncProgress, Storage, WelcomeLog, XPAward, XPResults, calculate_level, merge_xp_awards,
+)
 from .sqlite import ALLOWED_SETTINGS
 
 
@@ -52,16 +57,78 @@ CREATE TABLE IF NOT EXISTS welcome_logs (
 """
 
 
+# One statement for a whole batch: the arrays are zipped by UNNEST and the
+# level is recomputed in SQL with the same formula as calculate_level().
+ADD_XP_MANY_SQL = """
+INSERT INTO user_levels AS u
+    (guild_id, user_id, username, xp, level, total_messages, last_xp_time)
+SELECT guild_id, user_id, username, xp, 1 + floor(sqrt(xp / 100.0))::int, messages, $6
+FROM UNNEST($1::text[], $2::text[], $3::text[], $4::bigint[], $5::bigint[])
+    AS incoming(guild_id, user_id, username, xp, messages)
+ON CONFLICT (guild_id, user_id) DO UPDATE SET
+    xp = u.xp + excluded.xp,
+    level = 1 + floor(sqrt((u.xp + excluded.xp) / 100.0))::int,
+    username = excluded.username,
+    total_messages = u.total_messages + excluded.total_messages,
+    last_xp_time = COALESCE(u.last_xp_time, excluded.last_xp_time)
+RETURNING guild_id, user_id, xp, level
+"""
+
+# Single-statement award: the row lock taken by ON CONFLICT serialises
+# concurrent awards, so xp - $4 in RETURNING is exactly this award's starting
+# point (0 for a fresh row) and old_level is derived from it. asyncpg prepares
+# and caches the statement per connection, and no explicit transaction is
+# needed for one statement.
+ADD_XP_SQL = """
+INSERT INTO user_levels AS u
+    (guild_id, user_id, username, xp, level, total_messages, last_xp_time)
+VALUES ($1, $2, $3, $4::bigint, 1 + floor(sqrt($4::bigint / 100.0))::int, 1, $5)
+ON CONFLICT (guild_id, user_id) DO UPDATE SET
+    xp = u.xp + excluded.xp,
+    level = 1 + floor(sqrt((u.xp + excluded.xp) / 100.0))::int,
+    username = excluded.username,
+    total_messages = u.total_messages + 1,
+    last_xp_time = excluded.last_xp_time
+RETURNING xp, level, 1 + floor(sqrt(greatest(xp - $4::bigint, 0) / 100.0))::int AS old_level
+"""
+
+# Conditional upsert on last_xp_time using the database clock, so every
+# process agrees on when a cooldown started. The row lock serialises
+# concurrent claims; the loser re-checks the WHERE and gets no row back.
+CLAIM_COOLDOWN_SQL = """
+INSERT INTO user_levels AS u (guild_id, user_id, username, last_xp_time)
+VALUES ($1, $2, $3, now())
+ON CONFLICT (guild_id, user_id) DO UPDATE SET last_xp_time = excluded.last_xp_time
+WHERE u.last_xp_time IS NULL
+   OR u.last_xp_time <= excluded.last_xp_time - make_interval(secs => $4)
+RETURNING 1
+"""
+
+
+logger = logging.getLogger("discord_stockbot.storage")
+
+# NOTIFY channel used to invalidate guild settings caches in other processes.
+SETTINGS_CHANNEL = "guild_settings_changed"
+
+
 class PostgresStorage(Storage):
     """PostgreSQL implementation backed by an asyncpg connection pool."""
 
     backend_name = "postgres"
+    shared_cooldowns = True
+    # Backoff between attempts to re-establish a lost LISTEN connection.
+    listener_retry_delay = 1.0
+    listener_retry_max_delay = 60.0
 
     def __init__(self, dsn: str, min_pool_size: int = 1, max_pool_size: int = 5):
         self._dsn = dsn
         self._min_pool_size = min_pool_size
         self._max_pool_size = max_pool_size
         self._pool: Optional[asyncpg.Pool] = None
+        self._listener: Optional[asyncpg.Connection] = None
+        self._listener_callback: Optional[Callable[[Optional[str]], None]] = None
+        self._listener_reconnect: Optional[asyncio.Task] = None
+        self._background_migrations: Optional[asyncio.Task] = None
 
     def _require_pool(self) -> asyncpg.Pool:
         if self._pool is None:
@@ -80,12 +147,40 @@ class PostgresStorage(Storage):
         try:
             async with self._pool.acquire() as conn:
                 await conn.execute(POSTGRES_SCHEMA)
+                deferred = await migrations.apply_postgres(conn)
         except Exception:
             await self._pool.close()
             self._pool = None
             raise
+        if deferred:
+            # CONCURRENTLY builds can take a while on large tables; the bot
+            # does not need to wait for them to serve requests.
+            self._background_migrations = asyncio.get_running_loop().create_task(
+                self._run_background_migrations(deferred)
+            )
+
+    async def _run_background_migrations(self, deferred) -> None:
+        try:
+            await migrations.apply_postgres_concurrent(self._require_pool(), deferred)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.warning("background migration failed (%s); will retry on next start", type(exc).__name__)
 
     async def close(self) -> None:
+        self._listener_callback = None
+        for name in ("_background_migrations", "_listener_reconnect"):
+            task = getattr(self, name)
+            setattr(self, name, None)
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            await listener.close()
         if self._pool is not None:
             await self._pool.close()
             self._pool = None
@@ -98,66 +193,116 @@ class PostgresStorage(Storage):
         )
         return dict(row) if row else None
 
+    async def get_user_levels_many(
+        self, keys: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        rows = await self._require_pool().fetch(
+            """
+            SELECT u.* FROM user_levels u
+            JOIN UNNEST($1::text[], $2::text[]) AS wanted(guild_id, user_id)
+                ON u.guild_id = wanted.guild_id AND u.user_id = wanted.user_id
+            """,
+            [guild_id for guild_id, _ in keys],
+            [user_id for _, user_id in keys],
+        )
+        return {(row["guild_id"], row["user_id"]): dict(row) for row in rows}
+
     async def add_xp(
         self, guild_id: str, user_id: str, username: str, xp_amount: int
     ) -> Tuple[int, int, bool]:
-        async with self._require_pool().acquire() as conn:
-            async with conn.transaction():
-                await conn.execute(
-                    "SELECT pg_advisory_xact_lock(hashtextextended($1, 0))",
-                    f"{guild_id}:{user_id}",
-                )
-                row = await conn.fetchrow(
-                    "SELECT xp, level FROM user_levels WHERE guild_id = $1 AND user_id = $2",
-                    guild_id,
-                    user_id,
-                )
-                now = datetime.now(timezone.utc)
-                if row:
-                    old_level = int(row["level"])
-                    new_xp = int(row["xp"]) + xp_amount
-                    new_level = calculate_level(new_xp)
-                    await conn.execute(
-                        """
-                        UPDATE user_levels
-                        SET xp = $1, level = $2, username = $3,
-                            total_messages = total_messages + 1, last_xp_time = $4
-                        WHERE guild_id = $5 AND user_id = $6
-                        """,
-                        new_xp,
-                        new_level,
-                        username,
-                        now,
-                        guild_id,
-                        user_id,
-                    )
-                else:
-                    old_level = 1
-                    new_xp = xp_amount
-                    new_level = calculate_level(new_xp)
-                    await conn.execute(
-                        """
-                        INSERT INTO user_levels
-                            (guild_id, user_id, username, xp, level, total_messages, last_xp_time)
-                        VALUES ($1, $2, $3, $4, $5, 1, $6)
-                        """,
-                        guild_id,
-                        user_id,
-                        username,
-                        new_xp,
-                        new_level,
-                        now,
-                    )
+        row = await self._require_pool().fetchrow(
+            ADD_XP_SQL, guild_id, user_id, username, xp_amount, datetime.now(timezone.utc)
+        )
+        new_level = int(row["level"])
+        new_xp = int(row["xp"])
+        old_level = int(row["old_level"])
         return new_level, new_xp, new_level > old_level
 
+    async def add_xp_many(self, awards: Iterable[XPAward]) -> XPResults:
+        awards = merge_xp_awards(awards)
+        if not awards:
+            return {}
+        deltas = {(award.guild_id, award.user_id): award.xp for award in awards}
+        rows = await self._require_pool().fetch(
+            ADD_XP_MANY_SQL,
+            [award.guild_id for award in awards],
+            [award.user_id for award in awards],
+            [award.username for award in awards],
+            [award.xp for award in awards],
+            [award.messages for award in awards],
+            datetime.now(timezone.utc),
+        )
+        results: XPResults = {}
+        for row in rows:
+            key = (row["guild_id"], row["user_id"])
+            new_xp = int(row["xp"])
+            new_level = int(row["level"])
+            old_xp = new_xp - deltas[key]
+            old_level = calculate_level(old_xp) if old_xp > 0 else 1
+            results[key] = (new_level, new_xp, new_level > old_level)
+        return results
+
+    async def claim_xp_cooldown(
+        self, guild_id: str, user_id: str, username: str, cooldown_seconds: int
+    ) -> bool:
+        claimed = await self._require_pool().fetchval(
+            CLAIM_COOLDOWN_SQL, guild_id, user_id, username, float(cooldown_seconds)
+        )
+        return claimed is not None
+
     async def get_leaderboard(self, guild_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         rows = await self._require_pool().fetch(
-            "SELECT * FROM user_levels WHERE guild_id = $1 ORDER BY xp DESC LIMIT $2",
+            "SELECT * FROM user_levels WHERE guild_id = $1 ORDER BY xp DESC, user_id LIMIT $2",
+            guild_id,
+            limit,
+        )
+        return [dict(row) for row in rows]
+
+    async def get_leaderboard_after(
+        self, guild_id: str, xp: int, user_id: str, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        # Mixed sort directions rule out a (xp, user_id) row comparison; the
+        # expanded form still walks idx_user_levels_guild_xp from the cursor.
+        rows = await self._require_pool().fetch(
+            """
+            SELECT * FROM user_levels
+            WHERE guild_id = $1 AND (xp < $2 OR (xp = $2 AND user_id > $3))
+            ORDER BY xp DESC, user_id LIMIT $4
+            """,
+            guild_id,
+            xp,
+            user_id,
+            limit,
+        )
+        return [dict(row) for row in rows]
+
+    async def get_members_from_level(
+        self, guild_id: str, min_level: int, after_user_id: Optional[str] = None, limit: int = 200
+    ) -> List[Dict[str, Any]]:
+        # Walks the (guild_id, user_id) unique index from the cursor.
+        rows = await self._require_pool().fetch(
+            """
+            SELECT user_id, xp, level FROM user_levels
+            WHERE guild_id = $1 AND level >= $2 AND user_id > $3
+            ORDER BY user_id LIMIT $4
+            """,
             guild_id,
+            min_level,
+            after_user_id or "",
             limit,
         )
         return [dict(row) for row in rows]
 
+    async def get_guild_levels(self, guild_id: str) -> List[Dict[str, Any]]:
+        rows = await self._require_pool().fetch(
+            "SELECT user_id, username, xp FROM user_levels WHERE guild_id = $1",
+            guild_id,
+        )
+        return [dict(row) for row in rows]
+
     async def get_user_rank(self, guild_id: str, user_id: str) -> Optional[int]:
         row = await self._require_pool().fetchrow(
             """
@@ -211,16 +356,40 @@ class PostgresStorage(Storage):
         return result == "DELETE 1"
 
     async def get_guild_settings(self, guild_id: str) -> Dict[str, Any]:
-        row = await self._require_pool().fetchrow(
-            """
-            INSERT INTO guild_settings (guild_id) VALUES ($1)
-            ON CONFLICT(guild_id) DO UPDATE SET guild_id = excluded.guild_id
-            RETURNING *
-            """,
-            guild_id,
-        )
+        pool = self._require_pool()
+        row = await pool.fetchrow("SELECT * FROM guild_settings WHERE guild_id = $1", guild_id)
+        if row is None:
+            # Only the first read for a guild writes its default row.
+            row = await pool.fetchrow(
+                """
+                INSERT INTO guild_settings (guild_id) VALUES ($1)
+                ON CONFLICT(guild_id) DO UPDATE SET guild_id = excluded.guild_id
+                RETURNING *
+                """,
+                guild_id,
+            )
         return dict(row)
 
+    async def get_guild_settings_many(self, guild_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        guild_ids = list(dict.fromkeys(guild_ids))
+        if not guild_ids:
+            return {}
+        pool = self._require_pool()
+        rows = await pool.fetch("SELECT * FROM guild_settings WHERE guild_id = ANY($1::text[])", guild_ids)
+        found = {row["guild_id"]: dict(row) for row in rows}
+        missing = [guild_id for guild_id in guild_ids if guild_id not in found]
+        if missing:
+            rows = await pool.fetch(
+                """
+                INSERT INTO guild_settings (guild_id) SELECT UNNEST($1::text[])
+                ON CONFLICT(guild_id) DO UPDATE SET guild_id = excluded.guild_id
+                RETURNING *
+                """,
+                missing,
+            )
+            found.update((row["guild_id"], dict(row)) for row in rows)
+        return found
+
     async def update_guild_settings(self, guild_id: str, **kwargs: Any) -> None:
         values = [(key, value) for key, value in kwargs.items() if key in ALLOWED_SETTINGS]
         if not values:
@@ -231,12 +400,64 @@ class PostgresStorage(Storage):
         updates = ", ".join(f"{key} = excluded.{key}" for key, _ in values)
         await self._require_pool().execute(
             f"""
-            INSERT INTO guild_settings ({', '.join(columns)}) VALUES ({placeholders})
-            ON CONFLICT(guild_id) DO UPDATE SET {updates}
+            WITH changed AS (
+                INSERT INTO guild_settings ({', '.join(columns)}) VALUES ({placeholders})
+                ON CONFLICT(guild_id) DO UPDATE SET {updates}
+                RETURNING guild_id
+            )
+            SELECT pg_notify('{SETTINGS_CHANNEL}', guild_id) FROM changed
             """,
             *params,
         )
 
+    async def listen_settings_changes(self, callback: Callable[[Optional[str]], None]) -> None:
+        if self._listener_callback is not None:
+            return
+        self._listener = await self._connect_listener(callback)
+        self._listener_callback = callback
+
+    async def _connect_listener(self, callback: Callable[[Optional[str]], None]) -> asyncpg.Connection:
+        # LISTEN needs a dedicated connection; a pooled one would be recycled.
+        listener = await asyncpg.connect(dsn=self._dsn)
+        try:
+            await listener.add_listener(
+                SETTINGS_CHANNEL, lambda _conn, _pid, _channel, payload: callback(payload)
+            )
+        except BaseException:
+            await listener.close()
+            raise
+        listener.add_termination_listener(self._on_listener_terminated)
+        return listener
+
+    def _on_listener_terminated(self, connection: asyncpg.Connection) -> None:
+        if connection is not self._listener or self._listener_callback is None:
+            return  # closed on purpose by close()
+        self._listener = None
+        logger.warning("settings listener connection lost; reconnecting")
+        self._listener_reconnect = asyncio.get_running_loop().create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self) -> None:
+        delay = self.listener_retry_delay
+        while True:
+            await asyncio.sleep(delay)
+            callback = self._listener_callback
+            if callback is None:
+                return
+            try:
+                listener = await self._connect_listener(callback)
+            except Exception as exc:
+                delay = min(delay * 2, self.listener_retry_max_delay)
+                logger.warning(
+                    "settings listener reconnect failed (%s); retrying in %.0fs", type(exc).__name__, delay
+                )
+                continue
+            self._listener = listener
+            self._listener_reconnect = None
+            logger.info("settings listener reconnected")
+            # Notifications sent while disconnected are lost; drop every entry.
+            callback(None)
+            return
+
     async def log_welcome(self, guild_id: str, user_id: str, username: str) -> None:
         await self._require_pool().execute(
             "INSERT INTO welcome_logs (guild_id, user_id, username) VALUES ($1, $2, $3)",
@@ -244,3 +465,33 @@ class PostgresStorage(Storage):
             user_id,
             username,
         )
+
+    async def log_welcome_many(self, entries: Iterable[WelcomeLog]) -> None:
+        records = [tuple(entry) for entry in entries]
+        if not records:
+            return
+        # COPY streams the rows in one command; joined_at takes its default.
+        await self._require_pool().copy_records_to_table(
+            "welcome_logs", records=records, columns=list(WelcomeLog._fields)
+        )
+
+    async def get_role_sync_progress(self, guild_id: str) -> Optional[RoleSyncProgress]:
+        row = await self._require_pool().fetchrow(
+            f"SELECT {', '.join(RoleSyncProgress._fields)} FROM role_sync_progress WHERE guild_id = $1",
+            guild_id,
+        )
+        return RoleSyncProgress(**dict(row)) if row else None
+
+    async def save_role_sync_progress(self, guild_id: str, progress: RoleSyncProgress) -> None:
+        fields = RoleSyncProgress._fields
+        placeholders = ", ".join(f"${i}" for i in range(2, len(fields) + 2))
+        updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        await self._require_pool().execute(
+            f"""
+            INSERT INTO role_sync_progress (guild_id, {', '.join(fields)})
+            VALUES ($1, {placeholders})
+            ON CONFLICT (guild_id) DO UPDATE SET {updates}, updated_at = now()
+            """,
+            guild_id,
+            *progress,
+        )
@@ -3,13 +3,18 @@
 from __future__ import annotations
 
 import asyncio
-from datetime import datetime, timezone
+import re
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 
 import aiosqlite
 
-from .base import Storage, calculate_level
+from . import migrations
+from .base import (
+    RoleSyncProgress, Storage, WelcomeLog, XPAward, XPResults, calculate_level, merge_xp_awards,
+)
 
 
 SQLITE_SCHEMA = """
@@ -53,6 +58,11 @@ CREATE TABLE IF NOT EXISTS welcome_logs (
 """
 
 
+# Keys per lookup statement; two bound parameters each stays well under
+# SQLite's default variable limit.
+SQLITE_BATCH_KEYS = 400
+
+
 ALLOWED_SETTINGS = {
     "welcome_channel_id",
     "welcome_message",
@@ -64,14 +74,47 @@ ALLOWED_SETTINGS = {
 }
 
 
+# Tuning applied to every connection. WAL makes NORMAL durable against
+# application crashes (only an OS crash can lose the last commits), and lets
+# the read-only connections run alongside the writer.
+DEFAULT_PRAGMAS: Dict[str, Union[int, str]] = {
+    "synchronous": "NORMAL",
+    "mmap_size": 64 * 1024 * 1024,
+    "cache_size": -16000,  # KiB when negative
+    "busy_timeout": 5000,  # ms
+}
+_PRAGMA_VALUE = re.compile(r"^-?\d+$|^[A-Za-z]+$")
+
+
 class SQLiteStorage(Storage):
-    """A single-connection SQLite backend serialized with an async lock."""
+    """SQLite backend with one writer connection and a pool of read-only readers.
+
+    Writes are serialized on the writer with an async lock. Reads borrow a
+    reader connection and never wait for that lock; in WAL mode they see the
+    last committed state. With ``readers=0`` (or an in-memory database) reads
+    share the writer connection instead.
+    """
 
     backend_name = "sqlite"
 
-    def __init__(self, path: str):
+    def __init__(
+        self,
+        path: str,
+        readers: int = 4,
+        pragmas: Optional[Mapping[str, Union[int, str]]] = None,
+    ):
         self.path = Path(path)
+        self._pragmas = dict(DEFAULT_PRAGMAS)
+        for name, value in (pragmas or {}).items():
+            if name not in DEFAULT_PRAGMAS:
+                raise ValueError(f"unsupported SQLite pragma: {name}")
+            if not _PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f"invalid value for SQLite pragma {name}")
+            self._pragmas[name] = value
+        self._reader_count = 0 if str(path) == ":memory:" else max(0, readers)
         self._connection: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
         self._lock = asyncio.Lock()
 
     def _conn(self) -> aiosqlite.Connection:
@@ -85,26 +128,83 @@ class SQLiteStorage(Storage):
         if self.path.parent != Path("."):
             self.path.parent.mkdir(parents=True, exist_ok=True)
         self._connection = await aiosqlite.connect(self.path)
-        self._connection.row_factory = aiosqlite.Row
-        await self._connection.execute("PRAGMA journal_mode=WAL")
-        await self._connection.execute("PRAGMA foreign_keys=ON")
-        await self._connection.executescript(SQLITE_SCHEMA)
-        await self._connection.commit()
+        try:
+            self._connection.row_factory = aiosqlite.Row
+            await self._connection.execute("PRAGMA journal_mode=WAL")
+            await self._connection.execute("PRAGMA foreign_keys=ON")
+            await self._apply_pragmas(self._connection)
+            await self._connection.executescript(SQLITE_SCHEMA)
+            await self._connection.commit()
+            await migrations.apply_sqlite(self._connection)
+            # Readers open after the schema exists: mode=ro cannot create it.
+            uri = f"{self.path.resolve().as_uri()}?mode=ro"
+            for _ in range(self._reader_count):
+                reader = await aiosqlite.connect(uri, uri=True)
+                self._readers.append(reader)
+                reader.row_factory = aiosqlite.Row
+                await reader.execute("PRAGMA query_only=ON")
+                await self._apply_pragmas(reader)
+                self._idle_readers.put_nowait(reader)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _apply_pragmas(self, conn: aiosqlite.Connection) -> None:
+        for name, value in self._pragmas.items():
+            await conn.execute(f"PRAGMA {name}={value}")
 
     async def close(self) -> None:
+        readers, self._readers = self._readers, []
+        self._idle_readers = asyncio.Queue()
+        for reader in readers:
+            await reader.close()
         if self._connection is not None:
             await self._connection.close()
             self._connection = None
 
+    @asynccontextmanager
+    async def _read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a connection for a read-only query."""
+        if not self._readers:
+            async with self._lock:
+                yield self._conn()
+            return
+        idle = self._idle_readers
+        reader = await idle.get()
+        try:
+            yield reader
+        finally:
+            idle.put_nowait(reader)
+
     async def get_user_level(self, guild_id: str, user_id: str) -> Optional[Dict[str, Any]]:
-        async with self._lock:
-            cursor = await self._conn().execute(
+        async with self._read() as conn:
+            cursor = await conn.execute(
                 "SELECT * FROM user_levels WHERE guild_id = ? AND user_id = ?",
                 (guild_id, user_id),
             )
             row = await cursor.fetchone()
         return dict(row) if row else None
 
+    async def get_user_levels_many(
+        self, keys: Iterable[Tuple[str, str]]
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        keys = list(dict.fromkeys(keys))
+        found: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        async with self._read() as conn:
+            for start in range(0, len(keys), SQLITE_BATCH_KEYS):
+                chunk = keys[start:start + SQLITE_BATCH_KEYS]
+                placeholders = ", ".join("(?, ?)" for _ in chunk)
+                cursor = await conn.execute(
+                    f"""
+                    SELECT * FROM user_levels
+                    WHERE (guild_id, user_id) IN (VALUES {placeholders})
+                    """,
+                    [value for key in chunk for value in key],
+                )
+                for row in await cursor.fetchall():
+                    found[(row["guild_id"], row["user_id"])] = dict(row)
+        return found
+
     async def add_xp(
         self, guild_id: str, user_id: str, username: str, xp_amount: int
     ) -> Tuple[int, int, bool]:
@@ -117,7 +217,7 @@ class SQLiteStorage(Storage):
                     (guild_id, user_id),
                 )
                 row = await cursor.fetchone()
-                now = datetime.now(timezone.utc).isoformat()
+                now = time.time()
                 if row:
                     old_level = int(row["level"])
                     new_xp = int(row["xp"]) + xp_amount
@@ -149,18 +249,136 @@ class SQLiteStorage(Storage):
                 raise
         return new_level, new_xp, new_level > old_level
 
-    async def get_leaderboard(self, guild_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    async def add_xp_many(self, awards: Iterable[XPAward]) -> XPResults:
+        awards = merge_xp_awards(awards)
+        if not awards:
+            return {}
+        async with self._lock:
+            conn = self._conn()
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                current: Dict[Tuple[str, str], int] = {}
+                for start in range(0, len(awards), SQLITE_BATCH_KEYS):
+                    chunk = awards[start:start + SQLITE_BATCH_KEYS]
+                    placeholders = ", ".join("(?, ?)" for _ in chunk)
+                    params = [value for award in chunk for value in (award.guild_id, award.user_id)]
+                    cursor = await conn.execute(
+                        f"""
+                        SELECT guild_id, user_id, xp FROM user_levels
+                        WHERE (guild_id, user_id) IN (VALUES {placeholders})
+                        """,
+                        params,
+                    )
+                    for row in await cursor.fetchall():
+                        current[(row["guild_id"], row["user_id"])] = int(row["xp"])
+
+                now = time.time()
+                results: XPResults = {}
+                rows = []
+                for award in awards:
+                    key = (award.guild_id, award.user_id)
+                    old_xp = current.get(key)
+                    new_xp = (old_xp or 0) + award.xp
+                    old_level = calculate_level(old_xp) if old_xp is not None else 1
+                    new_level = calculate_level(new_xp)
+                    results[key] = (new_level, new_xp, new_level > old_level)
+                    rows.append(
+                        (award.guild_id, award.user_id, award.username, new_xp, new_level,
+                         award.messages, award.last_xp_time or now, award.last_xp_time)
+                    )
+                # last_xp_time is Unix seconds. Multi-argument MAX() is NULL if
+                # either side is, so the COALESCE keeps whichever one exists.
+                await conn.executemany(
+                    """
+                    INSERT INTO user_levels
+                        (guild_id, user_id, username, xp, level, total_messages, last_xp_time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+                        xp = excluded.xp,
+                        level = excluded.level,
+                        username = excluded.username,
+                        total_messages = user_levels.total_messages + excluded.total_messages,
+                        last_xp_time = COALESCE(
+                            MAX(user_levels.last_xp_time, ?8), user_levels.last_xp_time, ?8
+                        )
+                    """,
+                    rows,
+                )
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        return results
+
+    async def claim_xp_cooldown(
+        self, guild_id: str, user_id: str, username: str, cooldown_seconds: int
+    ) -> bool:
+        now = time.time()
         async with self._lock:
             cursor = await self._conn().execute(
-                "SELECT * FROM user_levels WHERE guild_id = ? ORDER BY xp DESC LIMIT ?",
+                """
+                INSERT INTO user_levels
+                    (guild_id, user_id, username, xp, level, total_messages, last_xp_time)
+                VALUES (?, ?, ?, 0, 1, 0, ?)
+                ON CONFLICT(guild_id, user_id) DO UPDATE SET last_xp_time = excluded.last_xp_time
+                WHERE user_levels.last_xp_time IS NULL OR user_levels.last_xp_time <= ?
+                """,
+                (guild_id, user_id, username, now, now - cooldown_seconds),
+            )
+            await self._conn().commit()
+        return cursor.rowcount > 0
+
+    async def get_leaderboard(self, guild_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                "SELECT * FROM user_levels WHERE guild_id = ? ORDER BY xp DESC, user_id LIMIT ?",
                 (guild_id, limit),
             )
             rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
+    async def get_leaderboard_after(
+        self, guild_id: str, xp: int, user_id: str, limit: int = 10
+    ) -> List[Dict[str, Any]]:
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                """
+                SELECT * FROM user_levels
+                WHERE guild_id = ? AND (xp < ? OR (xp = ? AND user_id > ?))
+                ORDER BY xp DESC, user_id LIMIT ?
+                """,
+                (guild_id, xp, xp, user_id, limit),
+            )
+            rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+    async def get_members_from_level(
+        self, guild_id: str, min_level: int, after_user_id: Optional[str] = None, limit: int = 200
+    ) -> List[Dict[str, Any]]:
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                """
+                SELECT user_id, xp, level FROM user_levels
+                WHERE guild_id = ? AND level >= ? AND user_id > ?
+                ORDER BY user_id LIMIT ?
+                """,
+                (guild_id, min_level, after_user_id or "", limit),
+            )
+            rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+    async def get_guild_levels(self, guild_id: str) -> List[Dict[str, Any]]:
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                "SELECT user_id, username, xp FROM user_levels WHERE guild_id = ?",
+                (guild_id,),
+            )
+            rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
     async def get_user_rank(self, guild_id: str, user_id: str) -> Optional[int]:
-        async with self._lock:
-            cursor = await self._conn().execute(
+        async with self._read() as conn:
+            cursor = await conn.execute(
                 """
                 SELECT COUNT(*) AS rank FROM user_levels
                 WHERE guild_id = ? AND xp > (
@@ -189,8 +407,8 @@ class SQLiteStorage(Storage):
             await self._conn().commit()
 
     async def get_level_reward(self, guild_id: str, level: int) -> Optional[Dict[str, Any]]:
-        async with self._lock:
-            cursor = await self._conn().execute(
+        async with self._read() as conn:
+            cursor = await conn.execute(
                 "SELECT * FROM level_rewards WHERE guild_id = ? AND level = ?",
                 (guild_id, level),
             )
@@ -198,8 +416,8 @@ class SQLiteStorage(Storage):
         return dict(row) if row else None
 
     async def get_all_level_rewards(self, guild_id: str) -> List[Dict[str, Any]]:
-        async with self._lock:
-            cursor = await self._conn().execute(
+        async with self._read() as conn:
+            cursor = await conn.execute(
                 "SELECT * FROM level_rewards WHERE guild_id = ? ORDER BY level ASC",
                 (guild_id,),
             )
@@ -216,21 +434,56 @@ class SQLiteStorage(Storage):
         return cursor.rowcount > 0
 
     async def get_guild_settings(self, guild_id: str) -> Dict[str, Any]:
-        async with self._lock:
-            conn = self._conn()
-            await conn.execute(
-                "INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?)",
-                (guild_id,),
-            )
-            await conn.commit()
+        async with self._read() as conn:
             cursor = await conn.execute(
                 "SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,)
             )
             row = await cursor.fetchone()
+        if row is None:
+            # Only the first read for a guild writes its default row.
+            async with self._lock:
+                conn = self._conn()
+                await conn.execute(
+                    "INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?)",
+                    (guild_id,),
+                )
+                await conn.commit()
+                cursor = await conn.execute(
+                    "SELECT * FROM guild_settings WHERE guild_id = ?", (guild_id,)
+                )
+                row = await cursor.fetchone()
         if row is None:
             raise RuntimeError("failed to create guild settings")
         return dict(row)
 
+    async def get_guild_settings_many(self, guild_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        guild_ids = list(dict.fromkeys(guild_ids))
+        found = await self._select_guild_settings(guild_ids)
+        missing = [guild_id for guild_id in guild_ids if guild_id not in found]
+        if missing:
+            async with self._lock:
+                conn = self._conn()
+                await conn.executemany(
+                    "INSERT OR IGNORE INTO guild_settings (guild_id) VALUES (?)",
+                    [(guild_id,) for guild_id in missing],
+                )
+                await conn.commit()
+            found.update(await self._select_guild_settings(missing))
+        return found
+
+    async def _select_guild_settings(self, guild_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        found: Dict[str, Dict[str, Any]] = {}
+        async with self._read() as conn:
+            for start in range(0, len(guild_ids), SQLITE_BATCH_KEYS):
+                chunk = guild_ids[start:start + SQLITE_BATCH_KEYS]
+                cursor = await conn.execute(
+                    f"SELECT * FROM guild_settings WHERE guild_id IN ({', '.join('?' for _ in chunk)})",
+                    chunk,
+                )
+                for row in await cursor.fetchall():
+                    found[row["guild_id"]] = dict(row)
+        return found
+
     async def update_guild_settings(self, guild_id: str, **kwargs: Any) -> None:
         values = [(key, value) for key, value in kwargs.items() if key in ALLOWED_SETTINGS]
         if not values:
@@ -254,3 +507,45 @@ class SQLiteStorage(Storage):
                 (guild_id, user_id, username),
             )
             await self._conn().commit()
+
+    async def log_welcome_many(self, entries: Iterable[WelcomeLog]) -> None:
+        rows = [tuple(entry) for entry in entries]
+        if not rows:
+            return
+        async with self._lock:
+            conn = self._conn()
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                await conn.executemany(
+                    "INSERT INTO welcome_logs (guild_id, user_id, username) VALUES (?, ?, ?)",
+                    rows,
+                )
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+
+    async def get_role_sync_progress(self, guild_id: str) -> Optional[RoleSyncProgress]:
+        async with self._read() as conn:
+            cursor = await conn.execute(
+                f"SELECT {', '.join(RoleSyncProgress._fields)} FROM role_sync_progress WHERE guild_id = ?",
+                (guild_id,),
+            )
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        return RoleSyncProgress(*row)._replace(done=bool(row["done"]))
+
+    async def save_role_sync_progress(self, guild_id: str, progress: RoleSyncProgress) -> None:
+        columns = ", ".join(RoleSyncProgress._fields)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in RoleSyncProgress._fields)
+        async with self._lock:
+            await self._conn().execute(
+                f"""
+                INSERT INTO role_sync_progress (guild_id, {columns})
+                VALUES (?, {', '.join('?' for _ in RoleSyncProgress._fields)})
+                ON CONFLICT(guild_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+                """,
+                (guild_id, *progress[:-1], int(progress.done)),
+            )
+            await self._conn().commit()
@@ -1,5 +1,6 @@
 import asyncio
 import importlib
+from types import SimpleNamespace
 
 import reliability
 
@@ -103,3 +104,76 @@ def test_signal_handler_marks_not_ready_and_closes(monkeypatch):
         assert not appmod.readiness.is_ready()
 
     asyncio.run(scenario())
+
+
+def test_unknown_symbol_does_not_cache_fundamentals(monkeypatch):
+    appmod = importlib.import_module("bot")
+    market = importlib.import_module("market")
+
+    class FakeYahoo:
+        async def quote(self, symbol):
+            await asyncio.sleep(0.05)
+            raise market.SymbolNotFound("not found", status=404)
+
+    class FakeQuotes:
+        def __init__(self):
+            self.calls = []
+
+        def get_quote(self, symbol):
+            self.calls.append(symbol)
+            raise RuntimeError("upstream down")
+
+    quotes = FakeQuotes()
+    monkeypatch.setattr(appmod, "_yahoo", FakeYahoo())
+    monkeypatch.setattr(appmod, "_quotes", quotes)
+    monkeypatch.setattr(appmod, "_fundamentals", market.TTLCache(maxsize=8, ttl=60))
+
+    assert asyncio.run(appmod.get_stock_info_async("NOPE")) is None
+    assert appmod._fundamentals.get("NOPE") is None
+
+
+class _StubQuotes:
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.searches = []
+
+    def search(self, query, limit):
+        self.searches.append(query)
+        return [SimpleNamespace(symbol=symbol) for symbol in self.symbols[:limit]]
+
+
+def test_symbol_search_falls_back_to_yolab_quote_when_native_client_fails(monkeypatch):
+    appmod = importlib.import_module("bot")
+    market = importlib.import_module("market")
+
+    class FailingYahoo:
+        async def search(self, query, limit):
+            raise market.YahooError("HTTP 503", status=503)
+
+    quotes = _StubQuotes(["NVDA"])
+    monkeypatch.setattr(appmod, "_yahoo", FailingYahoo())
+    monkeypatch.setattr(appmod, "_quotes", quotes)
+    monkeypatch.setattr(appmod, "_resolution_cache", market.ResolutionCache(maxsize=8))
+
+    assert asyncio.run(appmod.search_stock_by_name_async("nvidia")) == "NVDA"
+    assert quotes.searches == ["nvidia"]
+    assert appmod._resolution_cache.lookup("nvidia") == (True, "NVDA")
+
+
+def test_symbol_search_timeout_returns_none_without_caching(monkeypatch):
+    appmod = importlib.import_module("bot")
+    market = importlib.import_module("market")
+
+    class HangingYahoo:
+        async def search(self, query, limit):
+            await asyncio.sleep(10)
+
+    quotes = _StubQuotes(["NVDA"])
+    monkeypatch.setattr(appmod, "_yahoo", HangingYahoo())
+    monkeypatch.setattr(appmod, "_quotes", quotes)
+    monkeypatch.setattr(appmod, "_resolution_cache", market.ResolutionCache(maxsize=8))
+    monkeypatch.setattr(appmod, "SYMBOL_SEARCH_TIMEOUT", 0.01)
+
+    assert asyncio.run(appmod.search_stock_by_name_async("nvidia")) is None
+    assert quotes.searches == []
+    assert appmod._resolution_cache.lookup("nvidia") == (False, None)
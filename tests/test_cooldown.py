@@ -0,0 +1,47 @@
+from cooldown import CooldownTracker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_try_start_blocks_until_cooldown_expires():
+    clock = FakeClock()
+    tracker = CooldownTracker(clock=clock)
+
+    assert tracker.try_start(("g", "u"), 60) is True
+    assert tracker.active(("g", "u"))
+    assert tracker.try_start(("g", "u"), 60) is False
+    assert tracker.remaining(("g", "u")) == 60
+
+    clock.now = 59.9
+    assert ("g", "u") in tracker
+    clock.now = 60.0
+    assert not tracker.active(("g", "u"))
+    assert tracker.try_start(("g", "u"), 60) is True
+
+
+def test_expired_keys_are_evicted():
+    clock = FakeClock()
+    tracker = CooldownTracker(clock=clock)
+
+    for user in range(1000):
+        tracker.try_start(("g", user), 30 + user % 3)
+    assert len(tracker) == 1000
+
+    clock.now = 30.5
+    assert len(tracker) == 666  # 30 秒的那批已過期
+    clock.now = 40.0
+    assert len(tracker) == 0
+    assert tracker._expiry == []
+
+
+def test_zero_cooldown_never_blocks_or_stores():
+    tracker = CooldownTracker(clock=FakeClock())
+    assert tracker.try_start("k", 0) is True
+    assert tracker.try_start("k", 0) is True
+    assert len(tracker) == 0
@@ -0,0 +1,567 @@
+import asyncio
+import logging
+import random
+from datetime import datetime
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from market import (
+    BarStore,
+    Prefetcher,
+    ResolutionCache,
+    RollingStats,
+    RollingStatsBook,
+    SessionTTLPolicy,
+    SingleFlight,
+    SymbolNotFound,
+    TTLCache,
+    ThrottledEditor,
+    exchange_for,
+    gather_bounded,
+    normalize_query,
+    parse_holidays,
+)
+from market.yahoo import chart_url, parse_chart, parse_search, range_for
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_gather_bounded_runs_concurrently_within_limit():
+    active = 0
+    peak = 0
+
+    async def worker(key):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return key * 2
+
+    results, errors = run(gather_bounded([1, 2, 3, 4, 5, 1], worker, limit=2))
+    assert list(results) == [1, 2, 3, 4, 5]
+    assert results[3] == 6
+    assert errors == {}
+    assert peak == 2
+
+
+def test_gather_bounded_reports_timeouts_and_failures_per_key():
+    async def worker(key):
+        if key == "slow":
+            await asyncio.sleep(1)
+        if key == "broken":
+            raise ValueError("upstream")
+        return key
+
+    results, errors = run(
+        gather_bounded(["ok", "slow", "broken"], worker, limit=3, timeout=0.05)
+    )
+    assert results == {"ok": "ok"}
+    assert isinstance(errors["slow"], TimeoutError)
+    assert isinstance(errors["broken"], ValueError)
+
+
+def test_gather_bounded_rejects_non_positive_limit():
+    async def worker(key):
+        return key
+
+    with pytest.raises(ValueError):
+        run(gather_bounded([1], worker, limit=0))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=30, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    cache.set("short", 4, ttl=5)
+    clock.now = 10
+    assert cache.get("short") is None
+    assert cache.get("a") == 1
+    clock.now = 31
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_ttl_cache_peek_serves_stale_entries_within_grace():
+    clock = FakeClock()
+    cache = TTLCache(ttl=30, stale_ttl=60, clock=clock)
+    cache.set("2330.TW", "quote")
+
+    clock.now = 10
+    assert cache.peek("2330.TW") == ("quote", 10, True)
+    clock.now = 45
+    assert cache.get("2330.TW") is None
+    entry = cache.peek("2330.TW")
+    assert entry.value == "quote" and entry.age == 45 and entry.fresh is False
+    clock.now = 90
+    assert cache.peek("2330.TW") is None
+    assert len(cache) == 0
+
+
+def test_resolution_cache_normalizes_queries_and_expires_misses_sooner():
+    clock = FakeClock()
+    cache = ResolutionCache(positive_ttl=600, negative_ttl=60, clock=clock)
+    assert normalize_query("  Taiwan   Semi ") == "taiwan semi"
+
+    assert cache.lookup("nvidia") == (False, None)
+    cache.store("NVIDIA ", "NVDA")
+    cache.store("no such thing", None)
+    assert cache.lookup("nvidia") == (True, "NVDA")
+    assert cache.lookup("No  Such Thing") == (True, None)
+
+    clock.now = 61
+    assert cache.lookup("no such thing") == (False, None)
+    assert cache.lookup("nvidia") == (True, "NVDA")
+
+
+def test_single_flight_shares_one_call_between_concurrent_callers():
+    flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "quote"
+
+    async def scenario():
+        results = await asyncio.gather(*(flight.do("2330.TW", fetch) for _ in range(10)))
+        assert results == ["quote"] * 10
+        assert calls == 1
+        assert flight.coalesced == 9
+        assert len(flight) == 0
+
+        await flight.do("2330.TW", fetch)
+        assert calls == 2
+
+    run(scenario())
+
+
+def test_single_flight_survives_cancelled_caller_and_shares_errors():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        raise ValueError("upstream")
+
+    async def scenario():
+        impatient = asyncio.create_task(flight.do("key", fetch))
+        patient = asyncio.create_task(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        with pytest.raises(ValueError):
+            await patient
+
+    run(scenario())
+
+
+def _bars(*days):
+    return [
+        SimpleNamespace(
+            date=f"2026-01-{day:02d}", open=1.0, high=float(day), low=0.5, close=1.0, volume=10
+        )
+        for day in days
+    ]
+
+
+def test_bar_store_fetches_full_depth_once_then_only_new_bars(tmp_path):
+    now = [1767744000.0]  # 2026-01-07 UTC
+    store = BarStore(str(tmp_path / "bars.db"), depth=5, max_age=60, clock=lambda: now[0])
+    requested = []
+
+    def fetch(count):
+        requested.append(count)
+        return _bars(3, 5, 6, 7)[-count:]
+
+    try:
+        bars = store.sync("2330.TW", fetch)
+        assert requested == [5]
+        assert [bar.date for bar in bars] == ["2026-01-03", "2026-01-05", "2026-01-06", "2026-01-07"]
+
+        assert store.sync("2330.TW", fetch) == bars
+        assert requested == [5]  # 仍在 max_age 內，只讀本機
+
+        now[0] += 60
+        store.sync("2330.TW", fetch)
+        assert requested == [5, 2]  # 只補最後一筆之後（含重抓最後一筆）
+    finally:
+        store.close()
+
+
+def test_bar_store_serves_stored_bars_when_upstream_fails(tmp_path, caplog):
+    now = [1767744000.0]
+    store = BarStore(str(tmp_path / "bars.db"), depth=5, max_age=0, clock=lambda: now[0])
+
+    def broken(_count):
+        raise RuntimeError("upstream down")
+
+    try:
+        with pytest.raises(RuntimeError):
+            store.sync("AAPL", broken)
+        store.upsert("AAPL", _bars(6, 7))
+        with caplog.at_level(logging.WARNING, logger="discord_stockbot.bars"):
+            assert [bar.high for bar in store.sync("AAPL", broken)] == [6.0, 7.0]
+        assert "AAPL" in caplog.text and "RuntimeError" in caplog.text
+    finally:
+        store.close()
+
+
+def test_bar_store_keeps_only_the_most_recent_depth_bars(tmp_path):
+    store = BarStore(str(tmp_path / "bars.db"), depth=3)
+    try:
+        store.upsert("AAPL", _bars(1, 2))
+        store.upsert("AAPL", _bars(3, 4, 5))
+        store.upsert("AAPL", _bars(6))
+        store.upsert("MSFT", _bars(1))
+        with store._lock:
+            rows = store._conn().execute(
+                "SELECT symbol, date FROM daily_bars ORDER BY symbol, date"
+            ).fetchall()
+    finally:
+        store.close()
+    assert rows == [
+        ("AAPL", "2026-01-04"), ("AAPL", "2026-01-05"), ("AAPL", "2026-01-06"), ("MSFT", "2026-01-01"),
+    ]
+
+
+def test_rolling_stats_match_full_recomputation():
+    rng = random.Random(7)
+    stats = RollingStats(window=5)
+    history = []
+    for day in range(1, 40):
+        bar = (f"2026-02-{day:02d}", rng.uniform(10, 20), rng.uniform(1, 10), rng.choice([None, 100.0, 250.0]))
+        history.append(bar)
+        assert stats.push(*bar)
+        live = (rng.uniform(10, 20), rng.uniform(1, 10), 300.0)
+
+        window = history[-4:]
+        volumes = [volume for *_, volume in window if volume is not None] + [live[2]]
+        high, low, avg = stats.snapshot(*live)
+        assert high == max([bar[1] for bar in window] + [live[0]])
+        assert low == min([bar[2] for bar in window] + [live[1]])
+        assert avg == pytest.approx(sum(volumes) / len(volumes))
+
+    assert stats.push("2026-02-01", 99.0, 0.1, 1.0) is False
+    assert len(stats) == 4
+
+
+def test_bar_store_async_sync_uses_coroutine_fetch(tmp_path):
+    now = [1767744000.0]
+    store = BarStore(str(tmp_path / "bars.db"), depth=5, max_age=60, clock=lambda: now[0])
+    requested = []
+
+    async def fetch(count):
+        requested.append(count)
+        return _bars(3, 5, 6, 7)[-count:]
+
+    try:
+        bars = run(store.async_sync("2330.TW", fetch))
+        assert [bar.date for bar in bars][-1] == "2026-01-07"
+        assert run(store.async_sync("2330.TW", fetch)) == bars
+        assert requested == [5]
+    finally:
+        store.close()
+
+
+def test_rolling_stats_book_refreshes_only_when_due():
+    clock = FakeClock()
+    book = RollingStatsBook(window=5, refresh_interval=60, clock=clock)
+    loads = []
+
+    def load():
+        loads.append(clock.now)
+        return _bars(5, 6, 7)
+
+    assert book.snapshot("AAPL", load, live_high=1.0, live_low=0.1, live_volume=40) == (
+        6.0, 0.1, 20.0,
+    )
+    book.snapshot("AAPL", load)
+    assert loads == [0.0]
+    clock.now = 60
+    book.snapshot("AAPL", load)
+    assert loads == [0.0, 60]
+
+    def broken():
+        raise RuntimeError("upstream down")
+
+    assert book.snapshot("MSFT", broken, live_high=1.0) == (None, None, None)
+
+
+def test_rolling_stats_book_retries_failed_loads_soon_and_keeps_old_stats():
+    clock = FakeClock()
+    book = RollingStatsBook(window=5, refresh_interval=3600, retry_interval=30, maxsize=2, clock=clock)
+    attempts = []
+
+    def flaky():
+        attempts.append(clock.now)
+        if len(attempts) in (1, 3):
+            raise RuntimeError("upstream down")
+        return _bars(5, 6, 7)
+
+    assert book.snapshot("AAPL", flaky) == (None, None, None)
+    book.snapshot("AAPL", flaky)
+    assert attempts == [0.0]  # 失敗後不立刻重打上游
+    clock.now = 30
+    assert book.snapshot("AAPL", flaky) == (6.0, 0.5, 10.0)  # 短退避後重試，不必等一小時
+    clock.now = 3630
+    assert book.snapshot("AAPL", flaky) == (6.0, 0.5, 10.0)  # 更新失敗：沿用舊統計
+    assert attempts == [0.0, 30, 3630]
+
+    book.snapshot("MSFT", flaky)
+    book.snapshot("TSLA", flaky)
+    assert len(book) == 2  # 最多保留 maxsize 檔
+
+
+def test_prefetcher_counts_runs_and_failures_and_stops_cleanly():
+    batches = []
+
+    async def refresh(symbols):
+        batches.append(list(symbols))
+        if len(batches) == 2:
+            raise ConnectionError("upstream down")
+        return {"^N225": TimeoutError()}
+
+    async def scenario():
+        prefetcher = Prefetcher(["^GSPC", "^N225", "^GSPC"], refresh, interval=0.01)
+        prefetcher.start()
+        while prefetcher.runs < 3:
+            await asyncio.sleep(0.005)
+        await prefetcher.stop()
+        assert not prefetcher.is_running()
+        return prefetcher.stats()
+
+    stats = run(scenario())
+    assert batches[0] == ["^GSPC", "^N225"]
+    assert stats["runs"] >= 3
+    assert stats["failed_runs"] == 1
+    assert stats["symbol_failures"] == stats["runs"] - 1
+    assert stats["last_duration"] is not None
+
+
+def _at(timezone_name, *parts):
+    return datetime(*parts, tzinfo=ZoneInfo(timezone_name)).timestamp()
+
+
+def test_exchange_for_maps_suffixes_and_indices():
+    assert exchange_for("2330.TW").key == "TW"
+    assert exchange_for("6488.TWO").key == "TW"
+    assert exchange_for("^N225").key == "JP"
+    assert exchange_for("^HSI").key == "HK"
+    assert exchange_for("AAPL").key == "US"
+    assert exchange_for("^GSPC").key == "US"
+    assert exchange_for("VOD.L") is None
+    assert exchange_for("BRK-B").key == "US"
+    for symbol in ("BTC-USD", "ETH-USDT", "EURUSD=X", "GC=F", "^FTSE"):
+        assert exchange_for(symbol) is None
+
+
+def test_session_ttl_is_short_in_session_and_lasts_until_next_open():
+    now = [_at("Asia/Taipei", 2026, 10, 16, 10, 0)]  # 週五盤中
+    policy = SessionTTLPolicy(open_ttl=30, open_lead=0, close_grace=0, clock=lambda: now[0])
+    assert policy.is_open("2330.TW")
+    assert policy.ttl("2330.TW") == 30
+
+    now[0] = _at("Asia/Taipei", 2026, 10, 17, 3, 0)  # 週六凌晨 → 下週一 09:00
+    assert not policy.is_open("^N225")
+    assert policy.ttl("2330.TW") == (2 * 24 + 6) * 3600
+    assert policy.ttl("VOD.L") == 30
+
+    capped = SessionTTLPolicy(open_ttl=30, max_closed_ttl=3600, clock=lambda: now[0])
+    assert capped.ttl("2330.TW") == 3600
+
+
+def test_session_ttl_keeps_round_the_clock_markets_short_on_weekends():
+    now = [_at("UTC", 2026, 10, 17, 12, 0)]  # 週六中午，美股休市
+    policy = SessionTTLPolicy(open_ttl=30, clock=lambda: now[0])
+    assert policy.ttl("AAPL") > 24 * 3600
+    assert policy.ttl("BTC-USD") == 30
+    assert policy.ttl("EURUSD=X") == 30
+    assert policy.ttl("GC=F") == 30
+
+    # chart meta 優先於代碼推測
+    policy.learn("XYZ", "CCC", "CRYPTOCURRENCY")
+    assert policy.ttl("xyz") == 30
+    policy.learn("0050.XX", "TAI", "ETF")
+    assert policy.exchange("0050.XX").key == "TW"
+    policy.learn("VOD.L", "LSE", "EQUITY")  # meta 也認不出來：維持代碼推測
+    assert policy.exchange("VOD.L") is None
+
+
+def test_session_ttl_honours_configured_holidays():
+    holidays = parse_holidays("TW:2026-10-19;XX:2026-01-01;US:not-a-date")
+    assert set(holidays) == {"TW"}
+    now = [_at("Asia/Taipei", 2026, 10, 19, 10, 0)]  # 週一但休市 → 週二 09:00
+    policy = SessionTTLPolicy(
+        open_ttl=30, open_lead=0, close_grace=0, holidays=holidays, clock=lambda: now[0]
+    )
+    assert not policy.is_open("2330.TW")
+    assert policy.ttl("2330.TW") == 23 * 3600
+
+
+def _chart_payload(closes, meta=None):
+    base = 1767744000  # 2026-01-07 00:00 UTC
+    stamps = [base + 86400 * i for i in range(len(closes))]
+    return {
+        "chart": {
+            "result": [
+                {
+                    "meta": {
+                        "symbol": "2330.TW",
+                        "currency": "TWD",
+                        "longName": "TSMC",
+                        "gmtoffset": 28800,
+                        "regularMarketPrice": 110.0,
+                        "previousClose": 100.0,
+                        "regularMarketDayHigh": 112.0,
+                        "regularMarketDayLow": 99.0,
+                        "regularMarketVolume": 5000,
+                        **(meta or {}),
+                    },
+                    "timestamp": stamps,
+                    "indicators": {
+                        "quote": [
+                            {
+                                "open": [c and c - 1 for c in closes],
+                                "high": [c and c + 1 for c in closes],
+                                "low": [c and c - 2 for c in closes],
+                                "close": closes,
+                                "volume": [1000] * len(closes),
+                            }
+                        ]
+                    },
+                }
+            ],
+            "error": None,
+        }
+    }
+
+
+def test_parse_chart_builds_quote_and_bars():
+    payload = _chart_payload([101.0, 105.0], meta={"exchangeName": "TAI", "instrumentType": "EQUITY"})
+    payload["chart"]["result"][0]["indicators"]["quote"][0]["open"] = [100.0, 104.0]
+    quote, bars = parse_chart(payload)
+    assert quote.symbol == "2330.TW" and quote.name == "TSMC" and quote.currency == "TWD"
+    assert quote.price == 110.0 and quote.open == 104.0
+    assert quote.change == 10.0 and quote.change_percent == pytest.approx(10.0)
+    assert (quote.high, quote.low, quote.volume) == (112.0, 99.0, 5000)
+    assert quote.extra == {}
+    assert (quote.exchange, quote.instrument_type) == ("TAI", "EQUITY")
+    # 日期以交易所時區（gmtoffset）計算
+    assert [bar.date for bar in bars] == ["2026-01-07", "2026-01-08"]
+    assert bars[-1].close == 105.0
+
+
+def test_parse_chart_skips_empty_rows_and_falls_back_to_chart_previous_close():
+    payload = _chart_payload(
+        [101.0, None, 103.0], meta={"previousClose": None, "chartPreviousClose": 88.0}
+    )
+    quote, bars = parse_chart(payload)
+    assert [bar.close for bar in bars] == [101.0, 103.0]
+    assert quote.change == 22.0
+
+
+def test_parse_chart_raises_symbol_not_found():
+    with pytest.raises(SymbolNotFound):
+        parse_chart({"chart": {"result": None, "error": {"code": "Not Found"}}})
+    with pytest.raises(SymbolNotFound):
+        parse_chart(_chart_payload([1.0], meta={"regularMarketPrice": None}))
+
+
+def test_chart_url_percent_encodes_symbol():
+    assert chart_url("2330.TW").endswith("/chart/2330.TW")
+    assert chart_url("^TWII").endswith("/chart/%5ETWII")
+    assert chart_url("BRK/B").endswith("/chart/BRK%2FB")
+    assert chart_url("../v7").endswith("/chart/..%2Fv7")
+
+
+def test_parse_search_maps_fields_and_limits():
+    payload = {
+        "quotes": [
+            {"symbol": "NVDA", "longname": "NVIDIA Corporation", "exchDisp": "NASDAQ", "quoteType": "EQUITY"},
+            {"shortname": "no symbol"},
+            {"symbol": "NVD.F", "shortname": "NVIDIA", "exchange": "FRA"},
+        ]
+    }
+    matches = parse_search(payload, limit=5)
+    assert [(m.symbol, m.name, m.exchange) for m in matches] == [
+        ("NVDA", "NVIDIA Corporation", "NASDAQ"),
+        ("NVD.F", "NVIDIA", "FRA"),
+    ]
+    assert len(parse_search(payload, limit=1)) == 1
+
+
+def test_range_for_picks_smallest_covering_range():
+    assert range_for(1) == "1d"
+    assert range_for(2) == "5d"
+    assert range_for(63) == "3mo"
+    assert range_for(1000) == "1y"
+
+
+def _fake_sleep(clock):
+    async def sleep(seconds):
+        clock.now += seconds
+        await asyncio.sleep(0)
+
+    return sleep
+
+
+def test_throttled_editor_coalesces_requests_within_interval():
+    clock = FakeClock()
+    edits = []
+    state = {"value": 0}
+
+    async def edit():
+        edits.append((clock.now, state["value"]))
+
+    async def scenario():
+        editor = ThrottledEditor(edit, min_interval=1.0, clock=clock, sleep=_fake_sleep(clock))
+        editor.touch()  # 占位訊息剛送出
+        for value in range(1, 4):
+            state["value"] = value
+            editor.request()
+        await editor.flush()
+        state["value"] = 4
+        editor.request()
+        await editor.flush()
+        return editor.edits
+
+    assert run(scenario()) == 2
+    # 三次請求合併成一次（畫最新狀態），兩次編輯間隔至少 1 秒
+    assert edits == [(1.0, 3), (2.0, 4)]
+
+
+def test_throttled_editor_flush_retries_failed_final_edit():
+    clock = FakeClock()
+    attempts = []
+
+    async def edit():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise RuntimeError("rate limited")
+
+    async def scenario():
+        editor = ThrottledEditor(edit, min_interval=1.0, clock=clock, sleep=_fake_sleep(clock))
+        editor.request()
+        await editor.flush()
+        return editor.edits
+
+    assert run(scenario()) == 1
+    assert attempts == [0.0, 1.0]
@@ -0,0 +1,127 @@
+import asyncio
+import random
+
+import database
+from ranking import GuildRankIndex, RankBook, SkipList
+from storage import XPAward
+from storage.sqlite import SQLiteStorage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(7)
+    skip = SkipList(rng.random)
+    expected = []
+    for _ in range(2000):
+        key = rng.randrange(500)
+        if key in expected and rng.random() < 0.5:
+            skip.remove(key)
+            expected.remove(key)
+        elif key not in expected:
+            skip.insert(key)
+            expected.append(key)
+        expected.sort()
+        probe = rng.randrange(-5, 505)
+        assert skip.bisect_left(probe) == sum(1 for value in expected if value < probe)
+    assert len(skip) == len(expected)
+    assert list(skip.iter_from()) == expected
+    assert list(skip.iter_from(250)) == [value for value in expected if value > 250]
+
+
+def test_skip_list_bulk_build_supports_updates():
+    rng = random.Random(11)
+    keys = sorted(rng.sample(range(10000), 500))
+    skip = SkipList.from_sorted(keys, rng.random)
+    assert list(skip.iter_from()) == keys
+    assert skip.bisect_left(keys[100]) == 100
+    skip.remove(keys[0])
+    skip.insert(-1)
+    skip.insert(20000)
+    expected = sorted([-1, 20000] + keys[1:])
+    assert list(skip.iter_from()) == expected
+    assert all(skip.bisect_left(key) == position for position, key in enumerate(expected))
+
+
+def test_guild_rank_index_matches_sql_rank_semantics():
+    rng = random.Random(3)
+    index = GuildRankIndex(rng.random)
+    xp = {}
+    for _ in range(3000):
+        user = f"user-{rng.randrange(300)}"
+        xp[user] = xp.get(user, 0) + rng.randrange(0, 30)
+        index.update(user, xp[user], user.upper())
+
+    for user, value in xp.items():
+        # 與 SQL 的 COUNT(xp > 我) + 1 相同：同分同名次
+        assert index.rank(user) == sum(1 for other in xp.values() if other > value) + 1
+
+    top = index.top(10)
+    assert [row["xp"] for row in top] == sorted(xp.values(), reverse=True)[:10]
+    assert top[0]["username"] == top[0]["user_id"].upper()
+    after = (top[4]["xp"], top[4]["user_id"])
+    assert index.top(5, after=after) == top[5:10]
+    assert index.rank("nobody") is None
+
+
+def test_rank_index_ignores_stale_smaller_xp():
+    index = GuildRankIndex()
+    index.update("a", 100, "A")
+    index.update("a", 40)
+    assert index.top(1) == [{"user_id": "a", "username": "A", "xp": 100, "level": 2}]
+
+
+def test_rank_book_replays_writes_made_during_load_and_expires():
+    clock = FakeClock()
+    book = RankBook(ttl=60, clock=clock)
+    book.apply("g", "a", 999)  # 尚未載入：略過
+    book.begin_load("g")
+    book.apply("g", "b", 50, "B")  # 載入查詢進行中寫入
+    index = book.load("g", [{"user_id": "a", "username": "A", "xp": 10}, {"user_id": "b", "username": "B", "xp": 20}])
+    assert index.rank("b") == 1
+    assert book.get("g") is index
+    clock.now = 60
+    assert book.get("g") is None
+
+
+def test_database_serves_rank_and_leaderboard_from_index(tmp_path):
+    class CountingStorage(SQLiteStorage):
+        loads = 0
+
+        async def get_guild_levels(self, guild_id):
+            CountingStorage.loads += 1
+            return await super().get_guild_levels(guild_id)
+
+    async def scenario():
+        await database.initialize(CountingStorage(str(tmp_path / "rank.db")))
+        try:
+            await database.add_xp("g", "a", "A", 50)
+            await database.add_xp("g", "b", "B", 80)
+            ranks = await asyncio.gather(
+                database.get_user_rank("g", "a"), database.get_user_rank("g", "b")
+            )
+            assert ranks == [2, 1]
+            assert CountingStorage.loads == 1
+
+            await database.add_xp_many([XPAward("g", "a", "A2", 100, 1)])
+            assert await database.get_user_rank("g", "a") == 1
+            leaders = await database.get_leaderboard("g", 10)
+            assert [(row["user_id"], row["xp"], row["username"]) for row in leaders] == [
+                ("a", 150, "A2"),
+                ("b", 80, "B"),
+            ]
+            assert CountingStorage.loads == 1
+        finally:
+            await database.close()
+
+    run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+
+import database
+from rewards import LevelReward, RewardMap
+from storage.sqlite import SQLiteStorage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_reward_map_lookups():
+    rewards = RewardMap(
+        [
+            {"level": 10, "role_id": "r10", "role_name": "Ten"},
+            {"level": 5, "role_id": 5, "role_name": "Five"},
+            {"level": 20, "role_id": "r20", "role_name": None},
+        ]
+    )
+
+    assert [reward.level for reward in rewards] == [5, 10, 20]
+    assert rewards.get(10) == LevelReward(10, "r10", "Ten")
+    assert rewards.get(11) is None
+    assert rewards.get(1) is None
+    assert [reward.level for reward in rewards.earned(19)] == [5, 10]
+    assert rewards.earned(4) == ()
+    assert [reward.role_id for reward in rewards.missing(25, {"5", "r20"})] == ["r10"]
+    assert rewards.role_ids() == frozenset({"5", "r10", "r20"})
+    assert not RewardMap()
+
+
+def test_database_caches_reward_map_and_refreshes_on_writes(tmp_path):
+    class CountingStorage(SQLiteStorage):
+        reads = 0
+
+        async def get_all_level_rewards(self, guild_id):
+            CountingStorage.reads += 1
+            return await super().get_all_level_rewards(guild_id)
+
+    async def scenario():
+        await database.initialize(CountingStorage(str(tmp_path / "rewards.db")))
+        try:
+            assert await database.get_level_reward("g", 5) is None
+            await database.add_level_reward("g", 5, "r5", "Five")
+            await database.add_level_reward("g", 10, "r10", "Ten")
+            reads = CountingStorage.reads
+
+            first = await database.get_reward_map("g")
+            assert await database.get_reward_map("g") is first
+            assert (await database.get_level_reward("g", 5))["role_id"] == "r5"
+            assert [row["level"] for row in await database.get_all_level_rewards("g")] == [5, 10]
+            assert CountingStorage.reads == reads
+
+            assert await database.remove_level_reward("g", 5) is True
+            assert [reward.level for reward in await database.get_reward_map("g")] == [10]
+            assert [reward.level for reward in first] == [5, 10]
+        finally:
+            await database.close()
+
+    run(scenario())
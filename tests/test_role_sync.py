@@ -0,0 +1,144 @@
+import asyncio
+
+import database
+from rewards import RewardMap
+from role_sync import RoleSync
+from storage import RoleSyncProgress, calculate_level
+from storage.sqlite import SQLiteStorage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+REWARDS = RewardMap(
+    [{"level": 2, "role_id": "r2", "role_name": "Two"}, {"level": 4, "role_id": "r4", "role_name": "Four"}]
+)
+
+
+def members():
+    # level 4, 4, 3, 2, 2, 1, 1
+    return {"a": 950, "b": 900, "c": 500, "d": 150, "e": 100, "f": 50, "g": 0}
+
+
+def fetcher(xp, calls):
+    """Reads the live ``xp`` dict on every call, like the storage query."""
+
+    async def fetch_page(min_level, after_user_id, limit):
+        calls.append((min_level, after_user_id))
+        rows = (
+            {"user_id": u, "xp": x, "level": calculate_level(x)}
+            for u, x in sorted(xp.items())
+            if calculate_level(x) >= min_level and (after_user_id is None or u > after_user_id)
+        )
+        return list(rows)[:limit]
+
+    return fetch_page
+
+
+def test_sync_grants_cumulative_missing_roles_at_a_limited_rate():
+    clock = FakeClock()
+    held = {"a": {"r2", "r4"}, "b": {"r2"}, "c": set(), "d": set(), "e": {"r2"}}
+    granted, saved, calls = [], [], []
+
+    async def grant(user_id, missing):
+        granted.append((user_id, [reward.role_id for reward in missing]))
+
+    async def save(progress):
+        saved.append(progress)
+
+    job = RoleSync(
+        REWARDS, fetcher(members(), calls), held.get, grant, save,
+        chunk_size=2, grant_interval=0.5, clock=clock, sleep=clock.sleep,
+    )
+    progress = run(job.run())
+
+    assert granted == [("b", ["r4"]), ("c", ["r2"]), ("d", ["r2"])]
+    assert clock.sleeps == [0.5, 0.5]
+    assert progress.done and progress.scanned == 5 and progress.granted == 3
+    # only members at the lowest reward level or above are read, in user_id order
+    assert calls == [(2, None), (2, "b"), (2, "d")]
+    assert [p.cursor_user_id for p in saved] == ["b", "d", "e"]
+
+
+def test_sync_resumes_from_saved_cursor_and_skips_departed_members():
+    granted = []
+
+    async def grant(user_id, missing):
+        granted.append(user_id)
+
+    async def save(progress):
+        pass
+
+    held = {"c": set(), "d": set()}
+    resume = RoleSyncProgress(cursor_user_id="b", scanned=2, granted=1)
+    job = RoleSync(REWARDS, fetcher(members(), []), held.get, grant, save, progress=resume, grant_interval=0)
+    progress = run(job.run())
+
+    assert granted == ["c", "d"]
+    assert progress.scanned == 5 and progress.skipped == 1 and progress.granted == 3
+
+
+def test_sync_reaches_members_whose_xp_rises_past_the_cursor():
+    xp = members()
+    granted = []
+
+    async def grant(user_id, missing):
+        granted.append((user_id, [reward.role_id for reward in missing]))
+        if user_id == "b":
+            # f climbs above everyone already scanned while the job is running
+            xp["f"] = 1000
+
+    async def save(progress):
+        pass
+
+    held = {u: set() for u in "abcdef"}
+    held["a"] = {"r2", "r4"}
+    job = RoleSync(REWARDS, fetcher(xp, []), held.get, grant, save, chunk_size=2, grant_interval=0)
+    progress = run(job.run())
+
+    assert ("f", ["r2", "r4"]) in granted
+    assert progress.done and progress.scanned == 6
+
+
+def test_sync_counts_failed_grants_and_keeps_going():
+    async def grant(user_id, missing):
+        if user_id == "c":
+            raise RuntimeError("forbidden")
+
+    async def save(progress):
+        pass
+
+    held = {u: set() for u in "abcde"}
+    progress = run(RoleSync(REWARDS, fetcher(members(), []), held.get, grant, save, grant_interval=0).run())
+    assert progress.failed == 1 and progress.granted == 6 and progress.done
+
+
+def test_role_sync_progress_round_trips_through_sqlite(tmp_path):
+    async def scenario():
+        await database.initialize(SQLiteStorage(str(tmp_path / "sync.db")))
+        try:
+            assert await database.get_role_sync_progress("g") is None
+            await database.save_role_sync_progress("g", RoleSyncProgress("b", 2, 1))
+            first = await database.get_role_sync_progress("g")
+            await database.save_role_sync_progress("g", first._replace(scanned=5, done=True))
+            return first, await database.get_role_sync_progress("g")
+        finally:
+            await database.close()
+
+    first, second = run(scenario())
+    assert first == RoleSyncProgress("b", 2, 1, 0, 0, False)
+    assert second == RoleSyncProgress("b", 5, 1, 0, 0, True)
@@ -1,9 +1,13 @@
 import asyncio
+import logging
+import time
 
 import pytest
 
 import database
+from storage import RoleSyncProgress, XPAward
 from storage.factory import create_storage
+from storage.memory import InMemoryStorage
 from storage.postgres import PostgresStorage
 from storage.sqlite import SQLiteStorage
 
@@ -17,6 +21,68 @@ def test_factory_uses_sqlite_without_database_url(tmp_path):
     assert isinstance(storage, SQLiteStorage)
 
 
+def test_factory_configures_sqlite_readers_and_pragmas(tmp_path):
+    storage = create_storage(
+        {"DB_PATH": str(tmp_path / "local.db"), "SQLITE_READERS": "2", "SQLITE_MMAP_SIZE": "0"}
+    )
+    assert storage._reader_count == 2
+    assert storage._pragmas["mmap_size"] == "0"
+    assert storage._pragmas["synchronous"] == "NORMAL"
+
+
+def test_sqlite_rejects_unknown_or_unsafe_pragmas(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteStorage(str(tmp_path / "x.db"), pragmas={"journal_mode": "DELETE"})
+    with pytest.raises(ValueError):
+        SQLiteStorage(str(tmp_path / "x.db"), pragmas={"cache_size": "1; DROP TABLE user_levels"})
+
+
+def test_sqlite_reads_do_not_wait_for_the_writer(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "pool.db"), readers=2, pragmas={"busy_timeout": 100})
+        await storage.initialize()
+        try:
+            await storage.add_xp("guild", "user", "name", 120)
+            async with storage._lock:
+                # A write transaction is open on the writer connection.
+                await storage._conn().execute("BEGIN IMMEDIATE")
+                await storage._conn().execute("UPDATE user_levels SET xp = 999")
+                reads = await asyncio.wait_for(
+                    asyncio.gather(
+                        storage.get_user_level("guild", "user"),
+                        storage.get_leaderboard("guild"),
+                        storage.get_user_rank("guild", "user"),
+                    ),
+                    timeout=2,
+                )
+                await storage._conn().rollback()
+
+            async with storage._read() as reader:
+                with pytest.raises(Exception):
+                    await reader.execute("DELETE FROM user_levels")
+                cursor = await reader.execute("PRAGMA synchronous")
+                synchronous = (await cursor.fetchone())[0]
+            return reads, synchronous
+        finally:
+            await storage.close()
+
+    (level, leaders, rank), synchronous = run(scenario())
+    assert level["xp"] == 120
+    assert [row["xp"] for row in leaders] == [120]
+    assert rank == 1
+    assert synchronous == 1  # NORMAL
+
+
+def test_factory_selects_memory_backend():
+    storage = create_storage({"STORAGE_BACKEND": "memory", "DATABASE_URL": "postgresql://placeholder.invalid/x"})
+    assert isinstance(storage, InMemoryStorage)
+    assert storage.snapshot_path is None
+    with pytest.raises(RuntimeError, match="durable"):
+        create_storage({"STORAGE_BACKEND": "memory", "REQUIRE_DURABLE_STORAGE": "1"})
+    with pytest.raises(ValueError):
+        create_storage({"STORAGE_BACKEND": "redis"})
+
+
 def test_factory_uses_postgres_without_exposing_url():
     marker = "postgresql://placeholder.invalid/test"
     storage = create_storage({"DATABASE_URL": marker})
@@ -65,9 +131,13 @@ def test_postgres_initialize_closes_pool_when_schema_setup_fails(monkeypatch):
     assert pool.closed is True
     assert storage._pool is None
 
-def test_sqlite_contract_and_concurrent_xp(tmp_path):
+@pytest.mark.parametrize("backend", ["sqlite", "memory"])
+def test_storage_contract_and_concurrent_xp(tmp_path, backend):
     async def scenario():
-        storage = SQLiteStorage(str(tmp_path / "contract.db"))
+        if backend == "sqlite":
+            storage = SQLiteStorage(str(tmp_path / "contract.db"))
+        else:
+            storage = InMemoryStorage()
         await storage.initialize()
         try:
             settings = await storage.get_guild_settings("guild-1")
@@ -96,6 +166,16 @@ def test_sqlite_contract_and_concurrent_xp(tmp_path):
             leaders = await storage.get_leaderboard("guild-1")
             assert [row["user_id"] for row in leaders] == ["user-1"]
 
+            for user_id, xp in (("user-4", 300), ("user-3", 0), ("user-2", 120)):
+                await storage.add_xp("guild-1", user_id, user_id, xp)
+            page = await storage.get_members_from_level("guild-1", 2, None, 2)
+            assert page == [
+                {"user_id": "user-1", "xp": 100, "level": 2},
+                {"user_id": "user-2", "xp": 120, "level": 2},
+            ]
+            page = await storage.get_members_from_level("guild-1", 2, "user-2", 2)
+            assert [row["user_id"] for row in page] == ["user-4"]
+
             await storage.add_level_reward("guild-1", 2, "role-1", "Example Role")
             reward = await storage.get_level_reward("guild-1", 2)
             assert reward["role_id"] == "role-1"
@@ -113,6 +193,122 @@ def test_sqlite_contract_and_concurrent_xp(tmp_path):
     run(scenario())
 
 
+def test_sqlite_add_xp_many_batches_upserts(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "batch.db"))
+        await storage.initialize()
+        try:
+            await storage.add_xp("guild-1", "user-1", "Old Name", 90)
+            results = await storage.add_xp_many(
+                [
+                    XPAward("guild-1", "user-1", "New Name", 5, 1),
+                    XPAward("guild-1", "user-2", "Second", 40, 2),
+                    XPAward("guild-1", "user-1", "New Name", 5, 1),
+                ]
+            )
+            assert results == {
+                ("guild-1", "user-1"): (2, 100, True),
+                ("guild-1", "user-2"): (1, 40, False),
+            }
+            user = await storage.get_user_level("guild-1", "user-1")
+            assert (user["xp"], user["level"], user["total_messages"]) == (100, 2, 3)
+            assert user["username"] == "New Name"
+            second = await storage.get_user_level("guild-1", "user-2")
+            assert (second["xp"], second["total_messages"]) == (40, 2)
+            assert await storage.add_xp_many([]) == {}
+        finally:
+            await storage.close()
+
+    run(scenario())
+
+
+def test_postgres_add_xp_many_sends_one_unnest_statement():
+    class FakePool:
+        def __init__(self):
+            self.calls = []
+
+        async def fetch(self, query, *args):
+            self.calls.append((query, args))
+            return [
+                {"guild_id": "g", "user_id": "a", "xp": 100, "level": 2},
+                {"guild_id": "g", "user_id": "b", "xp": 30, "level": 1},
+            ]
+
+    storage = PostgresStorage("postgresql://placeholder.invalid/test")
+    storage._pool = FakePool()
+    results = run(
+        storage.add_xp_many(
+            [XPAward("g", "a", "A", 20, 2), XPAward("g", "b", "B", 30, 1)]
+        )
+    )
+
+    assert len(storage._pool.calls) == 1
+    query, args = storage._pool.calls[0]
+    assert "UNNEST" in query
+    assert args[:5] == (["g", "g"], ["a", "b"], ["A", "B"], [20, 30], [2, 1])
+    assert results == {("g", "a"): (2, 100, True), ("g", "b"): (1, 30, False)}
+
+
+def test_sqlite_claim_xp_cooldown_is_atomic_and_durable(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "cooldown.db")
+        storage = SQLiteStorage(path)
+        await storage.initialize()
+        try:
+            claims = await asyncio.gather(
+                *[storage.claim_xp_cooldown("g", "u", "User", 60) for _ in range(10)]
+            )
+            assert claims.count(True) == 1
+            row = await storage.get_user_level("g", "u")
+            assert (row["xp"], row["total_messages"]) == (0, 0)
+            assert row["last_xp_time"] is not None
+
+            assert isinstance(row["last_xp_time"], float)
+
+            # 沒帶發言時間的批次寫入不會把冷卻起點往後推；帶了就取較晚者
+            await storage.add_xp_many([XPAward("g", "u", "User", 20, 1)])
+            assert (await storage.get_user_level("g", "u"))["last_xp_time"] == row["last_xp_time"]
+            await storage.add_xp_many([XPAward("g", "u", "User", 5, 1, row["last_xp_time"] - 30)])
+            assert (await storage.get_user_level("g", "u"))["last_xp_time"] == row["last_xp_time"]
+            assert await storage.claim_xp_cooldown("g", "u", "User", 0) is True
+            claimed_at = (await storage.get_user_level("g", "u"))["last_xp_time"]
+            await storage.add_xp_many([XPAward("g", "u", "User", 5, 1, claimed_at + 30)])
+            assert (await storage.get_user_level("g", "u"))["last_xp_time"] == claimed_at + 30
+        finally:
+            await storage.close()
+
+        # 重新啟動後冷卻仍然有效
+        restarted = SQLiteStorage(path)
+        await restarted.initialize()
+        try:
+            assert await restarted.claim_xp_cooldown("g", "u", "User", 60) is False
+        finally:
+            await restarted.close()
+
+    run(scenario())
+
+
+def test_postgres_claim_xp_cooldown_uses_conditional_upsert():
+    class FakePool:
+        def __init__(self, result):
+            self.result = result
+            self.calls = []
+
+        async def fetchval(self, query, *args):
+            self.calls.append((query, args))
+            return self.result
+
+    storage = PostgresStorage("postgresql://placeholder.invalid/test")
+    storage._pool = FakePool(1)
+    assert run(storage.claim_xp_cooldown("g", "u", "User", 60)) is True
+    query, args = storage._pool.calls[0]
+    assert "WHERE u.last_xp_time IS NULL" in query
+    assert args == ("g", "u", "User", 60.0)
+
+    storage._pool = FakePool(None)
+    assert run(storage.claim_xp_cooldown("g", "u", "User", 60)) is False
+
+
 def test_database_facade_lifecycle(tmp_path):
     async def scenario():
         storage = SQLiteStorage(str(tmp_path / "facade.db"))
@@ -125,3 +321,604 @@ def test_database_facade_lifecycle(tmp_path):
             await database.close()
 
     run(scenario())
+
+
+def test_database_caches_guild_settings_until_updated(tmp_path, monkeypatch):
+    class CountingStorage(SQLiteStorage):
+        reads = 0
+
+        async def get_guild_settings(self, guild_id):
+            CountingStorage.reads += 1
+            return await super().get_guild_settings(guild_id)
+
+    now = [0.0]
+    monkeypatch.setattr(database, "_clock", lambda: now[0])
+    monkeypatch.setattr(database, "SETTINGS_CACHE_TTL", 60.0)
+
+    async def scenario():
+        await database.initialize(CountingStorage(str(tmp_path / "settings.db")))
+        try:
+            for _ in range(5):
+                settings = await database.get_guild_settings("guild")
+            assert CountingStorage.reads == 1
+            settings["xp_per_message"] = 999  # 呼叫端改不到快取
+            assert (await database.get_guild_settings("guild"))["xp_per_message"] == 15
+
+            await database.update_guild_settings("guild", xp_per_message=30)
+            assert (await database.get_guild_settings("guild"))["xp_per_message"] == 30
+            assert CountingStorage.reads == 2
+
+            now[0] = 61.0
+            await database.get_guild_settings("guild")
+            assert CountingStorage.reads == 3
+
+            database.invalidate_guild_settings("guild")
+            await database.get_guild_settings("guild")
+            assert CountingStorage.reads == 4
+        finally:
+            await database.close()
+
+    run(scenario())
+
+
+def test_postgres_settings_updates_notify_and_listener_invalidates(monkeypatch):
+    class FakePool:
+        def __init__(self):
+            self.queries = []
+
+        async def execute(self, query, *args):
+            self.queries.append(query)
+
+        async def close(self):
+            pass
+
+    class FakeListener:
+        def __init__(self):
+            self.handlers = {}
+            self.closed = False
+
+        async def add_listener(self, channel, handler):
+            self.handlers[channel] = handler
+
+        def add_termination_listener(self, handler):
+            pass
+
+        async def close(self):
+            self.closed = True
+
+    listener = FakeListener()
+
+    async def fake_connect(**_kwargs):
+        return listener
+
+    monkeypatch.setattr("storage.postgres.asyncpg.connect", fake_connect)
+    pool = FakePool()
+    storage = PostgresStorage("postgresql://placeholder.invalid/test")
+    storage._pool = pool
+    invalidated = []
+
+    async def scenario():
+        await storage.update_guild_settings("guild", xp_cooldown=10)
+        await storage.listen_settings_changes(invalidated.append)
+        listener.handlers["guild_settings_changed"](None, 1, "guild_settings_changed", "guild")
+        await storage.close()
+
+    run(scenario())
+    assert "pg_notify('guild_settings_changed', guild_id)" in pool.queries[0]
+    assert invalidated == ["guild"]
+    assert listener.closed is True
+
+
+def test_postgres_settings_listener_reconnects_and_invalidates_everything(monkeypatch):
+    class FakeListener:
+        def __init__(self):
+            self.handlers = {}
+            self.on_terminate = None
+            self.closed = False
+
+        async def add_listener(self, channel, handler):
+            self.handlers[channel] = handler
+
+        def add_termination_listener(self, handler):
+            self.on_terminate = handler
+
+        async def close(self):
+            self.closed = True
+            self.on_terminate(self)
+
+    listeners = []
+    attempts = []
+
+    async def fake_connect(**_kwargs):
+        attempts.append(len(listeners))
+        if len(attempts) == 2:
+            raise OSError("connection refused")
+        listeners.append(FakeListener())
+        return listeners[-1]
+
+    monkeypatch.setattr("storage.postgres.asyncpg.connect", fake_connect)
+    storage = PostgresStorage("postgresql://placeholder.invalid/test")
+    storage.listener_retry_delay = 0
+    invalidated = []
+
+    async def scenario():
+        await storage.listen_settings_changes(invalidated.append)
+        first = listeners[0]
+        first.on_terminate(first)  # server restart / network drop
+        while storage._listener is None:
+            await asyncio.sleep(0)
+        second = listeners[1]
+        second.handlers["guild_settings_changed"](None, 1, "guild_settings_changed", "guild")
+        await storage.close()
+        await asyncio.sleep(0)
+        return second
+
+    second = run(scenario())
+    assert len(attempts) == 3  # one failed reconnect, then success
+    assert invalidated == [None, "guild"]
+    assert second.closed and len(listeners) == 2  # closing does not reconnect
+
+
+def test_sqlite_migrations_apply_once_and_index_leaderboard(tmp_path):
+    from storage import migrations
+
+    async def scenario():
+        path = tmp_path / "bot.db"
+        storage = SQLiteStorage(str(path))
+        await storage.initialize()
+        await storage.close()
+        storage = SQLiteStorage(str(path))
+        await storage.initialize()
+        conn = storage._connection
+        cursor = await conn.execute("SELECT version FROM schema_migrations")
+        versions = [row[0] for row in await cursor.fetchall()]
+        cursor = await conn.execute(
+            "EXPLAIN QUERY PLAN SELECT user_id FROM user_levels "
+            "WHERE guild_id = ? ORDER BY xp DESC LIMIT 10",
+            ("guild",),
+        )
+        plan = " ".join(str(row[-1]) for row in await cursor.fetchall())
+        await storage.close()
+        return versions, plan
+
+    versions, plan = run(scenario())
+    assert versions == [m.version for m in migrations.MIGRATIONS]
+    assert "idx_user_levels_guild_xp" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_postgres_concurrent_migrations_run_outside_transaction_after_startup(caplog):
+    from storage import migrations
+
+    class FakeConnection:
+        def __init__(self):
+            self.queries = []
+            self.in_transaction = False
+            self.applied = set()
+            self.lock_busy = 0
+
+        def transaction(self):
+            conn = self
+
+            class Transaction:
+                async def __aenter__(self):
+                    conn.in_transaction = True
+
+                async def __aexit__(self, *exc):
+                    conn.in_transaction = False
+                    return False
+
+            return Transaction()
+
+        async def execute(self, query, *args):
+            self.queries.append((query, self.in_transaction))
+            if query.startswith("INSERT INTO schema_migrations"):
+                self.applied.add(args[0])
+
+        async def fetch(self, query, *args):
+            return [{"version": v} for v in self.applied]
+
+        async def fetchval(self, query, *args):
+            if "pg_try_advisory_lock" in query:
+                if self.lock_busy:
+                    self.lock_busy -= 1
+                    return False
+                return True
+            if "FROM schema_migrations" in query:
+                return 1 if args[0] in self.applied else None
+            return None
+
+    class AcquireContext:
+        def __init__(self, conn):
+            self.conn = conn
+
+        async def __aenter__(self):
+            return self.conn
+
+        async def __aexit__(self, *exc):
+            return False
+
+    class FakePool:
+        def __init__(self):
+            self.conn = FakeConnection()
+
+        def acquire(self):
+            return AcquireContext(self.conn)
+
+        async def close(self):
+            pass
+
+    async def scenario():
+        pool = FakePool()
+        deferred = await migrations.apply_postgres(pool.conn)
+        assert [m.version for m in deferred] == [1]
+        assert pool.conn.applied == {m.version for m in migrations.MIGRATIONS if not m.concurrent}
+        # another process holds the lock twice; the build waits instead of giving up
+        pool.conn.lock_busy = 2
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+
+        done = await migrations.apply_postgres_concurrent(pool, deferred, sleep=sleep)
+        assert done == [1]
+        assert sleeps == [5.0, 10.0]
+        assert await migrations.apply_postgres_concurrent(pool, deferred) == []
+        return pool.conn.queries
+
+    with caplog.at_level(logging.WARNING, logger="discord_stockbot.storage"):
+        queries = run(scenario())
+    assert sum("deferring 1 concurrent step" in r.getMessage() for r in caplog.records) == 2
+    concurrent = [(q, tx) for q, tx in queries if "CONCURRENTLY" in q]
+    assert len(concurrent) == 1
+    assert concurrent[0][1] is False
+
+
+def test_postgres_add_xp_is_one_statement_returning_old_level():
+    class FakePool:
+        def __init__(self):
+            self.calls = []
+
+        async def fetchrow(self, query, *args):
+            self.calls.append((query, args))
+            return {"xp": 410, "level": 3, "old_level": 2}
+
+        def acquire(self):
+            raise AssertionError("add_xp should not hold a pooled connection")
+
+    pool = FakePool()
+    storage = PostgresStorage("postgresql://placeholder.invalid/test")
+    storage._pool = pool
+
+    assert run(storage.add_xp("guild", "user", "name", 15)) == (3, 410, True)
+    assert len(pool.calls) == 1
+    query, args = pool.calls[0]
+    assert "ON CONFLICT (guild_id, user_id) DO UPDATE" in query
+    assert "AS old_level" in query
+    assert args[:4] == ("guild", "user", "name", 15)
+
+
+def test_sqlite_leaderboard_keyset_pages_match_index_order(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "pages.db"))
+        await database.initialize(storage)
+        try:
+            xp = [500, 300, 300, 300, 120, 120, 40]
+            await storage.add_xp_many(
+                XPAward("guild", f"user-{i}", f"name-{i}", amount) for i, amount in enumerate(xp)
+            )
+            await storage.add_xp("other", "user-x", "other", 900)
+
+            pages = [await storage.get_leaderboard("guild", 3)]
+            while pages[-1]:
+                last = pages[-1][-1]
+                pages.append(await storage.get_leaderboard_after("guild", last["xp"], last["user_id"], 3))
+            walked = [(row["xp"], row["user_id"]) for page in pages for row in page]
+
+            last = pages[0][-1]
+            from_index = await database.get_leaderboard_after("guild", last["xp"], last["user_id"], 10)
+            return walked, [(row["xp"], row["user_id"]) for row in from_index]
+        finally:
+            await database.close()
+
+    walked, from_index = run(scenario())
+    expected = sorted(((amount, f"user-{i}") for i, amount in enumerate([500, 300, 300, 300, 120, 120, 40])),
+                      key=lambda item: (-item[0], item[1]))
+    assert walked == expected
+    assert from_index == expected[3:]
+
+
+def test_sqlite_bulk_reads_and_welcome_logs(tmp_path, monkeypatch):
+    from storage import WelcomeLog
+
+    monkeypatch.setattr("storage.sqlite.SQLITE_BATCH_KEYS", 3)
+
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "bulk.db"))
+        await storage.initialize()
+        try:
+            await storage.add_xp_many(XPAward("g", f"u{i}", f"n{i}", 10 * i) for i in range(1, 8))
+            await storage.update_guild_settings("g1", xp_cooldown=5)
+            levels = await storage.get_user_levels_many(
+                [("g", f"u{i}") for i in range(10)] + [("g", "u1"), ("other", "u1")]
+            )
+            settings = await storage.get_guild_settings_many(["g1", "g2", "g3", "g4", "g1"])
+            again = await storage.get_guild_settings_many(["g2"])
+            await storage.log_welcome_many(WelcomeLog("g", f"u{i}", f"n{i}") for i in range(5))
+            await storage.log_welcome_many([])
+            cursor = await storage._conn().execute("SELECT COUNT(*) FROM welcome_logs")
+            welcomed = (await cursor.fetchone())[0]
+            return levels, settings, again, welcomed
+        finally:
+            await storage.close()
+
+    levels, settings, again, welcomed = run(scenario())
+    assert sorted(levels) == [("g", f"u{i}") for i in range(1, 8)]
+    assert levels[("g", "u3")]["xp"] == 30
+    assert sorted(settings) == ["g1", "g2", "g3", "g4"]
+    assert settings["g1"]["xp_cooldown"] == 5
+    assert settings["g2"]["xp_per_message"] == 15
+    assert again["g2"] == settings["g2"]
+    assert welcomed == 5
+
+
+def test_postgres_bulk_methods_use_one_command_each():
+    from storage import WelcomeLog
+
+    class FakePool:
+        def __init__(self):
+            self.calls = []
+
+        async def fetch(self, query, *args):
+            self.calls.append(("fetch", query, args))
+            if "INSERT INTO guild_settings" in query:
+                return [{"guild_id": guild_id, "xp_cooldown": 60} for guild_id in args[0]]
+            if "FROM guild_settings" in query:
+                return [{"guild_id": "g1", "xp_cooldown": 5}]
+            return [{"guild_id": "g", "user_id": "u1", "xp": 10}]
+
+        async def copy_records_to_table(self, table, *, records, columns):
+            self.calls.append(("copy", table, records, columns))
+
+    pool = FakePool()
+    storage = PostgresStorage("postgresql://placeholder.invalid/test")
+    storage._pool = pool
+
+    async def scenario():
+        levels = await storage.get_user_levels_many([("g", "u1"), ("g", "u2"), ("g", "u1")])
+        settings = await storage.get_guild_settings_many(["g1", "g2"])
+        await storage.log_welcome_many([WelcomeLog("g", "u1", "n1"), WelcomeLog("g", "u2", "n2")])
+        return levels, settings
+
+    levels, settings = run(scenario())
+    assert levels == {("g", "u1"): {"guild_id": "g", "user_id": "u1", "xp": 10}}
+    assert pool.calls[0][2] == (["g", "g"], ["u1", "u2"])
+    assert settings["g1"]["xp_cooldown"] == 5 and settings["g2"]["xp_cooldown"] == 60
+    assert pool.calls[2][2] == (["g2"],)
+    assert pool.calls[3] == (
+        "copy", "welcome_logs", [("g", "u1", "n1"), ("g", "u2", "n2")], ["guild_id", "user_id", "username"]
+    )
+
+
+def test_memory_storage_matches_sqlite_rankings_and_pages(tmp_path):
+    awards = [XPAward("g", f"u{i % 13}", f"n{i % 13}", (i * 37) % 90) for i in range(60)]
+    awards.append(XPAward("g", "tie-b", "b", 300))
+    awards.append(XPAward("g", "tie-a", "a", 300))
+
+    async def collect(storage):
+        await storage.initialize()
+        try:
+            await storage.add_xp_many(awards[:30])
+            for award in awards[30:]:
+                await storage.add_xp(award.guild_id, award.user_id, award.username, award.xp)
+            pages = [await storage.get_leaderboard("g", 4)]
+            while pages[-1]:
+                last = pages[-1][-1]
+                pages.append(await storage.get_leaderboard_after("g", last["xp"], last["user_id"], 4))
+            order = [(row["user_id"], row["xp"], row["level"], row["total_messages"]) for page in pages for row in page]
+            ranks = {user: await storage.get_user_rank("g", user) for user, *_ in order}
+            levels = await storage.get_user_levels_many([("g", "u1"), ("g", "missing")])
+            return order, ranks, {key: row["xp"] for key, row in levels.items()}
+        finally:
+            await storage.close()
+
+    expected = run(collect(SQLiteStorage(str(tmp_path / "parity.db"))))
+    assert run(collect(InMemoryStorage())) == expected
+
+
+def test_memory_storage_cooldown_and_snapshot_round_trip(tmp_path):
+    from storage import WelcomeLog
+
+    path = tmp_path / "snap" / "memory.json"
+
+    async def first_run():
+        storage = InMemoryStorage(str(path))
+        await storage.initialize()
+        assert await storage.claim_xp_cooldown("g", "u", "name", 60) is True
+        assert await storage.claim_xp_cooldown("g", "u", "name", 60) is False
+        assert await storage.claim_xp_cooldown("g", "u", "name", 0) is True
+        await storage.add_xp_many([XPAward("g", "u", "name", 250, 3), XPAward("g", "v", "other", 40)])
+        await storage.update_guild_settings("g", xp_cooldown=5, bogus=1)
+        await storage.add_level_reward("g", 2, "role", "Role")
+        await storage.save_role_sync_progress("g", RoleSyncProgress("u", 1, 1))
+        await storage.log_welcome_many([WelcomeLog("g", "w", "new")])
+        await storage.close()
+
+    async def second_run():
+        storage = InMemoryStorage(str(path))
+        await storage.initialize()
+        try:
+            return (
+                await storage.get_user_level("g", "u"),
+                await storage.get_user_rank("g", "v"),
+                await storage.get_guild_settings("g"),
+                await storage.get_all_level_rewards("g"),
+                await storage.get_role_sync_progress("g"),
+                len(storage._welcome_logs),
+            )
+        finally:
+            await storage.close()
+
+    run(first_run())
+    assert path.exists() and not path.with_name("memory.json.tmp").exists()
+    user, rank, settings, rewards, progress, welcomed = run(second_run())
+    assert (user["xp"], user["level"], user["total_messages"]) == (250, 2, 3)
+    assert user["last_xp_time"] is not None
+    assert rank == 2
+    assert settings["xp_cooldown"] == 5 and "bogus" not in settings
+    assert [(row["level"], row["role_id"]) for row in rewards] == [(2, "role")]
+    assert progress == RoleSyncProgress("u", 1, 1)
+    assert welcomed == 1
+
+
+def test_memory_storage_reads_do_not_create_guilds(tmp_path):
+    import json
+
+    path = tmp_path / "memory.json"
+
+    async def scenario():
+        storage = InMemoryStorage(str(path))
+        await storage.initialize()
+        await storage.add_xp("active", "u", "User", 10)
+        for guild_id in ("ghost-1", "ghost-2"):
+            assert await storage.get_user_level(guild_id, "u") is None
+            assert await storage.get_leaderboard(guild_id) == []
+            assert await storage.get_user_rank(guild_id, "u") == 1
+            assert await storage.get_all_level_rewards(guild_id) == []
+            assert await storage.get_role_sync_progress(guild_id) is None
+            assert (await storage.get_guild_settings(guild_id))["xp_cooldown"] == 60
+        await storage.log_welcome("ghost-3", "u", "User")
+        await storage.close()
+
+    run(scenario())
+    assert list(json.loads(path.read_text("utf-8"))["guilds"]) == ["active"]
+
+
+def test_sqlite_migrates_iso_last_xp_time_to_epoch_seconds(tmp_path):
+    import sqlite3
+
+    path = tmp_path / "legacy.db"
+
+    async def create():
+        storage = SQLiteStorage(str(path))
+        await storage.initialize()
+        await storage.add_xp("g", "u", "User", 10)
+        await storage.close()
+
+    run(create())
+    legacy = sqlite3.connect(path)
+    legacy.execute("UPDATE user_levels SET last_xp_time = '2024-01-01T00:00:00.500000+00:00'")
+    legacy.execute("DELETE FROM schema_migrations WHERE version = 3")
+    legacy.commit()
+    legacy.close()
+
+    async def reopen():
+        storage = SQLiteStorage(str(path))
+        await storage.initialize()
+        try:
+            row = await storage.get_user_level("g", "u")
+            # A cooldown from 2024 has long expired: compared numerically.
+            return row["last_xp_time"], await storage.claim_xp_cooldown("g", "u", "User", 60)
+        finally:
+            await storage.close()
+
+    last, claimed = run(reopen())
+    assert last == pytest.approx(1704067200.5)
+    assert claimed is True
+
+
+def test_sqlite_migration_restarts_unfinished_leaderboard_order_role_syncs(tmp_path):
+    import sqlite3
+
+    path = tmp_path / "legacy.db"
+
+    async def create():
+        storage = SQLiteStorage(str(path))
+        await storage.initialize()
+        await storage.close()
+
+    run(create())
+    legacy = sqlite3.connect(path)
+    legacy.execute("ALTER TABLE role_sync_progress ADD COLUMN cursor_xp INTEGER")
+    legacy.execute(
+        "INSERT INTO role_sync_progress (guild_id, cursor_xp, cursor_user_id, scanned, done) "
+        "VALUES ('running', 900, 'b', 2, 0), ('finished', 50, 'f', 5, 1)"
+    )
+    legacy.execute("DELETE FROM schema_migrations WHERE version = 4")
+    legacy.commit()
+    legacy.close()
+
+    async def reopen():
+        storage = SQLiteStorage(str(path))
+        await storage.initialize()
+        try:
+            return (
+                await storage.get_role_sync_progress("running"),
+                await storage.get_role_sync_progress("finished"),
+            )
+        finally:
+            await storage.close()
+
+    running, finished = run(reopen())
+    assert running == RoleSyncProgress(None, 2)
+    assert finished == RoleSyncProgress("f", 5, done=True)
+    columns = [row[1] for row in sqlite3.connect(path).execute("PRAGMA table_info(role_sync_progress)")]
+    assert "cursor_xp" not in columns
+
+
+def test_database_skips_per_message_claim_writes_on_single_process_backends(tmp_path):
+    class CountingStorage(SQLiteStorage):
+        claims = 0
+
+        async def claim_xp_cooldown(self, *args):
+            CountingStorage.claims += 1
+            return await super().claim_xp_cooldown(*args)
+
+    path = str(tmp_path / "claims.db")
+
+    async def scenario():
+        await database.initialize(CountingStorage(path))
+        try:
+            assert await database.claim_xp_cooldown("g", "u", "User", 60) is True
+            await database.add_xp_many([XPAward("g", "u", "User", 20, 1, time.time())])
+            assert await database.claim_xp_cooldown("g", "u", "User", 60) is True
+        finally:
+            await database.close()
+        # 重新啟動後，第一次確認會讀到批次寫入的發言時間
+        await database.initialize(CountingStorage(path))
+        try:
+            return await database.claim_xp_cooldown("g", "u", "User", 60)
+        finally:
+            await database.close()
+
+    assert run(scenario()) is False
+    assert CountingStorage.claims == 0
+
+
+def test_database_cooldown_checks_stop_once_the_startup_window_ends(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(database, "_clock", lambda: now[0])
+
+    class CountingStorage(SQLiteStorage):
+        reads = 0
+
+        async def get_user_level(self, *args):
+            CountingStorage.reads += 1
+            return await super().get_user_level(*args)
+
+    async def scenario():
+        await database.initialize(CountingStorage(str(tmp_path / "window.db")))
+        try:
+            for user in ("a", "b", "a"):
+                assert await database.claim_xp_cooldown("g", user, user, 60) is True
+            assert CountingStorage.reads == 2  # once per member
+            assert len(database._cooldown_checked) == 2
+            now[0] += 61  # nothing from before startup can still be cooling down
+            for user in ("a", "c", "d"):
+                assert await database.claim_xp_cooldown("g", user, user, 60) is True
+            assert CountingStorage.reads == 2
+            assert len(database._cooldown_checked) == 0
+        finally:
+            await database.close()
+
+    run(scenario())
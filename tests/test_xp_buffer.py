@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from storage import XPAward
+from storage.sqlite import SQLiteStorage
+from xp_buffer import XPBuffer
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDB:
+    def __init__(self, rows=None):
+        self.rows = dict(rows or {})
+        self.loads = []
+        self.batches = []
+        self.fail = False
+
+    async def load(self, guild_id, user_id):
+        self.loads.append((guild_id, user_id))
+        xp = self.rows.get((guild_id, user_id))
+        return None if xp is None else {"xp": xp}
+
+    async def write(self, awards):
+        if self.fail:
+            raise RuntimeError("db down")
+        self.batches.append(list(awards))
+        results = {}
+        for award in awards:
+            key = (award.guild_id, award.user_id)
+            self.rows[key] = self.rows.get(key, 0) + award.xp
+            results[key] = (0, self.rows[key], False)
+        return results
+
+
+def test_award_detects_level_up_locally_and_loads_once():
+    db = FakeDB({("g", "u"): 90})
+    buffer = XPBuffer(db.load, db.write)
+
+    async def scenario():
+        first = await buffer.award("g", "u", "User", 5)
+        second = await buffer.award("g", "u", "User", 5)
+        return first, second
+
+    first, second = run(scenario())
+    assert first == (1, 95, False)
+    assert second == (2, 100, True)
+    assert db.loads == [("g", "u")]
+    assert db.batches == []  # 尚未寫入
+
+
+def test_flush_merges_deltas_per_member_into_one_batch():
+    db = FakeDB()
+    wall = FakeClock()
+    buffer = XPBuffer(db.load, db.write, wall_clock=wall)
+
+    async def scenario():
+        for second in (100.0, 160.0, 220.0):
+            wall.now = second
+            await buffer.award("g", "a", "A", 10)
+        await buffer.award("g", "b", "B", 7)
+        written = await buffer.flush()
+        assert await buffer.flush() == 0
+        return written
+
+    assert run(scenario()) == 2
+    # last_xp_time 是最後一則發言的時間，隨批次一起寫入
+    assert db.batches == [[XPAward("g", "a", "A", 30, 3, 220.0), XPAward("g", "b", "B", 7, 1, 220.0)]]
+    assert len(buffer) == 0
+
+
+def test_failed_flush_keeps_deltas_for_retry():
+    db = FakeDB()
+    wall = FakeClock()
+    buffer = XPBuffer(db.load, db.write, wall_clock=wall)
+
+    async def scenario():
+        wall.now = 10.0
+        await buffer.award("g", "a", "A", 10)
+        db.fail = True
+        with pytest.raises(RuntimeError):
+            await buffer.flush()
+        wall.now = 75.0
+        await buffer.award("g", "a", "A", 5)
+        db.fail = False
+        await buffer.flush()
+
+    run(scenario())
+    assert buffer.failed_flushes == 1
+    assert db.batches == [[XPAward("g", "a", "A", 15, 2, 75.0)]]
+    assert db.rows[("g", "a")] == 15
+
+
+def test_flush_reconciles_view_with_database_and_evicts_idle_members():
+    clock = FakeClock()
+    db = FakeDB()
+    buffer = XPBuffer(db.load, db.write, idle_ttl=60, clock=clock)
+
+    async def scenario():
+        await buffer.award("g", "a", "A", 10)
+        db.rows[("g", "a")] = 500  # 其他行程寫入
+        await buffer.flush()
+        level, xp, _ = await buffer.award("g", "a", "A", 1)
+        assert xp == 511 and level == 3
+        clock.now = 120
+        await buffer.flush()
+        await buffer.award("g", "a", "A", 1)
+
+    run(scenario())
+    assert db.loads == [("g", "a"), ("g", "a")]  # 閒置後被移出視圖，重新讀取
+
+
+def test_stop_drains_pending_awards_to_storage(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(str(tmp_path / "buffer.db"))
+        await storage.initialize()
+        try:
+            buffer = XPBuffer(storage.get_user_level, storage.add_xp_many, interval=3600)
+            buffer.start()
+            for _ in range(4):
+                await buffer.award("g", "u", "User", 25)
+            await buffer.stop()
+            return await storage.get_user_level("g", "u")
+        finally:
+            await storage.close()
+
+    row = run(scenario())
+    assert row["xp"] == 100
+    assert row["level"] == 2
+    assert row["total_messages"] == 4
@@ -0,0 +1,160 @@
+"""
+經驗值寫入緩衝（write-behind），不相依 discord，方便單元測試。
+
+每則訊息的 XP 先套用到記憶體中的本機視圖，升級判定當下就完成；同一成員
+累積的增量每 interval 秒合併成一批，以一次 add_xp_many 寫進資料庫。
+寫入失敗時增量放回緩衝，下個週期重試；stop() 會把剩下的增量寫完。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from storage import XPAward, calculate_level, merge_xp_awards
+
+logger = logging.getLogger("discord_stockbot.xp_buffer")
+
+Key = Tuple[str, str]
+LoadFn = Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]]
+WriteFn = Callable[[List[XPAward]], Awaitable[Dict[Key, Tuple[int, int, bool]]]]
+
+
+class _Member:
+    __slots__ = ("xp", "touched_at")
+
+    def __init__(self, xp: int, touched_at: float) -> None:
+        self.xp = xp
+        self.touched_at = touched_at
+
+
+class XPBuffer:
+    """
+    XP 累積器。
+
+    load(guild_id, user_id) 用於成員第一次出現時讀取資料庫中的 XP（之後以
+    本機視圖為準）；write(awards) 為批次寫入，回傳寫入後的 (level, xp, leveled)。
+    每次寫入後以資料庫回傳值校正本機視圖，其他行程的寫入也會反映進來。
+    超過 idle_ttl 秒沒有新訊息、也沒有待寫增量的成員會從視圖移除。
+    """
+
+    def __init__(
+        self,
+        load: LoadFn,
+        write: WriteFn,
+        interval: float = 10.0,
+        idle_ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.interval = interval
+        self.idle_ttl = idle_ttl
+        self._load = load
+        self._write = write
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._view: Dict[Key, _Member] = {}
+        self._pending: Dict[Key, XPAward] = {}
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def award(
+        self, guild_id: str, user_id: str, username: str, xp_amount: int
+    ) -> Tuple[int, int, bool]:
+        """加 XP 並回傳 (new_level, new_xp, leveled_up)，語意與 add_xp 相同。"""
+        key = (guild_id, user_id)
+        member = self._view.get(key)
+        if member is None:
+            row = await self._load(guild_id, user_id)
+            loaded = _Member(int(row["xp"]) if row else 0, self._clock())
+            member = self._view.setdefault(key, loaded)
+
+        old_level = calculate_level(member.xp)
+        member.xp += xp_amount
+        member.touched_at = self._clock()
+        # 發言時間隨批次寫入 last_xp_time（單一行程的後端靠它在重啟後延續冷卻）
+        now = self._wall_clock()
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = XPAward(guild_id, user_id, username, xp_amount, 1, now)
+        else:
+            self._pending[key] = pending._replace(
+                username=username, xp=pending.xp + xp_amount, messages=pending.messages + 1,
+                last_xp_time=now,
+            )
+        new_level = calculate_level(member.xp)
+        return new_level, member.xp, new_level > old_level
+
+    async def flush(self) -> int:
+        """把目前累積的增量一次寫入；回傳寫入的成員數。失敗時增量放回並拋出例外。"""
+        async with self._flush_lock:
+            if not self._pending:
+                self._evict_idle()
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                results = await self._write(list(batch.values()))
+            except BaseException:
+                self.failed_flushes += 1
+                self._restore(batch)
+                raise
+            self.flushes += 1
+            for key, (_, db_xp, _) in results.items():
+                member = self._view.get(key)
+                if member is not None:
+                    newer = self._pending.get(key)
+                    member.xp = db_xp + (newer.xp if newer else 0)
+            self._evict_idle()
+            return len(batch)
+
+    def _restore(self, batch: Dict[Key, XPAward]) -> None:
+        for key, award in batch.items():
+            newer = self._pending.get(key)
+            if newer is not None:
+                award = merge_xp_awards([award, newer])[0]
+            self._pending[key] = award
+
+    def _evict_idle(self) -> None:
+        cutoff = self._clock() - self.idle_ttl
+        idle = [
+            key
+            for key, member in self._view.items()
+            if member.touched_at < cutoff and key not in self._pending
+        ]
+        for key in idle:
+            del self._view[key]
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        """停止週期寫入，並把剩下的增量寫完。"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception as exc:
+            logger.error(
+                "關機前寫入 XP 失敗（%s），%d 位成員的增量未寫入", type(exc).__name__, len(self)
+            )
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as exc:
+                logger.warning("XP 批次寫入失敗（%s），下個週期重試", type(exc).__name__)